@@ -1,7 +1,28 @@
 """Upload files to online mirroring services."""
-from mirror_up.mirror_ace import MirrorAceConnection  # noqa
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from mirror_up._pool import MirrorAcePool  # noqa
+    from mirror_up._transport import TransportConfig  # noqa
+    from mirror_up._utils import BufferPool  # noqa
+    from mirror_up.mirror_ace import MirrorAceConnection  # noqa
 
 __author__ = """Mycsina"""
 __email__ = "mycsina@protonmail.com"
 __version__ = "0.1.6"
 APP_NAME = "mirror-up"
+
+# Name -> module it comes from, imported on first access so the CLI starts without httpx and anyio
+_LAZY = {
+    "BufferPool": "mirror_up._utils",
+    "MirrorAceConnection": "mirror_up.mirror_ace",
+    "MirrorAcePool": "mirror_up._pool",
+    "TransportConfig": "mirror_up._transport",
+}
+
+
+def __getattr__(name: str) -> object:
+    if name in _LAZY:
+        return getattr(import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
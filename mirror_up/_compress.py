@@ -0,0 +1,178 @@
+"""Block-parallel compression of uploads, skipping content that is already compressed."""
+import mimetypes
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from importlib.util import find_spec
+from os import PathLike
+from typing import BinaryIO, Callable, List, Optional
+
+from mirror_up._utils import read_into
+
+# Size of the blocks compressed independently, and concurrently, on the process pool
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Codec -> extension added to the upload's name
+EXTENSIONS = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz", "zstd": ".zst"}
+
+# Leading bytes of compressed formats and of media that is compressed already
+SIGNATURES = (
+    b"\x1f\x8b",  # gzip
+    b"BZh",  # bzip2
+    b"\xfd7zXZ\x00",  # xz
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"PK\x03\x04",  # zip, and the formats built on it
+    b"7z\xbc\xaf\x27\x1c",  # 7z
+    b"Rar!\x1a\x07",  # rar
+    b"\x89PNG",  # png
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",  # gif
+    b"OggS",  # ogg
+    b"fLaC",  # flac
+    b"ID3",  # mp3
+    b"\x1a\x45\xdf\xa3",  # matroska, webm
+)
+
+# Types whose files are compressed, or not worth compressing
+COMPRESSED_TYPES = ("image/", "video/", "audio/")
+COMPRESSED_SUBTYPES = ("zip", "gzip", "x-7z-compressed", "vnd.rar", "x-rar-compressed", "x-xz", "x-bzip2", "zstd")
+
+
+def available_codecs() -> List[str]:
+    """Codecs usable in this environment, zstd needs the zstandard package."""
+    return [codec for codec in EXTENSIONS if codec != "zstd" or find_spec("zstandard") is not None]
+
+
+def is_compressed(file_path: PathLike, sniff: bool = True) -> bool:
+    """
+    Check if a file is compressed already, going by its name and then by its first bytes.
+
+    Args:
+        file_path: PathLike = Path of the file
+        sniff: bool = Also look at the first bytes, rather than the name alone
+    """
+    file_type, encoding = mimetypes.guess_type(str(file_path))
+    if encoding is not None:
+        return True
+    if file_type is not None and (
+        file_type.startswith(COMPRESSED_TYPES) or file_type.split("/")[1] in COMPRESSED_SUBTYPES
+    ):
+        return True
+    if not sniff:
+        return False
+    with open(file_path, "rb") as f:
+        head = f.read(16)
+    # Containers based on RIFF and ISO BMFF put their signature after a length
+    return head.startswith(SIGNATURES) or head[8:12] == b"WEBP" or head[4:8] == b"ftyp"
+
+
+def _compressor(codec: str, level: Optional[int]) -> Callable[[bytes], bytes]:
+    # Codecs are only imported once used, zstandard being optional
+    if codec == "gzip":
+        import gzip
+
+        # No timestamp, so the same content always compresses to the same bytes
+        return lambda data: gzip.compress(data, 6 if level is None else level, mtime=0)
+    if codec == "bz2":
+        import bz2
+
+        return lambda data: bz2.compress(data, 9 if level is None else level)
+    if codec == "xz":
+        import lzma
+
+        return lambda data: lzma.compress(data, preset=level)
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression needs the zstandard package") from None
+
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def compress_block(codec: str, level: Optional[int], block: bytes) -> bytes:
+    """Compress a block into a complete stream of the codec."""
+    return _compressor(codec, level)(block)
+
+
+def compress_stream(
+    source: BinaryIO,
+    size: int,
+    target: BinaryIO,
+    codec: str,
+    level: Optional[int] = None,
+    workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    acquire: Callable[[int, bool], Optional[bytearray]] = lambda size, wait: bytearray(size),
+    release: Callable[[bytearray], None] = lambda buffer: None,
+) -> int:
+    """
+    Compress the next size bytes of source into target, compressing blocks of BLOCK_SIZE on a process pool.
+
+    Each block becomes a complete stream of its own. Every codec reads concatenated streams back as one,
+    so the result decompresses like a file compressed in a single pass. Blocks are read into buffers taken
+    with acquire, which are only given back to release once their compressed bytes have been written,
+    so they also stand for those bytes. Once blocks are in flight, no more are read ahead while acquire has
+    no room for another.
+
+    Args:
+        source: BinaryIO = Readable file object, positioned at the start of the content
+        size: int = Number of bytes to compress
+        target: BinaryIO = Writable file object receiving the compressed bytes
+        codec: str = One of EXTENSIONS
+        level: Optional[int] = Compression level, the codec's default if None
+        workers: Optional[int] = Number of processes, os.cpu_count() if None, twice as many blocks are read ahead
+        executor: Optional[Executor] = Pool the blocks are compressed on, one of workers processes is started
+            for the call if None
+        acquire: Callable[[int, bool], Optional[bytearray]] = Takes a buffer of the given size, waiting for room
+            if the flag is set, else giving None when there is none
+        release: Callable[[bytearray], None] = Gives a buffer taken with acquire back
+
+    Returns:
+        int = Number of compressed bytes written
+    """
+    _compressor(codec, level)
+    if size <= BLOCK_SIZE:
+        # Not worth going through the processes for
+        buffer = acquire(BLOCK_SIZE, True)
+        try:
+            return target.write(compress_block(codec, level, _read_block(source, buffer, size)))
+        finally:
+            release(buffer)
+    workers = workers or os.cpu_count() or 1
+    if executor is None:
+        with ProcessPoolExecutor(workers) as executor:
+            return compress_stream(source, size, target, codec, level, workers, executor, acquire, release)
+    written = 0
+    pending: List = []
+    remaining = size
+    try:
+        while remaining or pending:
+            # Keep every process busy, without reading far ahead of what has been written
+            while remaining and len(pending) < workers * 2:
+                buffer = acquire(BLOCK_SIZE, not pending)
+                if buffer is None:
+                    break
+                pending.append((buffer, None))
+                block = _read_block(source, buffer, min(BLOCK_SIZE, remaining))
+                remaining -= len(block)
+                pending[-1] = (buffer, executor.submit(compress_block, codec, level, block))
+            buffer, future = pending[0]
+            written += target.write(future.result())
+            pending.pop(0)
+            release(buffer)
+    finally:
+        # Failed part way, whatever is still compressing is thrown away
+        for buffer, future in pending:
+            if future is not None:
+                future.cancel()
+            release(buffer)
+    return written
+
+
+def _read_block(source: BinaryIO, buffer: bytearray, size: int) -> bytearray:
+    """Read exactly size bytes of source into buffer, returning them without a copy when they fill it."""
+    if len(read_into(source, buffer, size)) < size:
+        raise EOFError(f"Expected {size} more bytes")
+    # Sent to the process pool, a slice of the buffer is pickled the same as the whole of it would be
+    return buffer if size == len(buffer) else buffer[:size]
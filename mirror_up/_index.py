@@ -0,0 +1,97 @@
+"""Local indexes of uploaded content, used to skip uploading the same bytes twice and to find packed files."""
+import json
+import sqlite3
+import time
+from os import PathLike
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from mirror_up._utils import user_cache_dir
+
+
+class DedupIndex:
+    """
+    SQLite index mapping a file's content hash and size to the server's response to its upload.
+
+    Args:
+        index_path: Optional[PathLike] = Where the index is kept, defaults to the user cache dir
+    """
+
+    def __init__(self, index_path: Optional[PathLike] = None) -> None:  # noqa
+        self.path = Path(index_path) if index_path is not None else user_cache_dir() / "index.sqlite3"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                "digest TEXT NOT NULL, size INTEGER NOT NULL, response TEXT NOT NULL, uploaded REAL NOT NULL, "
+                "PRIMARY KEY (digest, size))"
+            )
+
+    def lookup(self, digest: str, size: int) -> Union[dict, list, None]:
+        """Server response of an earlier upload of the same content, a list of them for multi-volume uploads."""
+        row = self._db.execute("SELECT response FROM uploads WHERE digest = ? AND size = ?", (digest, size)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def add(self, digest: str, size: int, response: Union[dict, list]) -> None:
+        """Record the server response of an upload."""
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)", (digest, size, json.dumps(response), time.time())
+            )
+
+    def remove(self, digest: str, size: int) -> None:
+        """Forget content whose upload no longer exists."""
+        with self._db:
+            self._db.execute("DELETE FROM uploads WHERE digest = ? AND size = ?", (digest, size))
+
+    def close(self) -> None:  # noqa: D102
+        self._db.close()
+
+
+class BundleIndex:
+    """
+    SQLite index mapping each file packed into a bundle to the bundle's slug and the file's offset within it.
+
+    Args:
+        index_path: Optional[PathLike] = Where the index is kept, defaults to the user cache dir
+    """
+
+    def __init__(self, index_path: Optional[PathLike] = None) -> None:  # noqa
+        self.path = Path(index_path) if index_path is not None else user_cache_dir() / "index.sqlite3"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS packed ("
+                "path TEXT PRIMARY KEY, slug TEXT NOT NULL, bundle TEXT NOT NULL, "
+                "offset INTEGER NOT NULL, size INTEGER NOT NULL, uploaded REAL NOT NULL)"
+            )
+
+    def lookup(self, file_path: PathLike) -> Optional[dict]:
+        """Slug and name of the bundle a file was packed into, with the offset and size of its content."""
+        row = self._db.execute(
+            "SELECT slug, bundle, offset, size FROM packed WHERE path = ?", (str(Path(file_path).resolve()),)
+        ).fetchone()
+        return dict(zip(("slug", "bundle", "offset", "size"), row)) if row is not None else None
+
+    def add(self, slug: str, bundle: str, files: List[Tuple[PathLike, int, int]]) -> None:
+        """
+        Record the files packed into an uploaded bundle.
+
+        Args:
+            slug: str = Slug of the bundle
+            bundle: str = Name of the bundle
+            files: List[Tuple[PathLike, int, int]] = Path, offset within the bundle and size of each file
+        """
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO packed VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (str(Path(file_path).resolve()), slug, bundle, offset, size, time.time())
+                    for file_path, offset, size in files
+                ],
+            )
+
+    def close(self) -> None:  # noqa: D102
+        self._db.close()
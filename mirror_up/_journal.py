@@ -0,0 +1,106 @@
+"""On-disk journal of upload progress, used to resume interrupted uploads."""
+import json
+import logging
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Optional
+
+from mirror_up._session import is_fresh
+from mirror_up._utils import atomic_write, user_cache_dir
+
+# Entries untouched for this many seconds are dropped
+JOURNAL_TTL = 7 * 24 * 3600
+
+
+class UploadJournal:
+    """
+    Record of the chunks and multi-volume parts acknowledged by the server, for each file being uploaded.
+
+    Files are identified by path, size and modification time, so a file changed since its last attempt
+    always starts over. Chunks are tracked per upload name, together with the session they were sent with,
+    since resuming a chunked upload requires the same upload key, and the account that started it, since
+    upload keys only hold for the account they were handed to.
+
+    Args:
+        journal_path: Optional[PathLike] = Where the journal is kept, defaults to the user cache dir
+    """
+
+    def __init__(self, journal_path: Optional[PathLike] = None) -> None:  # noqa
+        self.path = Path(journal_path) if journal_path is not None else user_cache_dir() / "journal.json"
+        try:
+            entries = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            entries = {}
+        self._entries: Dict[str, dict] = {
+            key: entry for key, entry in entries.items() if entry["updated"] + JOURNAL_TTL > time.time()
+        }
+
+    @staticmethod
+    def key(file_path: PathLike, size: int, mtime: int) -> str:
+        """Journal key of a file."""
+        return f"{Path(file_path).resolve()}:{size}:{mtime}"
+
+    def resume_session(self, key: str, name: str, account: Optional[str] = None) -> Optional[dict]:
+        """Session an unfinished chunked upload was started with, if the account can still use it to resume it."""
+        upload = self._entries.get(key, {}).get("uploads", {}).get(name)
+        if upload is None or not upload["ranges"] or not is_fresh(upload["session"]):
+            return None
+        if upload.get("account") != account:
+            return None
+        return upload["session"]
+
+    def acknowledged(self, key: str, name: str, range_start: int, range_end: int) -> bool:
+        """Check if the server has already acknowledged a byte range of an upload."""
+        upload = self._entries.get(key, {}).get("uploads", {}).get(name, {"ranges": []})
+        return any(start <= range_start and range_end <= end for start, end in upload["ranges"])
+
+    def part(self, key: str, name: str) -> Optional[dict]:
+        """Server response of an already uploaded multi-volume part."""
+        return self._entries.get(key, {}).get("parts", {}).get(name)
+
+    def start(self, key: str, name: str, session: dict, account: Optional[str] = None) -> None:
+        """Start tracking a chunked upload from scratch, under the session of an account."""
+        self._entry(key)["uploads"][name] = {"session": session, "ranges": [], "account": account}
+        self._save()
+
+    def acknowledge(self, key: str, name: str, range_start: int, range_end: int) -> None:
+        """Record a byte range the server has acknowledged."""
+        upload = self._entry(key)["uploads"].setdefault(name, {"session": {}, "ranges": []})
+        ranges = sorted(upload["ranges"] + [[range_start, range_end]])
+        # Merge contiguous ranges, so finished uploads shrink back to a single one
+        merged = [ranges[0]]
+        for start, end in ranges[1:]:
+            if start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        upload["ranges"] = merged
+        self._save()
+
+    def finish_part(self, key: str, name: str, response: dict) -> None:
+        """Record an uploaded multi-volume part, with the server's response."""
+        entry = self._entry(key)
+        entry["uploads"].pop(name, None)
+        entry["parts"][name] = response
+        self._save()
+
+    def finish(self, key: str) -> None:
+        """Forget a file whose upload has completed."""
+        if self._entries.pop(key, None) is not None:
+            self._save()
+
+    def discard(self, key: str) -> None:
+        """Forget any progress of a file, so its upload starts over."""
+        self.finish(key)
+
+    def _entry(self, key: str) -> dict:
+        entry = self._entries.setdefault(key, {"uploads": {}, "parts": {}})
+        entry["updated"] = time.time()
+        return entry
+
+    def _save(self) -> None:
+        try:
+            atomic_write(self.path, json.dumps(self._entries))
+        except OSError as e:
+            logging.warning(f"[W] Couldn't save upload journal: {e}")
@@ -0,0 +1,138 @@
+"""Per-folder manifest of synced files, used to upload only what changed since the last sync."""
+import hashlib
+import json
+import logging
+import os
+from fnmatch import fnmatch
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from mirror_up._utils import atomic_write, user_cache_dir
+
+
+def scan_tree(
+    root: PathLike,
+    recursive: bool = True,
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Walk a folder with os.scandir, yielding the files to sync.
+
+    Patterns are matched against both the path relative to root, with forward slashes, and the bare name.
+    Excluded folders aren't descended into, and symlinked folders are never followed.
+
+    Args:
+        root: PathLike = Folder being synced
+        recursive: bool = Also walk subfolders
+        include: Optional[List[str]] = Only files matching one of these globs are synced, all of them if empty
+        exclude: Optional[List[str]] = Files and folders matching any of these globs are skipped
+
+    Yields:
+        Tuple[str, os.stat_result] = Relative path and stat of each file
+    """
+    include, exclude = include or [], exclude or []
+
+    def _matches(rel_path: str, name: str, patterns: List[str]) -> bool:
+        return any(fnmatch(rel_path, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+    pending = [""]
+    while pending:
+        prefix = pending.pop()
+        try:
+            entries = os.scandir(os.path.join(root, prefix))
+        except OSError as e:
+            logging.warning(f"[W] Can't scan {os.path.join(root, prefix)}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                rel_path = f"{prefix}{entry.name}"
+                if _matches(rel_path, entry.name, exclude):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            pending.append(f"{rel_path}/")
+                    elif entry.is_file() and (not include or _matches(rel_path, entry.name, include)):
+                        yield rel_path, entry.stat()
+                except OSError as e:
+                    logging.warning(f"[W] Can't stat {entry.path}: {e}")
+
+
+class SyncManifest:
+    """
+    Size, modification time, inode and resulting slugs of every file uploaded from a folder.
+
+    A file is uploaded again whenever any of its size, mtime_ns or inode differ from the manifest's,
+    so a rescan only costs a stat of each file.
+
+    Args:
+        root: PathLike = Folder the manifest belongs to
+        manifest_path: Optional[PathLike] = Where the manifest is kept, defaults to the user cache dir
+    """
+
+    def __init__(self, root: PathLike, manifest_path: Optional[PathLike] = None) -> None:  # noqa
+        self.root = Path(root).resolve()
+        if manifest_path is None:
+            folder_key = hashlib.sha256(str(self.root).encode()).hexdigest()[:32]
+            manifest_path = user_cache_dir() / "manifests" / f"{folder_key}.json"
+        self.path = Path(manifest_path)
+        try:
+            self._entries: Dict[str, dict] = json.loads(self.path.read_text())["files"]
+        except (OSError, ValueError, KeyError):
+            self._entries = {}
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._entries)
+
+    def __contains__(self, rel_path: str) -> bool:  # noqa: D105
+        return rel_path in self._entries
+
+    def changed(self, rel_path: str, stat: os.stat_result) -> bool:
+        """Check if a file is new or differs from when it was last uploaded."""
+        entry = self._entries.get(rel_path)
+        return entry is None or (entry["size"], entry["mtime_ns"], entry["inode"]) != (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        )
+
+    def slugs(self, rel_path: str) -> List[str]:
+        """Slugs a file was uploaded as, several for multi-volume uploads."""
+        return self._entries[rel_path]["slugs"]
+
+    def record(self, rel_path: str, stat: os.stat_result, slugs: List[str]) -> None:
+        """Record an uploaded file."""
+        self._entries[rel_path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "inode": stat.st_ino,
+            "slugs": slugs,
+        }
+
+    def prune(self, rel_paths: List[str]) -> List[str]:
+        """
+        Forget files that are no longer in the folder.
+
+        Only files missing from the scan are checked, and kept if they still exist, since a scan with
+        other globs or without recursion doesn't see every file of the manifest.
+
+        Args:
+            rel_paths: List[str] = Every file found by the latest scan
+
+        Returns:
+            List[str] = Files that were forgotten
+        """
+        unseen = set(self._entries).difference(rel_paths)
+        gone = [rel_path for rel_path in unseen if not self.root.joinpath(rel_path).is_file()]
+        for rel_path in gone:
+            del self._entries[rel_path]
+        return sorted(gone)
+
+    def save(self) -> None:
+        """Write the manifest to disk."""
+        try:
+            atomic_write(self.path, json.dumps({"root": str(self.root), "files": self._entries}))
+        except OSError as e:
+            logging.warning(f"[W] Couldn't save sync manifest: {e}")
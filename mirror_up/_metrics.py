@@ -0,0 +1,124 @@
+"""Timing spans and counters emitted by uploads, with JSON and Prometheus textfile exports."""
+import json
+import math
+import time
+from contextlib import contextmanager
+from os import PathLike
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+
+class MetricsHook:
+    """
+    Receiver of the spans and counters emitted by uploads, ignoring all of them.
+
+    Subclass it and override the methods of interest to collect them somewhere.
+    Spans are named after the phase they time: handshake, hash, archive, split, compress, read, digest, upload
+    and verify.
+    Counters are bytes_read, bytes_sent, requests, retries, handshakes, session_refreshes and verify_failures.
+    The chunk_seconds observations are the time each chunk took to be acknowledged, retries included.
+    """
+
+    def span_finished(self, name: str, seconds: float) -> None:
+        """Called when a span finishes, with its duration."""
+
+    def count(self, name: str, value: float = 1) -> None:
+        """Called to increase a counter."""
+
+    def observe(self, name: str, value: float) -> None:
+        """Called with a sample of a histogram."""
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the body of a with statement as a span."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.span_finished(name, time.perf_counter() - start)
+
+
+class MetricsRecorder(MetricsHook):
+    """
+    Hook aggregating spans, counters and histograms in memory, to export them once uploads are done.
+
+    Attributes:
+        spans: Dict[str, List[float]] = Count, total and maximum seconds of each span
+        counters: Dict[str, float] = Value of each counter
+        histograms: Dict[str, List[int]] = Samples falling into each of LATENCY_BUCKETS, by histogram
+        sums: Dict[str, float] = Sum of every sample of each histogram
+    """
+
+    def __init__(self) -> None:  # noqa
+        self.spans: Dict[str, List[float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, List[int]] = {}
+        self.sums: Dict[str, float] = {}
+
+    def span_finished(self, name: str, seconds: float) -> None:  # noqa: D102
+        span = self.spans.setdefault(name, [0, 0.0, 0.0])
+        span[0] += 1
+        span[1] += seconds
+        span[2] = max(span[2], seconds)
+
+    def count(self, name: str, value: float = 1) -> None:  # noqa: D102
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:  # noqa: D102
+        buckets = self.histograms.setdefault(name, [0] * len(LATENCY_BUCKETS))
+        buckets[next(i for i, bound in enumerate(LATENCY_BUCKETS) if value <= bound)] += 1
+        self.sums[name] = self.sums.get(name, 0.0) + value
+
+    def summary(self) -> dict:
+        """Everything recorded, as a JSON serializable dict."""
+        return {
+            "spans": {
+                name: {"count": count, "seconds": total, "max_seconds": longest}
+                for name, (count, total, longest) in self.spans.items()
+            },
+            "counters": dict(self.counters),
+            "histograms": {
+                name: {
+                    "buckets": {str(bound): n for bound, n in zip(LATENCY_BUCKETS, buckets)},
+                    "count": sum(buckets),
+                    "sum": self.sums[name],
+                }
+                for name, buckets in self.histograms.items()
+            },
+        }
+
+    def prometheus(self) -> str:
+        """Everything recorded, in the Prometheus text exposition format."""
+        lines = [
+            "# TYPE mirror_up_span_seconds_total counter",
+            *(f'mirror_up_span_seconds_total{{span="{name}"}} {total}' for name, (_, total, _) in self.spans.items()),
+            "# TYPE mirror_up_spans_total counter",
+            *(f'mirror_up_spans_total{{span="{name}"}} {count}' for name, (count, _, _) in self.spans.items()),
+        ]
+        for name, value in self.counters.items():
+            lines += [f"# TYPE mirror_up_{name}_total counter", f"mirror_up_{name}_total {value}"]
+        for name, buckets in self.histograms.items():
+            lines.append(f"# TYPE mirror_up_{name} histogram")
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, buckets):
+                cumulative += n
+                lines.append(f'mirror_up_{name}_bucket{{le="{"+Inf" if math.isinf(bound) else bound}"}} {cumulative}')
+            lines += [f"mirror_up_{name}_sum {self.sums[name]}", f"mirror_up_{name}_count {cumulative}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, metrics_path: PathLike) -> None:
+        """
+        Write everything recorded to a file, as a Prometheus textfile if it ends in .prom, as JSON otherwise.
+
+        The file is swapped in whole, so collectors never read a partial one.
+        """
+        # Imported here, the CLI loads this module on startup and _utils would bring anyio along
+        from mirror_up._utils import atomic_write
+
+        metrics_path = Path(metrics_path)
+        content = self.prometheus() if metrics_path.suffix == ".prom" else json.dumps(self.summary(), indent=2)
+        # Collectors like node_exporter's may run as another user
+        atomic_write(metrics_path, content, 0o644)
@@ -0,0 +1,163 @@
+"""Dry-run plans of uploads from a stat-only scan, and the throughput history their time estimates come from."""
+import json
+import logging
+import math
+import time
+from os import PathLike
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from mirror_up._compress import is_compressed
+from mirror_up._utils import TarStream, atomic_write, split_ranges, user_cache_dir
+
+# Runs kept in the throughput history, older ones say little about the network today
+HISTORY_SIZE = 20
+
+
+class PlannedUpload(NamedTuple):
+    """
+    How a file/folder would be uploaded.
+
+    Attributes:
+        path: str = The file/folder's path
+        name: str = Name of the upload, a tar named after the folder for folders
+        route: str = simple for a single request, chunked for Content-Range chunks, split for multi-volume parts
+        archive: bool = A folder uploaded as a tar
+        size: int = Bytes uploaded, at most that many when compressing
+        volumes: int = Number of uploads it turns into, more than one when split
+        requests: int = Number of upload requests sent, retries aside
+        temp_bytes: int = Most bytes held in temporary files at once, at most that many when compressing
+    """
+
+    path: str
+    name: str
+    route: str
+    archive: bool
+    size: int
+    volumes: int
+    requests: int
+    temp_bytes: int
+
+
+def plan_upload(
+    file_path: PathLike,
+    max_chunk_size: int,
+    max_file_size: int,
+    stream_split: bool = True,
+    stream_archive: bool = True,
+    compression: Optional[str] = None,
+) -> PlannedUpload:
+    """
+    Plan the upload of a file/folder the way MirrorAceConnection would route it, reading nothing but stats.
+
+    Compressed sizes can't be known without compressing, so with compression the plan is an upper bound.
+
+    Args:
+        file_path: PathLike = The file/folder's path
+        max_chunk_size: int = The session's max_chunk_size
+        max_file_size: int = The session's max_file_size
+        stream_split: bool = Oversized files' volumes are uploaded by offset, without temporary files
+        stream_archive: bool = Folders are uploaded as a tar produced on the fly, without temporary files
+        compression: Optional[str] = Codec uploads are compressed with, if any
+    """
+    file_path = Path(file_path)
+    if file_path.is_dir():
+        # Every entry is stat'ed to size the tar, nothing is read until the stream is
+        with TarStream(file_path) as stream:
+            size = stream.size
+        name, archive = f"{file_path.name}.tar", True
+    else:
+        size = file_path.stat().st_size
+        name, archive = file_path.name, False
+    # A folder archived into ZIP_SAVE stays there while it is compressed or split in turn
+    archive_bytes = size if archive and not stream_archive else 0
+    compress_bytes = size if compression is not None and (archive or not is_compressed(file_path, sniff=False)) else 0
+    split_bytes = 0
+    if size > max_file_size:
+        lengths = [length for _, _, length in split_ranges(Path(name).stem, size, max_file_size)]
+        # Tars produced on the fly are always split in place
+        if not stream_split and not (archive and stream_archive):
+            split_bytes = size
+        route = "split"
+    else:
+        lengths = [size]
+        route = "simple" if size < max_chunk_size else "chunked"
+    # The compressed copy is gone by the time a file that didn't shrink gets split
+    temp_bytes = archive_bytes + max(compress_bytes, split_bytes)
+    requests = sum(1 if length < max_chunk_size else math.ceil(length / max_chunk_size) for length in lengths)
+    return PlannedUpload(str(file_path), name, route, archive, size, len(lengths), requests, temp_bytes)
+
+
+def plan_uploads(file_paths: List[PathLike], *args, **kwargs) -> List[PlannedUpload]:
+    """
+    Plan the upload of several files/folders, skipping paths that don't exist.
+
+    Args:
+        file_paths: List[PathLike] = The files/folders' paths
+        args, kwargs = Any other argument of plan_upload
+    """
+    plans = []
+    for file_path in file_paths:
+        try:
+            plans.append(plan_upload(file_path, *args, **kwargs))
+        except OSError as e:
+            logging.warning(f"[W] Can't plan {file_path}: {e}")
+    return plans
+
+
+class ThroughputHistory:
+    """
+    Bytes sent and seconds taken by the last HISTORY_SIZE upload runs, used to estimate how long uploads take.
+
+    Runs overlapping each other, like those of the connections of a pool, are measured as a single one from the
+    first start to the last end, with the bytes of all of them, so the rate recorded is the total one.
+
+    Args:
+        history_path: Optional[PathLike] = Where the history is kept, defaults to the user cache dir
+
+    Attributes:
+        runs: List[dict] = Time, bytes and seconds of each run, oldest first
+    """
+
+    def __init__(self, history_path: Optional[PathLike] = None) -> None:  # noqa
+        self.path = Path(history_path) if history_path is not None else user_cache_dir() / "throughput.json"
+        try:
+            self.runs: List[dict] = json.loads(self.path.read_text())[-HISTORY_SIZE:]
+        except (OSError, ValueError):
+            self.runs = []
+        self._running = 0
+        self._run_start = 0.0
+        self._run_bytes = 0
+
+    def start_run(self) -> None:
+        """Start timing a run, or join the one in progress."""
+        if not self._running:
+            self._run_start, self._run_bytes = time.monotonic(), 0
+        self._running += 1
+
+    def finish_run(self, bytes_sent: int = 0) -> None:
+        """Leave the run in progress with the bytes sent as part of it, recording the run once all have left."""
+        self._running -= 1
+        self._run_bytes += bytes_sent
+        if not self._running:
+            self.record(self._run_bytes, time.monotonic() - self._run_start)
+
+    def record(self, bytes_sent: int, seconds: float) -> None:
+        """Add a run, dropping the oldest one past HISTORY_SIZE."""
+        if bytes_sent <= 0 or seconds <= 0:
+            return
+        self.runs = (self.runs + [{"time": time.time(), "bytes": bytes_sent, "seconds": seconds}])[-HISTORY_SIZE:]
+        try:
+            atomic_write(self.path, json.dumps(self.runs))
+        except OSError as e:
+            logging.warning(f"[W] Couldn't save throughput history: {e}")
+
+    def rate(self) -> Optional[float]:
+        """Bytes per second across the recorded runs, so larger runs weigh more, None before any run."""
+        seconds = sum(run["seconds"] for run in self.runs)
+        return sum(run["bytes"] for run in self.runs) / seconds if seconds else None
+
+    def estimate(self, size: int) -> Optional[float]:
+        """Seconds uploading size bytes should take, None before any run."""
+        rate = self.rate()
+        return size / rate if rate else None
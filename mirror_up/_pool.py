@@ -0,0 +1,198 @@
+"""Sharding uploads across several MirrorAce accounts, each with its own upload session and server."""
+import logging
+import os
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import anyio
+import httpx
+
+from mirror_up._manifest import scan_tree
+from mirror_up.mirror_ace import MirrorAceConnection
+
+# Seconds an account is left alone after an upload through it fails, doubled for each failure in a row
+FAILOVER_COOLDOWN = 30
+FAILOVER_COOLDOWN_MAX = 600
+
+
+class MirrorAcePool:
+    """
+    Spread uploads across the connections of several MirrorAce accounts, for more throughput than one allows.
+
+    Each file goes to the connection with the fewest bytes outstanding, among the ones not cooling down. When an
+    upload fails or gets throttled past its retries, its account cools down for a while and the file is tried
+    again on another one, until every account has been tried. Files that can't be read fail right away, since
+    no other account would do any better with them. Give each connection its own scheduler, so each
+    account's requests are paced on their own.
+
+    Like a connection, used from synchronous code every upload method closes the clients once done, and from
+    async code, async with keeps them open until the pool is closed.
+
+    Example:
+        async with MirrorAcePool.from_credentials([(key1, token1), (key2, token2)]) as pool:
+            results = await pool.upload_many(paths)
+
+    Args:
+        connections: List[MirrorAceConnection] = Connection of each account
+
+    Attributes:
+        connections: List[MirrorAceConnection] = Connection of each account
+        outstanding: Dict[int, int] = Bytes of the uploads in progress on each connection, by position
+    """
+
+    def __init__(self, connections: List[MirrorAceConnection]) -> None:  # noqa
+        if not connections:
+            raise ValueError("A pool needs at least one connection")
+        self.connections = connections
+        self.outstanding: Dict[int, int] = dict.fromkeys(range(len(connections)), 0)
+        # Position -> failures in a row, and until when the connection is avoided
+        self._failures: Dict[int, int] = dict.fromkeys(range(len(connections)), 0)
+        self._cooldown_until: Dict[int, float] = dict.fromkeys(range(len(connections)), 0.0)
+
+    @classmethod
+    def from_credentials(cls, credentials: List[Tuple[str, str]], **kwargs) -> "MirrorAcePool":
+        """
+        Create a pool with a connection for each account.
+
+        Args:
+            credentials: List[Tuple[str, str]] = API key and token of each account
+            kwargs = Any other argument of MirrorAceConnection, given to every connection
+        """
+        return cls([MirrorAceConnection(api_key, api_token, **kwargs) for api_key, api_token in credentials])
+
+    async def __aenter__(self) -> "MirrorAcePool":  # noqa: D105
+        for connection in self.connections:
+            await connection.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:  # noqa: D105
+        for connection in self.connections:
+            await connection.__aexit__(*exc_info)
+
+    async def aclose(self) -> None:
+        """Close every connection's client."""
+        for connection in self.connections:
+            await connection.aclose()
+
+    async def __call__(
+        self, file_path: PathLike, password: Optional[str] = None
+    ) -> Union[httpx.Response, List[httpx.Response], None]:
+        """
+        Upload a file/folder through whichever account is least busy.
+
+        Args:
+            file_path: PathLike = The file/folder's path
+            password: Optional[str] = Upload's password, if desired.
+        """
+        return (await self.upload_many([file_path], password))[0]
+
+    async def upload_many(
+        self,
+        file_paths: List[PathLike],
+        password: Optional[str] = None,
+        max_files: int = 4,
+        on_result: Optional[Callable[[int, Union[httpx.Response, List[httpx.Response], None]], None]] = None,
+    ) -> List[Union[httpx.Response, List[httpx.Response], None]]:
+        """
+        Upload several files/folders concurrently, spread across the pool's accounts.
+
+        Args:
+            file_paths: List[PathLike] = The files/folders' paths
+            password: Optional[str] = Upload's password, if desired.
+            max_files: int = Maximum number of files uploaded at the same time, across every account
+            on_result: Optional[Callable] = Called with each path's position and result as soon as it is known
+
+        Returns:
+            List = Each path's result, in the same order, the last attempt's for the ones that failed everywhere
+        """
+        limiter = anyio.CapacityLimiter(max(1, max_files))
+        results: List[Union[httpx.Response, List[httpx.Response], None]] = [None] * len(file_paths)
+        # Held open across every account, so the whole call is recorded as one run, however files come and go
+        histories = list(
+            {
+                id(connection.history): connection.history
+                for connection in self.connections
+                if connection.history is not None
+            }.values()
+        )
+
+        async def _upload_one(i: int, file_path: PathLike) -> None:
+            size = await anyio.to_thread.run_sync(_upload_size, file_path)
+            async with limiter:
+                tried = set()
+                while len(tried) < len(self.connections):
+                    position = self._pick(tried)
+                    tried.add(position)
+                    connection = self.connections[position]
+                    self.outstanding[position] += size
+                    errors = {}
+                    try:
+                        # Goes through the connection's index and error handling, a single file at a time
+                        (results[i],) = await connection._upload_many(
+                            [file_path], password, anyio.CapacityLimiter(1), errors=errors
+                        )
+                    finally:
+                        self.outstanding[position] -= size
+                    if self._succeeded(connection, results[i]):
+                        self._failures[position] = 0
+                        break
+                    if _is_local(errors.get(0)):
+                        # Reading the file failed, not the account
+                        break
+                    self._cool_down(position)
+                    if len(tried) < len(self.connections):
+                        logging.warning(f"[W] {Path(file_path).name} failed through account {position}, failing over")
+            if on_result is not None:
+                on_result(i, results[i])
+
+        for history in histories:
+            history.start_run()
+        try:
+            async with anyio.create_task_group() as task_group:
+                for i, file_path in enumerate(file_paths):
+                    task_group.start_soon(_upload_one, i, file_path)
+        finally:
+            for history in histories:
+                history.finish_run()
+            for connection in self.connections:
+                await connection._release_client()
+        return results
+
+    def _pick(self, tried: set) -> int:
+        """Position of the untried connection with the fewest bytes outstanding, preferring ones not cooling down."""
+        now = time.monotonic()
+        candidates = [i for i in range(len(self.connections)) if i not in tried]
+        ready = [i for i in candidates if self._cooldown_until[i] <= now]
+        if ready:
+            return min(ready, key=lambda i: (self.outstanding[i], i))
+        # Every account left is cooling down, the one that has been resting the longest still gets a go
+        return min(candidates, key=lambda i: self._cooldown_until[i])
+
+    def _cool_down(self, position: int) -> None:
+        self._failures[position] += 1
+        cooldown = min(FAILOVER_COOLDOWN * 2 ** (self._failures[position] - 1), FAILOVER_COOLDOWN_MAX)
+        self._cooldown_until[position] = time.monotonic() + cooldown
+        logging.debug(f"[D] Account {position} cools down for {cooldown}s")
+
+    @staticmethod
+    def _succeeded(connection: MirrorAceConnection, result: Union[httpx.Response, List[httpx.Response], None]) -> bool:
+        responses = result if isinstance(result, list) else [result]
+        return all(req is not None and connection._check_success(req) for req in responses)
+
+
+def _is_local(error: Optional[Exception]) -> bool:
+    """Check if an upload failed on this side, like a file that can't be read, rather than on MirrorAce's."""
+    # httpx wraps the sockets' OSErrors in its own errors, so these come from reading the files
+    return isinstance(error, OSError)
+
+
+def _upload_size(file_path: PathLike) -> int:
+    """Bytes a file/folder upload sends, near enough for placing it."""
+    if os.path.isdir(file_path):
+        return sum(stat.st_size for _, stat in scan_tree(file_path))
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
@@ -0,0 +1,161 @@
+"""Adaptive request concurrency and bandwidth limiting, shared by every upload of a connection."""
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+import anyio
+
+# Requests slower than this many times the best one of their size seen are a sign of congestion
+LATENCY_TOLERANCE = 2.0
+# How much the best latencies seen drift towards recent ones, so the baselines follow the network
+BASELINE_DECAY = 0.01
+
+
+class TokenBucket:
+    """
+    Cap the rate bytes are sent at, across every scheduler sharing the bucket.
+
+    Args:
+        rate: Optional[float] = Maximum rate in bytes per second, unlimited if None
+
+    Attributes:
+        rate: Optional[float] = Maximum rate in bytes per second, can be changed at any time
+    """
+
+    def __init__(self, rate: Optional[float] = None) -> None:  # noqa
+        self.rate = rate
+        self._tokens = float(rate or 0)
+        self._refilled = time.monotonic()
+        self._lock = anyio.Lock()
+
+    async def take(self, size: int) -> None:
+        """Wait until size bytes may be sent."""
+        if self.rate is None:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            # The bucket holds up to a second worth of bytes
+            self._tokens = min(self.rate, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            self._tokens -= size
+            if self._tokens < 0:
+                await anyio.sleep(-self._tokens / self.rate)
+
+
+class UploadScheduler:
+    """
+    Decide how many upload requests may be in flight, and how fast bytes may be sent.
+
+    The number of concurrent requests follows an AIMD controller: it grows by about one for each
+    round of successful requests, and is halved when a request fails or takes more than LATENCY_TOLERANCE
+    times the best of its size seen. An optional token bucket caps the overall upload rate, it may be shared
+with other schedulers to cap their combined rate.
+
+    A request's latency is a round trip plus its size over the bandwidth, so small requests are mostly
+    round trip and large ones mostly bandwidth. Each request is only judged against the fastest recent one
+    of its size class, sizes within a factor of two of each other, so mixing small requests with large
+    chunks doesn't look like congestion.
+
+    Args:
+        initial_requests: int = Requests allowed in flight at first
+        max_requests: int = Upper bound for requests in flight
+        rate_limit: Optional[float] = Maximum upload rate in bytes per second, unlimited if None
+        bucket: Optional[TokenBucket] = Token bucket shared with other schedulers, replaces rate_limit
+
+    Attributes:
+        rate_limit: Optional[float] = Maximum upload rate in bytes per second, can be changed at any time
+        bucket: TokenBucket = Token bucket capping the upload rate
+        bytes_sent: int = Bytes of every successful request
+        requests: int = Number of requests made
+    """
+
+    def __init__(  # noqa
+        self,
+        initial_requests: int = 4,
+        max_requests: int = 32,
+        rate_limit: Optional[float] = None,
+        bucket: Optional[TokenBucket] = None,
+    ) -> None:
+        self.max_requests = max(1, max_requests)
+        self.bucket = bucket if bucket is not None else TokenBucket(rate_limit)
+        self.bytes_sent = 0
+        self.requests = 0
+        self._window = float(min(max(1, initial_requests), self.max_requests))
+        self._in_flight = 0
+        # Set when a slot frees up or the window grows, created while someone waits since it needs a running
+        # event loop. A CapacityLimiter can't be used, resizing it loses wakeups on asyncio under anyio 3.
+        self._slot_freed: Optional[anyio.Event] = None
+        # Size class -> seconds and size of the fastest recent request of the class
+        self._baselines: Dict[int, Tuple[float, int]] = {}
+        self._last_decrease = 0.0
+
+    @property
+    def rate_limit(self) -> Optional[float]:
+        """Maximum upload rate in bytes per second, of the bucket."""
+        return self.bucket.rate
+
+    @rate_limit.setter
+    def rate_limit(self, rate: Optional[float]) -> None:
+        self.bucket.rate = rate
+
+    @property
+    def window(self) -> int:
+        """Requests currently allowed in flight."""
+        return int(self._window)
+
+    async def acquire(self, size: int) -> None:
+        """Wait for a request slot and for size bytes worth of bandwidth."""
+        while self._in_flight >= self.window:
+            if self._slot_freed is None:
+                self._slot_freed = anyio.Event()
+            await self._slot_freed.wait()
+        self._in_flight += 1
+        try:
+            await self.bucket.take(size)
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def release(self, size: int, elapsed: float, ok: bool) -> None:
+        """Give back the slot of a finished request, feeding its outcome to the controller."""
+        self._release_slot()
+        self._record(size, elapsed, ok)
+
+    def _release_slot(self) -> None:
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        # Every waiter checks the window again, those that don't fit wait for the next event
+        if self._slot_freed is not None:
+            self._slot_freed.set()
+            self._slot_freed = None
+
+    def _record(self, size: int, elapsed: float, ok: bool) -> None:
+        self.requests += 1
+        if ok:
+            self.bytes_sent += size
+        if ok and elapsed <= self._expected(size, elapsed) * LATENCY_TOLERANCE:
+            # Additive increase, about one more request per window of successes
+            self._resize(self._window + 1 / self._window)
+        elif time.monotonic() - self._last_decrease > elapsed:
+            # Multiplicative decrease, at most once per round trip
+            self._last_decrease = time.monotonic()
+            self._resize(self._window / 2)
+            logging.debug(f"[D] Backing off to {self.window} requests in flight")
+
+    def _expected(self, size: int, elapsed: float) -> float:
+        """Seconds a request of size bytes should take, learning from one that took elapsed seconds."""
+        size_class = max(size, 1).bit_length()
+        best, best_size = self._baselines.get(size_class, (elapsed, size))
+        # Within a class, a larger request may take proportionally longer, a smaller one as long if it's all round trip
+        scale = max(1.0, size / best_size)
+        best += (elapsed / scale - best) * BASELINE_DECAY
+        if elapsed / scale < best:
+            best, best_size, scale = elapsed, size, 1.0
+        self._baselines[size_class] = (best, best_size)
+        return best * scale
+
+    def _resize(self, window: float) -> None:
+        self._window = min(max(1.0, window), self.max_requests)
+        self._wake()
@@ -0,0 +1,90 @@
+"""Upload session cache, shared by every MirrorAceConnection using the same API key."""
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from mirror_up._utils import atomic_write, user_cache_dir
+
+# Sessions are renewed this many seconds before their upload key expires
+EXPIRY_MARGIN = 300
+
+_sessions: Dict[str, dict] = {}
+
+
+def load_session(api_key: str, on_disk: bool = False) -> Optional[dict]:
+    """
+    Get the cached upload session of an API key, if it isn't about to expire.
+
+    Args:
+        api_key: str = MirrorAce's API key
+        on_disk: bool = Also look in the user cache dir, for sessions created by earlier runs
+    """
+    key = account_id(api_key)
+    session = _sessions.get(key)
+    if session is None and on_disk:
+        session = _read_cache_file().get(key)
+    if session is None or not is_fresh(session):
+        return None
+    _sessions[key] = session
+    return dict(session)
+
+
+def save_session(api_key: str, session: dict, on_disk: bool = False) -> None:
+    """
+    Cache the upload session of an API key.
+
+    Args:
+        api_key: str = MirrorAce's API key
+        session: dict = Upload session, as returned by /api/v1/file/upload
+        on_disk: bool = Also save it in the user cache dir, for later runs
+    """
+    key = account_id(api_key)
+    _sessions[key] = dict(session)
+    if not on_disk:
+        return
+    sessions = {k: v for k, v in _read_cache_file().items() if is_fresh(v)}
+    sessions[key] = session
+    try:
+        # Upload keys are credentials, keep them private to the user
+        atomic_write(_cache_file(), json.dumps(sessions))
+    except OSError as e:
+        logging.debug(f"[D] Couldn't save upload session cache: {e}")
+
+
+def is_fresh(session: dict) -> bool:
+    """Check if an upload session's key is valid for at least EXPIRY_MARGIN more seconds."""
+    timestamp = session_expiry(session)
+    # Unknown format, never reuse it
+    return timestamp is not None and timestamp - EXPIRY_MARGIN > time.time()
+
+
+def session_expiry(session: dict) -> Optional[float]:
+    """Epoch timestamp at which an upload session's key expires, None if it can't be told."""
+    expiry = str(session.get("upload_key_expiry", ""))
+    try:
+        return float(expiry)
+    except ValueError:
+        try:
+            return datetime.fromisoformat(expiry).timestamp()
+        except ValueError:
+            return None
+
+
+def account_id(api_key: str) -> str:
+    """Identifier of the account of an API key, to keep in caches instead of the key itself."""
+    return hashlib.sha256(str(api_key).encode()).hexdigest()
+
+
+def _cache_file() -> Path:
+    return user_cache_dir() / "sessions.json"
+
+
+def _read_cache_file() -> Dict[str, dict]:
+    try:
+        return json.loads(_cache_file().read_text())
+    except (OSError, ValueError):
+        return {}
@@ -0,0 +1,136 @@
+"""HTTP version, connection limits, timeouts and socket buffers of the client uploads are sent through."""
+import importlib.util
+import socket
+from typing import Optional
+
+import httpx
+
+try:
+    from httpcore import AsyncNetworkBackend, AsyncNetworkStream
+except ImportError:
+    # Only exported from the top since httpcore 0.17
+    from httpcore.backends.base import AsyncNetworkBackend, AsyncNetworkStream
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the h2 package, installed with mirror_up[http2]."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def socket_buffers_available() -> bool:
+    """Socket buffers are set through the network backend of httpx's connection pool, which is internal to it."""
+    pool = getattr(httpx.AsyncHTTPTransport(), "_pool", None)
+    return isinstance(getattr(pool, "_network_backend", None), AsyncNetworkBackend)
+
+
+class TransportConfig:
+    """
+    Settings of a connection's HTTP client.
+
+    With HTTP/2, the concurrent chunk requests of every upload are multiplexed as streams over a single
+    connection to the upload server, instead of each needing a connection of its own. HTTP/2 is negotiated
+    over https, on plain http it is only spoken without http1, e.g. to a local test server.
+
+    Args:
+        http2: bool = Use HTTP/2 where the server supports it, needs the h2 package
+        http1: bool = Allow HTTP/1.1, without it every request is sent over HTTP/2
+        max_connections: Optional[int] = Maximum connections open at once, unlimited if None
+        max_keepalive: Optional[int] = Maximum idle connections kept open for later requests, unlimited if None
+        keepalive_expiry: Optional[float] = Seconds idle connections are kept open
+        connect_timeout: Optional[float] = Seconds to establish a connection, no limit if None
+        read_timeout: Optional[float] = Seconds to wait for the server's response to arrive, no limit if None
+        write_timeout: Optional[float] = Seconds to wait for a request's bytes to be sent, no limit if None
+        pool_timeout: Optional[float] = Seconds a request waits for a free connection, no limit if None
+        send_buffer: Optional[int] = Size of every socket's send buffer in bytes, the system's default if None,
+            only settable where socket_buffers_available()
+        receive_buffer: Optional[int] = Size of every socket's receive buffer in bytes, the system's default if None
+
+    Attributes:
+        http2: bool = Use HTTP/2 where the server supports it
+        http1: bool = Allow HTTP/1.1
+        send_buffer: Optional[int] = Size of every socket's send buffer in bytes
+        receive_buffer: Optional[int] = Size of every socket's receive buffer in bytes
+        limits: httpx.Limits = Connection limits of the client
+        timeout: httpx.Timeout = Timeouts of every request
+    """
+
+    def __init__(  # noqa
+        self,
+        http2: bool = False,
+        http1: bool = True,
+        max_connections: Optional[int] = 100,
+        max_keepalive: Optional[int] = 32,
+        keepalive_expiry: Optional[float] = 30.0,
+        connect_timeout: Optional[float] = 30.0,
+        read_timeout: Optional[float] = 1800.0,
+        write_timeout: Optional[float] = 300.0,
+        pool_timeout: Optional[float] = None,
+        send_buffer: Optional[int] = None,
+        receive_buffer: Optional[int] = None,
+    ) -> None:
+        if http2 and not http2_available():
+            raise ValueError("HTTP/2 needs the h2 package, install mirror_up[http2]")
+        if not http1 and not http2:
+            raise ValueError("Either HTTP/1.1 or HTTP/2 must be allowed")
+        if (send_buffer or receive_buffer) and not socket_buffers_available():
+            raise ValueError(f"Socket buffers can't be set with httpx {httpx.__version__}, leave them unset")
+        self.http2 = http2
+        self.http1 = http1
+        self.send_buffer = send_buffer
+        self.receive_buffer = receive_buffer
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_keepalive, keepalive_expiry=keepalive_expiry
+        )
+        # The scheduler already bounds requests in flight, waiting for a connection is how they queue for one
+        self.timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout, write=write_timeout, pool=pool_timeout)
+
+    def transport(self) -> httpx.AsyncHTTPTransport:
+        """Create a network transport with these settings' HTTP versions, limits and socket buffers."""
+        transport = httpx.AsyncHTTPTransport(verify=True, http1=self.http1, http2=self.http2, limits=self.limits)
+        if self.send_buffer or self.receive_buffer:
+            # httpx has no socket options of its own, the connection pool's backend opens every socket
+            pool = transport._pool
+            pool._network_backend = _SocketBufferBackend(pool._network_backend, self.send_buffer, self.receive_buffer)
+        return transport
+
+    def client(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+        """
+        Create a client with these settings.
+
+        Args:
+            transport: Optional[httpx.AsyncBaseTransport] = Transport requests are sent through instead of one from
+                transport(), only the timeouts apply to it
+        """
+        return httpx.AsyncClient(
+            verify=True, timeout=self.timeout, transport=transport if transport is not None else self.transport()
+        )
+
+
+class _SocketBufferBackend(AsyncNetworkBackend):
+    """Network backend sizing the buffers of the sockets opened through another one."""
+
+    def __init__(  # noqa
+        self, backend: AsyncNetworkBackend, send_buffer: Optional[int], receive_buffer: Optional[int]
+    ) -> None:
+        self._backend = backend
+        self._options = [
+            (option, size)
+            for option, size in ((socket.SO_SNDBUF, send_buffer), (socket.SO_RCVBUF, receive_buffer))
+            if size
+        ]
+
+    async def connect_tcp(  # noqa: D102
+        self, host: str, port: int, timeout: Optional[float] = None, local_address: Optional[str] = None
+    ) -> AsyncNetworkStream:
+        stream = await self._backend.connect_tcp(host, port, timeout=timeout, local_address=local_address)
+        sock = stream.get_extra_info("socket")
+        if sock is not None:
+            for option, size in self._options:
+                sock.setsockopt(socket.SOL_SOCKET, option, size)
+        return stream
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None) -> AsyncNetworkStream:  # noqa: D102
+        return await self._backend.connect_unix_socket(path, timeout=timeout)
+
+    async def sleep(self, seconds: float) -> None:  # noqa: D102
+        await self._backend.sleep(seconds)
@@ -1,13 +1,49 @@
+import hashlib
+import logging
+import os
 import shutil
-from io import BytesIO
+import tarfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import SEEK_CUR, SEEK_END, SEEK_SET, BytesIO, RawIOBase
 from os import PathLike, getenv
 from pathlib import Path
-from typing import BinaryIO
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
 
+import anyio
 import multivolumefile
-from dotenv.main import load_dotenv
 
-load_dotenv()
+# Bytes read at once when streaming through files
+READ_SIZE = 1024 * 1024
+# Files at least this large are hashed on a process pool, smaller ones aren't worth a process
+HASH_PROCESS_SIZE = 64 * 1024 * 1024
+
+
+def user_cache_dir() -> Path:
+    """Folder where mirror-up keeps its caches, following each platform's convention."""
+    from mirror_up import APP_NAME
+
+    if os.name == "nt":
+        return Path(getenv("LOCALAPPDATA", Path.home() / "AppData" / "Local")) / APP_NAME / "Cache"
+    return Path(getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / APP_NAME
+
+
+def atomic_write(file_path: PathLike, content: str, mode: int = 0o600) -> None:
+    """
+    Write a text file through a temporary file next to it, swapped in once complete.
+
+    A crash mid-write never leaves a truncated file behind, and readers only ever see a complete one.
+
+    Args:
+        file_path: PathLike = File to write, its folder is created if needed
+        content: str = Text to write
+        mode: int = Permissions of a newly created file, private to the user by default
+    """
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(f"{file_path.name}.tmp")
+    with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), "w") as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
 
 
 def split_directory(directory: PathLike, volume_size: int) -> None:
@@ -30,11 +66,408 @@ def split_directory(directory: PathLike, volume_size: int) -> None:
         split_directory(directory, volume_size)
 
 
+def split_ranges(stem: str, file_size: int, volume_size: int) -> Iterator[Tuple[str, int, int]]:
+    """
+    Generator that yields the volumes split_directory would produce, as byte ranges of the original file.
+
+    Args:
+        stem: str = Stem of the file, used to name each volume
+        file_size: int = Size of the file
+        volume_size: int = Size of each volume
+
+    Yields:
+        Tuple[str, int, int] = Volume name, offset and length
+    """
+    for i, offset in enumerate(range(0, file_size, volume_size), start=1):
+        # Same naming scheme as multivolumefile
+        yield f"{stem}.{i:04d}", offset, min(volume_size, file_size - offset)
+
+
+def pack_files(files: List[Tuple[str, int]], bundle_size: int) -> List[List[str]]:
+    """
+    Group files into bundles whose tar archives stay within bundle_size, keeping their order.
+
+    The space each file takes in the archive is overestimated, so long names needing extra headers still fit.
+
+    Args:
+        files: List[Tuple[str, int]] = Name in the archive and size of each file
+        bundle_size: int = Largest archive allowed
+
+    Returns:
+        List[List[str]] = Names of the files in each bundle
+    """
+    # End of archive marker, padded to a full record at most
+    available = bundle_size - tarfile.RECORDSIZE - tarfile.BLOCKSIZE * 2
+    bundles: List[List[str]] = []
+    used = available
+    for name, size in files:
+        # Header, a GNU long name header with the name itself, then the padded content
+        cost = tarfile.BLOCKSIZE * 2 + _block_padded(len(name.encode()) + 1) + _block_padded(size)
+        if used + cost > available:
+            bundles.append([])
+            used = 0
+        bundles[-1].append(name)
+        used += cost
+    return bundles
+
+
 def archive_directory(directory: PathLike) -> None:
     """Archive folder and save it on the folder specified in .env."""
     shutil.make_archive(f"{getenv('ZIP_SAVE') + Path(directory).name}", "tar", directory)
 
 
+class TarStream(RawIOBase):
+    """
+    Readable file object that produces an uncompressed tar of a directory without writing it to disk.
+
+    Every entry is stat'ed up front, so the archive's exact size is known before the first byte is read.
+    The archive of a directory is identical to the one archive_directory writes.
+
+    Args:
+        directory: Optional[PathLike] = Directory to archive
+        files: Optional[List[Tuple[PathLike, str]]] = Files to archive instead, with the name of each in the archive
+
+    Attributes:
+        size: int = Size of the archive in bytes
+        mtime: int = Latest modification time of the archived entries
+        members: Dict[str, Tuple[int, int]] = Offset and size of the content of each regular file, by name
+    """
+
+    def __init__(  # noqa
+        self, directory: Optional[PathLike] = None, files: Optional[List[Tuple[PathLike, str]]] = None
+    ) -> None:
+        self._members: List[Tuple[tarfile.TarInfo, bytes, Optional[str]]] = []
+        # Throwaway archive, only used so gettarinfo keeps track of hard links
+        with tarfile.open(fileobj=BytesIO(), mode="w") as tar:
+            if directory is not None:
+                self._add(tar, str(directory), os.curdir)
+            for name, arcname in files or []:
+                self._add(tar, str(name), arcname)
+        self.size = 0
+        self.members: Dict[str, Tuple[int, int]] = {}
+        for info, header, source in self._members:
+            self.size += len(header)
+            if source is not None:
+                self.members[info.name] = (self.size, info.size)
+                self.size += _block_padded(info.size)
+        # End of archive marker, padded to a full record like TarFile.close does
+        self._trailer = tarfile.BLOCKSIZE * 2 + (-(self.size + tarfile.BLOCKSIZE * 2) % tarfile.RECORDSIZE)
+        self.size += self._trailer
+        self.mtime = max((info.mtime for info, header, source in self._members), default=0)
+        self._pieces = self._generate()
+        self._pending = memoryview(b"")
+
+    def _add(self, tar: tarfile.TarFile, name: str, arcname: str) -> None:
+        # Same traversal as TarFile.add
+        info = tar.gettarinfo(name, arcname)
+        if info is None:
+            logging.warning(f"[W] Skipping {name}, its file type can't be archived")
+            return
+        header = info.tobuf(tar.format, tar.encoding, tar.errors)
+        self._members.append((info, header, name if info.isreg() else None))
+        if info.isdir():
+            for entry in sorted(os.listdir(name)):
+                self._add(tar, os.path.join(name, entry), os.path.join(arcname, entry))
+
+    def _generate(self) -> Iterator[bytes]:
+        for info, header, source in self._members:
+            yield header
+            if source is None:
+                continue
+            with open(source, "rb") as f:
+                remaining = info.size
+                while remaining:
+                    data = f.read(min(remaining, READ_SIZE))
+                    if not data:
+                        # The header already promised info.size bytes
+                        logging.warning(f"[W] {source} shrank while being archived, padding it with zeros")
+                        data = tarfile.NUL * min(remaining, READ_SIZE)
+                    remaining -= len(data)
+                    yield data
+            yield tarfile.NUL * (_block_padded(info.size) - info.size)
+        yield tarfile.NUL * self._trailer
+
+    def readable(self) -> bool:  # noqa: D102
+        return True
+
+    def readinto(self, buffer: bytearray) -> int:
+        """Fill buffer with the next bytes of the archive, returning how many were written."""
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view):
+            if not self._pending:
+                self._pending = memoryview(next(self._pieces, b""))
+                if not self._pending:
+                    break
+            n = min(len(self._pending), len(view) - filled)
+            view[filled : filled + n] = self._pending[:n]
+            self._pending = self._pending[n:]
+            filled += n
+        return filled
+
+    def close(self) -> None:  # noqa: D102
+        self._pieces.close()
+        super().close()
+
+
+def _block_padded(size: int) -> int:
+    return size + (-size % tarfile.BLOCKSIZE)
+
+
+class BufferPool:
+    """
+    Reusable bytearrays for chunk data, optionally capped to a total number of bytes.
+
+    Reading a chunk takes a buffer from the pool instead of allocating a new one. Once limit bytes are
+    allocated, acquire blocks until another upload gives a buffer back, so memory stays capped however
+    many uploads share the pool.
+
+    Args:
+        limit: Optional[int] = Maximum bytes allocated for buffers, unlimited if None
+
+    Attributes:
+        limit: Optional[int] = Maximum bytes allocated for buffers, unlimited if None
+        allocated: int = Bytes currently allocated for buffers, in use or free
+    """
+
+    def __init__(self, limit: Optional[int] = None) -> None:  # noqa
+        self.limit = limit
+        self.allocated = 0
+        self._free: Dict[int, List[bytearray]] = {}
+        # Set when a buffer is released, created while someone waits since it needs a running event loop
+        self._released: Optional[anyio.Event] = None
+
+    async def acquire(self, buffer_size: int) -> bytearray:
+        """Take a buffer of buffer_size bytes, waiting while the pool is at its limit."""
+        while True:
+            buffer = self.try_acquire(buffer_size)
+            if buffer is not None:
+                return buffer
+            if self._released is None:
+                self._released = anyio.Event()
+            await self._released.wait()
+
+    def try_acquire(self, buffer_size: int) -> Optional[bytearray]:
+        """Take a buffer of buffer_size bytes, None if the pool is at its limit."""
+        while True:
+            if self._free.get(buffer_size):
+                return self._free[buffer_size].pop()
+            # A single buffer is always allowed, even if it's larger than the limit
+            if self.limit is None or not self.allocated or self.allocated + buffer_size <= self.limit:
+                self.allocated += buffer_size
+                return bytearray(buffer_size)
+            # Free buffers of other sizes only take up room
+            if not self._drop_free(buffer_size):
+                return None
+
+    def release(self, buffer: bytearray) -> None:
+        """Give a buffer back to the pool once nothing reads from it anymore."""
+        self._free.setdefault(len(buffer), []).append(buffer)
+        if self._released is not None:
+            self._released.set()
+            self._released = None
+
+    def _drop_free(self, keep_size: int) -> bool:
+        dropped = False
+        for buffer_size, buffers in self._free.items():
+            if buffer_size != keep_size and buffers:
+                self.allocated -= buffer_size * len(buffers)
+                buffers.clear()
+                dropped = True
+        return dropped
+
+
+class BufferFile:
+    """
+    Read-only file object over a memoryview, so httpx can stream a pooled buffer without copying it whole.
+
+    Args:
+        view: memoryview = Bytes to expose
+    """
+
+    def __init__(self, view: memoryview) -> None:  # noqa
+        self._view = view
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes, or everything left if size is negative."""
+        end = len(self._view) if size < 0 else min(len(self._view), self._position + size)
+        data = bytes(self._view[self._position : end])
+        self._position = max(self._position, end)
+        return data
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        """Move to offset, relative to whence, and return the new position."""
+        base = {SEEK_SET: 0, SEEK_CUR: self._position, SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        """Current position."""
+        return self._position
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._view)
+
+
+class FileRange(RawIOBase):
+    """
+    Read-only file object over a byte range of an open file, reading at explicit offsets with os.pread.
+
+    The descriptor's own position is never moved, so any number of ranges of the same file can be read
+    at once, which is how the volumes of a multi-volume upload are read concurrently.
+
+    Args:
+        fd: int = Descriptor of the file, left open
+        offset: int = Start of the range in the file
+        length: int = Size of the range
+    """
+
+    def __init__(self, fd: int, offset: int, length: int) -> None:  # noqa
+        self._fd = fd
+        self._offset = offset
+        self._length = length
+        self._position = 0
+
+    @staticmethod
+    def supported(file_object: BinaryIO) -> bool:
+        """Check if ranges of file_object can be read with os.pread, which Windows lacks."""
+        if not hasattr(os, "pread"):
+            return False
+        try:
+            file_object.fileno()
+        except (AttributeError, OSError):
+            return False
+        return file_object.seekable()
+
+    def readable(self) -> bool:  # noqa: D102
+        return True
+
+    def seekable(self) -> bool:  # noqa: D102
+        return True
+
+    def readinto(self, buffer: bytearray) -> int:
+        """Fill buffer with the next bytes of the range, returning how many were written."""
+        view = memoryview(buffer).cast("B")[: self._length - self._position]
+        if not view:
+            return 0
+        if hasattr(os, "preadv"):
+            n = os.preadv(self._fd, [view], self._offset + self._position)
+        else:
+            data = os.pread(self._fd, len(view), self._offset + self._position)
+            n = len(data)
+            view[:n] = data
+        self._position += n
+        return n
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        """Move to offset, relative to whence, and return the new position."""
+        base = {SEEK_SET: 0, SEEK_CUR: self._position, SEEK_END: self._length}[whence]
+        self._position = min(max(0, base + offset), self._length)
+        return self._position
+
+    def tell(self) -> int:
+        """Current position."""
+        return self._position
+
+
+def read_into(file_object: BinaryIO, buffer: bytearray, size: int) -> memoryview:
+    """
+    Fill the start of buffer with up to size bytes of file_object.
+
+    Returns:
+        memoryview = View on the bytes that were read, shorter than size only at the end of the file
+    """
+    view = memoryview(buffer)[:size]
+    filled = 0
+    while filled < size:
+        n = file_object.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return view[:filled]
+
+
+class StreamDigest:
+    """
+    Digest and byte count of data as it is read for an upload, so its content never needs reading again to check it.
+
+    Args:
+        algorithm: str = hashlib algorithm to use
+
+    Attributes:
+        algorithm: str = hashlib algorithm in use
+        size: int = Number of bytes fed to it so far
+    """
+
+    def __init__(self, algorithm: str = "sha256") -> None:  # noqa
+        self.algorithm = algorithm
+        self.size = 0
+        self._hash = hashlib.new(algorithm)
+
+    def update(self, data: bytes) -> None:
+        """Feed the next bytes of the content."""
+        self._hash.update(data)
+        self.size += len(data)
+
+    def hexdigest(self) -> str:
+        """Hex digest of the content fed so far, prefixed by the algorithm, e.g. sha256:..."""
+        return f"{self.algorithm}:{self._hash.hexdigest()}"
+
+
+def digest_bytes(file_object: BinaryIO, size: int, digest: StreamDigest) -> None:
+    """Move a file forward by size bytes, feeding them to digest."""
+    while size:
+        data = file_object.read(min(size, READ_SIZE))
+        if not data:
+            break
+        digest.update(data)
+        size -= len(data)
+
+
+def skip_bytes(file_object: BinaryIO, size: int) -> None:
+    """Move a file forward by size bytes, reading through them if it can't seek."""
+    if file_object.seekable():
+        file_object.seek(size, os.SEEK_CUR)
+        return
+    while size:
+        data = file_object.read(min(size, READ_SIZE))
+        if not data:
+            break
+        size -= len(data)
+
+
+def hash_file(file_path: PathLike, algorithm: str = "sha256") -> str:
+    """Hex digest of a file's content."""
+    digest = hashlib.new(algorithm)
+    with open(file_path, "rb") as f:
+        for data in read_in_chunks(READ_SIZE, f):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def hash_files(file_paths: List[PathLike], algorithm: str = "sha256") -> List[str]:
+    """
+    Hash several files in parallel, large ones on a process pool so hashing isn't bound to a single core.
+
+    Args:
+        file_paths: List[PathLike] = Files to hash
+        algorithm: str = hashlib algorithm to use
+
+    Returns:
+        List[str] = Hex digest of each file, in the same order
+    """
+    # Processes are only started if some file is large enough to need them
+    with ThreadPoolExecutor() as threads, ProcessPoolExecutor() as processes:
+        futures = [
+            (processes if os.path.getsize(file_path) >= HASH_PROCESS_SIZE else threads).submit(
+                hash_file, file_path, algorithm
+            )
+            for file_path in file_paths
+        ]
+        return [future.result() for future in futures]
+
+
 def read_in_chunks(chunk_size: int, file_object: BinaryIO) -> BytesIO:
     """Generator that yields a file chunk by chunk."""
     while True:
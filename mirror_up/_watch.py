@@ -0,0 +1,272 @@
+"""Watching folders for new files, and the ledger of what was uploaded from them."""
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from datetime import datetime, timezone
+from fnmatch import fnmatch
+from os import PathLike
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import anyio
+
+from mirror_up._manifest import scan_tree
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class UploadLedger:
+    """
+    Append-only JSON lines record of every file uploaded or failed, one object per line.
+
+    Args:
+        ledger_path: PathLike = Where the ledger is kept
+    """
+
+    def __init__(self, ledger_path: PathLike) -> None:  # noqa
+        self.path = Path(ledger_path)
+        self._uploaded: Set[Tuple[str, int, int]] = set()
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    if entry.get("status") == "uploaded":
+                        self._uploaded.add((entry["path"], entry["size"], entry["mtime_ns"]))
+        except OSError:
+            pass
+
+    def uploaded(self, file_path: PathLike, stat: os.stat_result) -> bool:
+        """Check if a file has already been uploaded as it is now."""
+        return (str(Path(file_path).resolve()), stat.st_size, stat.st_mtime_ns) in self._uploaded
+
+    def record(self, file_path: PathLike, stat: os.stat_result, results: Optional[list], error: str = "") -> None:
+        """
+        Append the outcome of an upload.
+
+        Args:
+            file_path: PathLike = Uploaded file
+            stat: os.stat_result = Stat of the file when it was uploaded
+            results: Optional[list] = Server result of each upload, several for multi-volume ones, None if it failed,
+                with its checksum if the upload was verified
+            error: str = Why the upload failed
+        """
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "path": str(Path(file_path).resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "status": "uploaded" if results is not None else "failed",
+        }
+        if results is not None:
+            entry["results"] = [{key: result.get(key) for key in ("name", "slug", "url")} for result in results]
+            for recorded, result in zip(entry["results"], results):
+                # Only there when the connection hashes what it uploads
+                if "checksum" in result:
+                    recorded["checksum"] = result["checksum"]
+            self._uploaded.add((entry["path"], entry["size"], entry["mtime_ns"]))
+        else:
+            entry["error"] = error
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+class _Inotify:
+    """Non-blocking inotify instance watching directory trees, through libc."""
+
+    def __init__(self) -> None:  # noqa
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, str] = {}
+
+    def add_tree(self, directory: str, recursive: bool) -> None:
+        """Watch a directory, and its subdirectories if recursive."""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            logging.warning(f"[W] Can't watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return
+        self._dirs[wd] = directory
+        if recursive:
+            try:
+                with os.scandir(directory) as entries:
+                    subdirs = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+            except OSError:
+                return
+            for subdir in subdirs:
+                self.add_tree(subdir, recursive)
+
+    def read(self) -> Optional[List[Tuple[str, int]]]:
+        """Path and mask of every event since the last read, None if some were lost."""
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if wd in self._dirs and name:
+                    events.append((os.path.join(self._dirs[wd], os.fsdecode(name)), mask))
+
+    def close(self) -> None:  # noqa: D102
+        os.close(self._fd)
+
+
+class FolderWatcher:
+    """
+    Watch folders for files, yielding each of them once its size and modification time stop changing.
+
+    Changes are picked up through inotify on Linux, with a full scan only at startup or if events were lost.
+    Elsewhere the folders are rescanned with os.scandir every poll_interval.
+
+    Args:
+        folders: List[PathLike] = Folders to watch
+        recursive: bool = Also watch subfolders
+        include: Optional[List[str]] = Only files matching one of these globs are yielded
+        exclude: Optional[List[str]] = Files and folders matching any of these globs are ignored
+        stable_for: float = Seconds a file must stay unchanged before it is yielded
+        poll_interval: float = Seconds between checks for changes
+        use_inotify: bool = Use inotify when available, rather than rescanning
+    """
+
+    def __init__(  # noqa
+        self,
+        folders: List[PathLike],
+        recursive: bool = True,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        stable_for: float = 5.0,
+        poll_interval: float = 2.0,
+        use_inotify: bool = True,
+    ) -> None:
+        self.folders = [Path(folder).resolve() for folder in folders]
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.stable_for = stable_for
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and sys.platform.startswith("linux")
+
+    async def files(self) -> AsyncIterator[Tuple[Path, os.stat_result]]:
+        """Yield every stable file, then each new or changed one as it becomes stable, forever."""
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = _Inotify()
+            except (OSError, AttributeError) as e:
+                logging.warning(f"[W] inotify unavailable ({e}), polling instead")
+        try:
+            if inotify is not None:
+                for folder in self.folders:
+                    inotify.add_tree(str(folder), self.recursive)
+            # Path -> size and mtime_ns last seen, and since when they haven't changed
+            pending: Dict[Path, Tuple[int, int, float]] = {}
+            # Path -> size and mtime_ns of files already yielded
+            yielded: Dict[Path, Tuple[int, int]] = {}
+            rescan = True
+            while True:
+                if rescan or inotify is None:
+                    # The scan stats every file already, so pending files need no other check
+                    found = dict(await anyio.to_thread.run_sync(self._scan))
+                    for path in set(yielded).difference(found):
+                        del yielded[path]
+                else:
+                    found = {path: self._stat(path) for path in pending}
+                rescan = False
+                now = time.monotonic()
+                for path, stat in found.items():
+                    if stat is None or yielded.get(path) == (stat.st_size, stat.st_mtime_ns):
+                        pending.pop(path, None)
+                        continue
+                    size, mtime_ns, since = pending.get(path, (None, None, now))
+                    if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                        pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+                    elif now - since >= self.stable_for:
+                        del pending[path]
+                        yielded[path] = (stat.st_size, stat.st_mtime_ns)
+                        yield path, stat
+                await anyio.sleep(self.poll_interval)
+                if inotify is not None:
+                    events = inotify.read()
+                    if events is None:
+                        logging.warning("[W] Some file events were lost, rescanning")
+                        rescan = True
+                        continue
+                    for event_path, mask in events:
+                        if mask & IN_ISDIR:
+                            if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+                                # Files may have landed in it before it was watched
+                                inotify.add_tree(event_path, self.recursive)
+                                rescan = True
+                        elif mask & (IN_DELETE | IN_MOVED_FROM):
+                            yielded.pop(Path(event_path), None)
+                            pending.pop(Path(event_path), None)
+                        elif self._wanted(event_path):
+                            pending.setdefault(Path(event_path), (-1, -1, time.monotonic()))
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _scan(self) -> List[Tuple[Path, os.stat_result]]:
+        return [
+            (folder / rel_path, stat)
+            for folder in self.folders
+            for rel_path, stat in scan_tree(folder, self.recursive, self.include, self.exclude)
+        ]
+
+    def _wanted(self, file_path: str) -> bool:
+        # The same filtering as scan_tree, without walking the folder again
+        for folder in self.folders:
+            try:
+                parts = Path(file_path).relative_to(folder).parts
+            except ValueError:
+                continue
+            if not self.recursive and len(parts) > 1:
+                return False
+            # scan_tree prunes excluded folders, so every level of the path is checked against exclude
+            for depth in range(1, len(parts) + 1):
+                rel_path = "/".join(parts[:depth])
+                if any(
+                    fnmatch(rel_path, pattern) or fnmatch(parts[depth - 1], pattern) for pattern in self.exclude or []
+                ):
+                    return False
+            rel_path = "/".join(parts)
+            return not self.include or any(
+                fnmatch(rel_path, pattern) or fnmatch(parts[-1], pattern) for pattern in self.include
+            )
+        return False
+
+    @staticmethod
+    def _stat(file_path: Path) -> Optional[os.stat_result]:
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return None
+        return stat if file_path.is_file() else None
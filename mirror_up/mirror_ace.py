@@ -4,13 +4,17 @@
 import logging
 import math
 import mimetypes
-from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import shutil
+import tempfile
+import time
 from os import PathLike, getenv, path, remove
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
 
+import anyio
 import httpx
-import trio
 
 # from alive_progress import alive_bar
 #           with alive_bar(chunks, bar="smooth", spinner="dots_waves") as bar:
@@ -19,31 +23,265 @@ from dotenv import load_dotenv
 from format_byte import format_byte
 from httpx._utils import peek_filelike_length
 
-from mirror_up._utils import archive_directory, read_in_chunks, split_directory
+from mirror_up._journal import UploadJournal
+from mirror_up._metrics import MetricsHook
+from mirror_up._scheduler import UploadScheduler
+from mirror_up._session import EXPIRY_MARGIN, account_id, load_session, save_session, session_expiry
+from mirror_up._transport import TransportConfig
+from mirror_up._utils import (
+    READ_SIZE,
+    BufferFile,
+    BufferPool,
+    FileRange,
+    StreamDigest,
+    TarStream,
+    archive_directory,
+    digest_bytes,
+    hash_files,
+    pack_files,
+    read_into,
+    skip_bytes,
+    split_directory,
+    split_ranges,
+)
 
+# Modules of optional features are imported where they're used, so plain uploads don't load them
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from mirror_up._index import BundleIndex, DedupIndex
+    from mirror_up._manifest import SyncManifest
+    from mirror_up._plan import PlannedUpload, ThroughputHistory
+    from mirror_up._watch import FolderWatcher, UploadLedger
+
+# The only place .env is loaded, ahead of anything reading ZIP_SAVE or the API credentials
 load_dotenv()
 
+# Chunk buffers of every connection that isn't given its own pool
+BUFFERS = BufferPool()
+
+# Base and maximum delay, in seconds, between attempts of a failed request
+RETRY_BACKOFF = 1
+RETRY_BACKOFF_MAX = 60
+
+# hashlib algorithms uploads can be checked with
+CHECKSUMS = ("sha256", "sha512", "blake2b", "blake2s")
+
+
+class UploadError(Exception):
+    """
+    Raised when a chunk of an upload can't be sent, even after retrying it.
+
+    Args:
+        file_name: str = Name of the upload
+        range_start: int = First byte of the failed chunk
+        range_end: int = Last byte of the failed chunk
+        reason: str = Why the chunk failed
+
+    Attributes:
+        file_name: str = Name of the upload
+        range_start: int = First byte of the failed chunk
+        range_end: int = Last byte of the failed chunk
+    """
+
+    def __init__(self, file_name: str, range_start: int, range_end: int, reason: str) -> None:  # noqa
+        super().__init__(f"{file_name}: bytes {range_start}-{range_end} failed to upload ({reason})")
+        self.file_name = file_name
+        self.range_start = range_start
+        self.range_end = range_end
+
+
+class SessionError(Exception):
+    """Raised when MirrorAce refuses to start an upload session, e.g. because of invalid credentials."""
+
 
 class MirrorAceConnection:
     """
     Methods to use on a MirrorAce connection
 
+    The upload session is only started by the first upload, so creating a connection costs no request.
+    Used from synchronous code, every upload method closes the client once done, so each connection serves
+    a single call. From async code, under trio or asyncio, use create() or async with instead: the connection
+    then stays open for any number of uploads, made concurrently if needed, until it is closed.
+
+    Example:
+        async with await MirrorAceConnection.create(api_key, api_token) as connection:
+            results = await connection.upload_many(paths)
+
     Args:
         api_key : str = MirrorAce's API key
         api_token: str = MirrorAce's API token
+        chunk_window: int = Maximum number of chunks uploaded concurrently
+        stream_split: bool = Upload oversized files' volumes by offset, without temporary files
+        stream_archive: bool = Upload folders as a tar produced on the fly, without temporary files
+        session_cache: bool = Also cache upload sessions on disk, to reuse them across runs
+        journal: Optional[UploadJournal] = Journal recording upload progress
+        resume: bool = Continue uploads from the progress found in the journal
+        max_attempts: int = Times each request is attempted before giving up on it
+        buffers: Optional[BufferPool] = Pool chunk buffers are taken from, defaults to the process-wide BUFFERS
+        scheduler: Optional[UploadScheduler] = Adaptive limit on requests in flight and upload rate
+        index: Optional[DedupIndex] = Index of uploaded content, files already in it aren't uploaded again
+        revalidate: bool = Check that indexed uploads still exist on MirrorAce before skipping files
+        info_batch_size: int = Maximum number of slugs asked about in a single get_file_info request
+        info_concurrency: int = Maximum number of get_file_info requests in flight at once
+        info_ttl: Optional[float] = Seconds get_file_info results are cached for, they aren't cached if None
+        transport: Optional[httpx.AsyncBaseTransport] = Transport the client sends requests through
+        metrics: Optional[MetricsHook] = Hook receiving timing spans and counters of the connection's uploads
+        compression: Optional[str] = Codec uploads are compressed with, one of gzip, bz2, xz or zstd
+        compression_level: Optional[int] = Compression level, the codec's default if None
+        part_concurrency: int = Maximum number of multi-volume parts uploaded concurrently
+        checksum: Optional[str] = One of CHECKSUMS, uploads are hashed with it as they are read, then checked against
+            their size on MirrorAce, and their digest is added to their result
+        transport_config: Optional[TransportConfig] = HTTP version, connection limits, timeouts and socket buffers
+            of the client, TransportConfig's defaults if None
+        history: Optional[ThroughputHistory] = History the throughput of the connection's uploads is recorded in
+        handshake: bool = Start the upload session from __init__ rather than on the first upload, which must then
+            run outside any event loop
 
     Attributes:
         api_key : str = MirrorAce's API key
         api_token: str = MirrorAce's API token
+        chunk_window: int = Maximum number of chunks uploaded concurrently
+        stream_split: bool = Upload oversized files' volumes by offset, without temporary files
+        stream_archive: bool = Upload folders as a tar produced on the fly, without temporary files
+        session_cache: bool = Also cache upload sessions on disk, to reuse them across runs
+        journal: Optional[UploadJournal] = Journal recording upload progress
+        resume: bool = Continue uploads from the progress found in the journal
+        max_attempts: int = Times each request is attempted before giving up on it
+        buffers: Optional[BufferPool] = Pool chunk buffers are taken from, defaults to the process-wide BUFFERS
+        scheduler: Optional[UploadScheduler] = Adaptive limit on requests in flight and upload rate
+        index: Optional[DedupIndex] = Index of uploaded content, files already in it aren't uploaded again
+        revalidate: bool = Check that indexed uploads still exist on MirrorAce before skipping files
+        info_batch_size: int = Maximum number of slugs asked about in a single get_file_info request
+        info_concurrency: int = Maximum number of get_file_info requests in flight at once
+        info_ttl: Optional[float] = Seconds get_file_info results are cached for, they aren't cached if None
+        transport: Optional[httpx.AsyncBaseTransport] = Transport the client sends requests through
+        metrics: Optional[MetricsHook] = Hook receiving timing spans and counters of the connection's uploads
+        compression: Optional[str] = Codec uploads are compressed with, one of gzip, bz2, xz or zstd
+        compression_level: Optional[int] = Compression level, the codec's default if None
+        part_concurrency: int = Maximum number of multi-volume parts uploaded concurrently
+        checksum: Optional[str] = Algorithm uploads are hashed with as they are read, not hashed if None
+        transport_config: TransportConfig = HTTP version, connection limits, timeouts and socket buffers of the client
+        history: Optional[ThroughputHistory] = History the throughput of the connection's uploads is recorded in
     """
 
-    def __init__(self, api_key: str, api_token: str) -> None:  # noqa
+    def __init__(  # noqa
+        self,
+        api_key: str,
+        api_token: str,
+        chunk_window: int = 4,
+        stream_split: bool = True,
+        stream_archive: bool = True,
+        session_cache: bool = False,
+        journal: Optional[UploadJournal] = None,
+        resume: bool = False,
+        max_attempts: int = 5,
+        buffers: Optional[BufferPool] = None,
+        scheduler: Optional[UploadScheduler] = None,
+        index: Optional["DedupIndex"] = None,
+        revalidate: bool = False,
+        info_batch_size: int = 100,
+        info_concurrency: int = 4,
+        info_ttl: Optional[float] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        metrics: Optional[MetricsHook] = None,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+        part_concurrency: int = 4,
+        checksum: Optional[str] = None,
+        transport_config: Optional[TransportConfig] = None,
+        history: Optional["ThroughputHistory"] = None,
+        handshake: bool = False,
+    ) -> None:
         self.params: dict = {"api_key": api_key, "api_token": api_token}
         self.api_key = api_key
         self.api_token = api_token
+        # Number of chunk requests allowed in flight at once
+        self.chunk_window = max(1, chunk_window)
+        # Upload multi-volume parts straight from the source file instead of splitting into ZIP_SAVE first
+        self.stream_split = stream_split
+        # Upload folders as a tar produced on the fly instead of archiving them into ZIP_SAVE first
+        self.stream_archive = stream_archive
+        # Keep upload sessions in the user cache dir, so later runs can skip the handshake
+        self.session_cache = session_cache
+        self._session_lock = anyio.Lock()
+        # Key handed out by the last renewal after a rejection, a rejection under it isn't the session's fault
+        self._renewed_key: Optional[str] = None
+        self.journal = journal
+        self.resume = resume
+        self.max_attempts = max(1, max_attempts)
+        # Its limit caps the memory used by chunk data, across every upload sharing the pool
+        self.buffers = buffers if buffers is not None else BUFFERS
+        # Paces the requests of every upload made through the connection
+        self.scheduler = scheduler if scheduler is not None else UploadScheduler(chunk_window)
+        self.index = index
+        self.revalidate = revalidate
+        self.info_batch_size = max(1, info_batch_size)
+        self.info_concurrency = max(1, info_concurrency)
+        self.info_ttl = info_ttl
+        # Slug -> (time fetched, file info), only filled when info_ttl is set
+        self._info_cache: Dict[str, Tuple[float, dict]] = {}
+        self.transport = transport
+        self.metrics = metrics if metrics is not None else MetricsHook()
+        if compression is not None:
+            from mirror_up._compress import available_codecs
+
+            if compression not in available_codecs():
+                raise ValueError(f"Unavailable codec: {compression}, use one of {', '.join(available_codecs())}")
+        self.compression = compression
+        self.compression_level = compression_level
+        # Started on the first compressed upload, then shared by every later one until the connection closes
+        self._executor: Optional["ProcessPoolExecutor"] = None
+        # Each part in flight has up to chunk_window chunks of its own in flight
+        self.part_concurrency = max(1, part_concurrency)
+        if checksum is not None and checksum not in CHECKSUMS:
+            raise ValueError(f"Unknown checksum: {checksum}, use one of {', '.join(CHECKSUMS)}")
+        self.checksum = checksum
+        # Inside async with, the client stays open between uploads
+        self._managed = False
+        self.transport_config = transport_config if transport_config is not None else TransportConfig()
+        self.history = history
+        # Uploads overlapping each other make up a single run of the history, with the bytes sent since it started
+        self._running = 0
+        self._run_bytes = 0
         # Make client persistent throughout the instance
-        self.Client = httpx.AsyncClient(verify=True)
-        trio.run(self._get_upload)
+        self.Client = self.transport_config.client(transport)
+        if handshake:
+            anyio.run(self._get_upload, backend="trio")
+
+    @classmethod
+    async def create(cls, api_key: str, api_token: str, **kwargs) -> "MirrorAceConnection":
+        """
+        Create a connection from inside a running event loop, starting its upload session.
+
+        Args:
+            api_key : str = MirrorAce's API key
+            api_token: str = MirrorAce's API token
+            kwargs = Any other argument of MirrorAceConnection
+        """
+        connection = cls(api_key, api_token, handshake=False, **kwargs)
+        await connection._get_upload()
+        return connection
+
+    async def __aenter__(self) -> "MirrorAceConnection":  # noqa: D105
+        self._managed = True
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:  # noqa: D105
+        self._managed = False
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Close the connection's client, and stop its compression processes."""
+        await self.Client.aclose()
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await anyio.to_thread.run_sync(executor.shutdown)
+
+    async def _release_client(self) -> None:
+        # Connections used without async with only serve a single call
+        if not self._managed:
+            await self.aclose()
 
     async def __call__(self, file_path: PathLike, password: Optional[str] = None) -> None:
         """
@@ -55,48 +293,363 @@ class MirrorAceConnection:
             file_path: PathLike = The file/folder's path
             password: Optional[str] = Upload's password, if desired.
         """
+        try:
+            with self.metrics.span("upload"):
+                return await self._upload(file_path, password)
+        finally:
+            await self._release_client()
 
-        async def _upload_chunks(file: PathLike) -> httpx.Response:
-            """Use to upload file in chunks."""
-            file_name = Path(file).name
-            with open(file, "rb") as file:
-                chunk_size = int(self.params["max_chunk_size"])
-                file_size = peek_filelike_length(file)
-                chunks = math.ceil(file_size / chunk_size)
-                last_range = False
-                i = 0
-                while i < chunks:
-                    range_start = 0
-                    range_end = min(chunk_size, file_size - 1)
-                    if last_range is not False:
-                        range_start = last_range + 1
-                        range_end = min(range_start + chunk_size, file_size - 1)
-                    last_range = range_end
-                    chunk = next(read_in_chunks(int(self.params["max_chunk_size"]), file))
-                    files = {"files": (file_name, chunk)}
-                    # Required headers
-                    headers = {
-                        "Content-Range": "bytes" + str(range_start) + "-" + str(range_end) + "/" + str(file_size)
-                    }
-                    if password is not None:
-                        self.params.update({"file_password": password})
-                    req = await self.Client.post(
-                        self.params["server_file"], files=files, data=self.params, headers=headers, timeout=1800
-                    )
-                    i += 1
-            return req
+    async def upload_many(
+        self,
+        file_paths: List[PathLike],
+        password: Optional[str] = None,
+        max_files: int = 4,
+        on_result: Optional[Callable[[int, Union[httpx.Response, List[httpx.Response], None]], None]] = None,
+    ) -> List[Union[httpx.Response, List[httpx.Response], None]]:
+        """
+        Upload several files/folders concurrently, sharing this connection's client and upload session.
+
+        With an index, files whose content has already been uploaded are skipped and get the earlier upload's
+        result instead. Uploads with a password are never deduplicated.
+
+        Args:
+            file_paths: List[PathLike] = The files/folders' paths
+            password: Optional[str] = Upload's password, if desired.
+            max_files: int = Maximum number of files uploaded at the same time
+            on_result: Optional[Callable] = Called with each path's position and result as soon as it is known
+
+        Returns:
+            List = Each path's result, in the same order, None for the ones that failed
+        """
+        try:
+            return await self._upload_many(file_paths, password, anyio.CapacityLimiter(max(1, max_files)), on_result)
+        finally:
+            await self._release_client()
+
+    async def _upload_many(
+        self,
+        file_paths: List[PathLike],
+        password: Optional[str],
+        limiter: anyio.CapacityLimiter,
+        on_result: Optional[Callable[[int, Union[httpx.Response, List[httpx.Response], None]], None]] = None,
+        errors: Optional[Dict[int, Exception]] = None,
+    ) -> List[Union[httpx.Response, List[httpx.Response], None]]:
+        """Body of upload_many, leaving the client open, filling errors with the error each failed path raised."""
+        results = [None] * len(file_paths)
+
+        async def _upload_one(i: int, file_path: PathLike) -> None:
+            async with limiter:
+                try:
+                    with self.metrics.span("upload"):
+                        results[i] = await self._upload(file_path, password)
+                except (httpx.HTTPError, OSError, UploadError, SessionError) as e:
+                    logging.error(f"Error: {Path(file_path).name} failed to upload ({e!r})")
+                    if errors is not None:
+                        errors[i] = e
+            if i in digests:
+                self._index_result(*digests[i], results[i])
+            if on_result is not None:
+                on_result(i, results[i])
+
+        digests = await self._deduplicate(file_paths, results) if self.index and password is None else {}
+        self._start_run()
+        try:
+            async with anyio.create_task_group() as task_group:
+                for i, file_path in enumerate(file_paths):
+                    if results[i] is None:
+                        task_group.start_soon(_upload_one, i, file_path)
+                    elif on_result is not None:
+                        on_result(i, results[i])
+        finally:
+            self._finish_run()
+        return results
+
+    def _start_run(self) -> None:
+        if not self._running:
+            self._run_bytes = self.scheduler.bytes_sent
+            if self.history is not None:
+                self.history.start_run()
+        self._running += 1
+
+    def _finish_run(self) -> None:
+        self._running -= 1
+        if self.history is not None and not self._running:
+            self.history.finish_run(self.scheduler.bytes_sent - self._run_bytes)
+
+    async def plan(self, file_paths: List[PathLike]) -> List["PlannedUpload"]:
+        """
+        Plan how each file/folder would be uploaded, reading nothing but stats and uploading nothing.
 
-        async def part_upload(part: PathLike) -> None:
-            file_name = Path(part).name
-            req = await _upload_chunks(part)
-            await self._get_upload()
-            if self._check_success(req):
-                logging.info(f"[I] {file_name} has been uploaded")
-                logging.info(f"[I] File has been uploaded to: {req.json()['result']['url']}")
+        Routes follow the session's max_chunk_size and max_file_size, so a session is started unless one is cached.
+        history.estimate gives the time the plans' total size should take.
+
+        Args:
+            file_paths: List[PathLike] = The files/folders' paths
+
+        Returns:
+            List[PlannedUpload] = Plan of each path, in the same order, without the paths that don't exist
+        """
+        from mirror_up._plan import plan_uploads
+
+        try:
+            await self._ensure_session()
+        finally:
+            await self._release_client()
+        return await anyio.to_thread.run_sync(
+            plan_uploads,
+            file_paths,
+            int(self.params["max_chunk_size"]),
+            int(self.params["max_file_size"]),
+            self.stream_split,
+            self.stream_archive,
+            self.compression,
+        )
+
+    async def upload_packed(
+        self,
+        folder: PathLike,
+        password: Optional[str] = None,
+        max_files: int = 4,
+        bundle_size: Optional[int] = None,
+        pack_under: int = 1024 * 1024,
+        bundle_index: Optional["BundleIndex"] = None,
+    ) -> Dict[str, Union[httpx.Response, List[httpx.Response], None]]:
+        """
+        Upload every file within a folder, packing the small ones into tar bundles.
+
+        Bundles are produced on the fly and each of them is uploaded as a single file, so thousands of tiny
+        files only take a handful of uploads. Files of pack_under bytes or more are uploaded on their own.
+
+        Args:
+            folder: PathLike = Folder to upload, subfolders included
+            password: Optional[str] = Upload's password, if desired.
+            max_files: int = Maximum number of bundles and files uploaded at the same time
+            bundle_size: Optional[int] = Largest bundle, capped to and defaulting to max_file_size
+            pack_under: int = Size from which files are uploaded on their own rather than packed
+            bundle_index: Optional[BundleIndex] = Index recording the bundle and offset of every packed file
+
+        Returns:
+            Dict = Result of each bundle and of each file uploaded on its own, by upload name, None if it failed
+        """
+        try:
+            return await self._upload_packed(folder, password, max_files, bundle_size, pack_under, bundle_index)
+        finally:
+            await self._release_client()
+
+    async def _upload_packed(
+        self,
+        folder: PathLike,
+        password: Optional[str],
+        max_files: int,
+        bundle_size: Optional[int],
+        pack_under: int,
+        bundle_index: Optional["BundleIndex"],
+    ) -> Dict[str, Union[httpx.Response, List[httpx.Response], None]]:
+        """Body of upload_packed, leaving the client open."""
+        from mirror_up._manifest import scan_tree
+
+        await self._ensure_session()
+        max_file_size = int(self.params["max_file_size"])
+        bundle_size = min(bundle_size or max_file_size, max_file_size)
+        files = sorted(scan_tree(folder))
+        small = [(rel_path, stat.st_size) for rel_path, stat in files if stat.st_size < min(pack_under, bundle_size)]
+        large = [rel_path for rel_path, stat in files if stat.st_size >= min(pack_under, bundle_size)]
+        bundles = pack_files(small, bundle_size)
+        logging.info(f"[I] Packing {len(small)} files into {len(bundles)} bundles, {len(large)} files go on their own")
+        limiter = anyio.CapacityLimiter(max(1, max_files))
+        results = {}
+
+        async def _upload_bundle(bundle_name: str, members: List[str]) -> None:
+            async with limiter:
+                try:
+                    with self.metrics.span("upload"):
+                        stream = TarStream(files=[(Path(folder, rel_path), rel_path) for rel_path in members])
+                        journal_key = self._journal_key(Path(folder, bundle_name), stream.size, stream.mtime)
+                        with stream:
+                            req = await self._upload_stream(stream, stream.size, bundle_name, password, journal_key)
+                    self._finish_journal(journal_key, req)
+                except (httpx.HTTPError, OSError, UploadError, SessionError) as e:
+                    logging.error(f"Error: {bundle_name} failed to upload ({e!r})")
+                    req = None
+            results[bundle_name] = req
+            if bundle_index is not None and req is not None and self._check_success(req):
+                bundle_index.add(
+                    req.json()["result"]["slug"],
+                    bundle_name,
+                    [(Path(folder, name), offset, size) for name, (offset, size) in stream.members.items()],
+                )
+
+        # Bundles and large files make up a single run
+        self._start_run()
+        try:
+            async with anyio.create_task_group() as task_group:
+                for i, members in enumerate(bundles, start=1):
+                    task_group.start_soon(_upload_bundle, f"{Path(folder).resolve().name}.bundle{i:04d}.tar", members)
+                large_results = await self._upload_many(
+                    [Path(folder, rel_path) for rel_path in large], password, limiter
+                )
+        finally:
+            self._finish_run()
+        results.update(zip(large, large_results))
+        return results
+
+    async def sync(
+        self,
+        folder: PathLike,
+        password: Optional[str] = None,
+        max_files: int = 4,
+        recursive: bool = True,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        manifest: Optional["SyncManifest"] = None,
+    ) -> Dict[str, Union[httpx.Response, List[httpx.Response], None]]:
+        """
+        Upload the files of a folder that are new or changed since its last sync.
+
+        Each file is uploaded on its own, subfolders are walked rather than archived. The manifest is
+        updated as uploads complete and saved even if the sync is interrupted, so failed or unfinished
+        files are picked up again by the next sync.
+
+        Args:
+            folder: PathLike = Folder to sync
+            password: Optional[str] = Upload's password, if desired.
+            max_files: int = Maximum number of files uploaded at the same time
+            recursive: bool = Also sync the files inside subfolders
+            include: Optional[List[str]] = Only files matching one of these globs are synced
+            exclude: Optional[List[str]] = Files and folders matching any of these globs are skipped
+            manifest: Optional[SyncManifest] = Manifest of the folder, defaults to the one in the user cache dir
+
+        Returns:
+            Dict = Result of each uploaded file, by path relative to folder, None for the ones that failed
+        """
+        from mirror_up._manifest import SyncManifest, scan_tree
+
+        manifest = manifest if manifest is not None else SyncManifest(folder)
+        scanned = list(scan_tree(folder, recursive, include, exclude))
+        for rel_path in manifest.prune([rel_path for rel_path, _ in scanned]):
+            logging.debug(f"[D] {rel_path} is no longer in {Path(folder).name}")
+        changed = [(rel_path, stat) for rel_path, stat in scanned if manifest.changed(rel_path, stat)]
+        logging.info(f"[I] {len(changed)} of {len(scanned)} files in {Path(folder).name} are new or changed")
+
+        def _record(i: int, result: Union[httpx.Response, List[httpx.Response], None]) -> None:
+            responses = result if isinstance(result, list) else [result]
+            if all(req is not None and self._check_success(req) for req in responses):
+                manifest.record(*changed[i], [req.json()["result"]["slug"] for req in responses])
+
+        try:
+            results = await self.upload_many(
+                [Path(folder, rel_path) for rel_path, _ in changed], password, max_files, _record
+            )
+        finally:
+            manifest.save()
+        return {rel_path: result for (rel_path, _), result in zip(changed, results)}
+
+    async def watch(
+        self,
+        watcher: "FolderWatcher",
+        ledger: "UploadLedger",
+        password: Optional[str] = None,
+        workers: int = 4,
+    ) -> None:
+        """
+        Upload files as the watcher finds them, until cancelled.
+
+        Stable files are queued for a fixed pool of workers, which share this connection's client and upload
+        session, and every outcome is appended to the ledger. Files the ledger has as uploaded with the same
+        size and modification time are skipped, so a restarted watch picks up where the last one stopped.
+
+        Args:
+            watcher: FolderWatcher = Watcher of the folders to upload from
+            ledger: UploadLedger = Ledger of uploaded and failed files
+            password: Optional[str] = Upload's password, if desired.
+            workers: int = Number of files uploaded at the same time
+        """
+
+        async def _worker(queue: anyio.abc.ObjectReceiveStream) -> None:
+            async with queue:
+                async for file_path, stat in queue:
+                    try:
+                        # Watching outlives upload keys, uploads still running keep the session they started with
+                        await self.refresh_session()
+                    except httpx.HTTPError as e:
+                        logging.error(f"Error: upload session couldn't be renewed ({e!r})")
+                    # Goes through the index like any other batch, a single file at a time
+                    (result,) = await self._upload_many([file_path], password, limiter)
+                    responses = result if isinstance(result, list) else [result]
+                    failed = [req for req in responses if req is None or not self._check_success(req)]
+                    if not failed:
+                        ledger.record(file_path, stat, [req.json()["result"] for req in responses])
+                    else:
+                        ledger.record(
+                            file_path, stat, None, "failed to upload" if failed[0] is None else failed[0].text
+                        )
+
+        limiter = anyio.CapacityLimiter(max(1, workers))
+        send, receive = anyio.create_memory_object_stream(math.inf)
+        try:
+            async with anyio.create_task_group() as task_group:
+                async with receive:
+                    for _ in range(max(1, workers)):
+                        task_group.start_soon(_worker, receive.clone())
+                async with send:
+                    async for file_path, stat in watcher.files():
+                        if ledger.uploaded(file_path, stat):
+                            logging.debug(f"[D] {file_path.name} has already been uploaded")
+                            continue
+                        logging.info(f"[I] Queueing {file_path.name}")
+                        await send.send((file_path, stat))
+        finally:
+            await self._release_client()
+
+    async def _deduplicate(
+        self, file_paths: List[PathLike], results: List[Union[httpx.Response, List[httpx.Response], None]]
+    ) -> Dict[int, Tuple[str, int]]:
+        """
+        Fill in the results of files already found in the index.
+
+        Returns:
+            Dict[int, Tuple[str, int]] = Digest and size of every file left to upload, by position
+        """
+        files = {i: file_path for i, file_path in enumerate(file_paths) if path.isfile(file_path)}
+        logging.debug(f"[D] Hashing {len(files)} files")
+        with self.metrics.span("hash"):
+            hashes = await anyio.to_thread.run_sync(hash_files, list(files.values()))
+        digests = {i: (digest, os.path.getsize(file_path)) for (i, file_path), digest in zip(files.items(), hashes)}
+        known = {i: self.index.lookup(*digests[i]) for i in digests}
+        known = {i: response for i, response in known.items() if response is not None}
+        if known and self.revalidate:
+            slugs = {
+                i: [r["result"]["slug"] for r in (res if isinstance(res, list) else [res])] for i, res in known.items()
+            }
+            info = await self.get_file_info(sorted({slug for file_slugs in slugs.values() for slug in file_slugs}))
+            if info is None:
+                logging.warning("[W] Couldn't check whether indexed uploads still exist")
             else:
-                logging.error("Error: ", req.json())
-            return req
+                found = info.json()["result"]
+                for i, file_slugs in slugs.items():
+                    if any(found.get(slug, {}).get("status") in (None, "not found") for slug in file_slugs):
+                        logging.info(f"[I] {Path(file_paths[i]).name} is no longer on MirrorAce, uploading it again")
+                        self.index.remove(*digests[i])
+                        del known[i]
+        for i, response in known.items():
+            logging.info(f"[I] {Path(file_paths[i]).name} has already been uploaded, skipping it")
+            if isinstance(response, list):
+                results[i] = [httpx.Response(200, json=part) for part in response]
+            else:
+                results[i] = httpx.Response(200, json=response)
+            del digests[i]
+        return digests
+
+    def _index_result(self, digest: str, size: int, result: Union[httpx.Response, List[httpx.Response], None]) -> None:
+        responses = result if isinstance(result, list) else [result]
+        if all(req is not None and self._check_success(req) for req in responses):
+            self.index.add(digest, size, [req.json() for req in result] if isinstance(result, list) else result.json())
 
+    async def _upload(
+        self, file_path: PathLike, password: Optional[str] = None
+    ) -> Union[httpx.Response, List[httpx.Response]]:
+        """Upload a file/folder, leaving the client open."""
+        await self._ensure_session()
         if path.isfile(file_path):
             with open(file_path, "rb") as file:
                 content_size = peek_filelike_length(file)
@@ -104,81 +657,664 @@ class MirrorAceConnection:
                 logging.info(f"[I] File being uploaded: {file_name}")
                 # File size formatted into readable format.
                 logging.debug(f"[D] File size: {format_byte(content_size)}")
-                if content_size > int(self.params["max_file_size"]):
-                    if not Path(getenv("ZIP_SAVE")).is_dir():
-                        logging.info(f"[D] Creating tar save folder")
-                        Path(getenv("ZIP_SAVE")).mkdir()
-                    logging.info(f"[D] Splitting {file_name} into multi-volume archive")
-                    split_directory(Path(file_path), int(self.params["max_file_size"]))
-                    with ThreadPoolExecutor() as executor:
-                        futures = [
-                            executor.submit(part_upload, path)
-                            for path in Path(f"{getenv('ZIP_SAVE') + Path(file_path).stem}/").iterdir()
-                        ]
-                        result = [await future.result() for future in futures]
-                    await self.Client.aclose()
-                    remove(Path(f'{getenv("ZIP_SAVE")}/{Path(file_path).stem}/'))
-                    return result
-                if content_size < int(self.params["max_chunk_size"]):
-                    payload = {"files": (file_name, file, mimetypes.guess_type(file_path)[0])}
-                    if password is not None:
-                        self.params.update({"file_password": password})
-                    req = await self.Client.post(self.params["server_file"], files=payload, data=self.params)
-                    if self._check_success(req):
-                        logging.info(f"[I] {file_name} has been uploaded")
-                        logging.info(f"[I] File has been uploaded to: {req.json()['result']['url']}")
-                    else:
-                        logging.error("Error: ", req)
-                    await self.Client.aclose()
-                    return req
+                journal_key = self._journal_key(file_path, content_size, os.stat(file_path).st_mtime_ns)
+                result = None
+                if self.compression is not None:
+                    from mirror_up._compress import is_compressed
+
+                    if not is_compressed(file_path):
+                        result = await self._upload_compressed(file, content_size, file_name, password, journal_key)
+                        # Uploaded as is when compressing didn't pay off
+                        file.seek(0)
+                if result is None and content_size > int(self.params["max_file_size"]) and not self.stream_split:
+                    result = await self._split_upload(file_path, password, journal_key)
+                elif result is None:
+                    result = await self._upload_stream(file, content_size, file_name, password, journal_key)
+            self._finish_journal(journal_key, result)
+            return result
+        if path.isdir(file_path):
+            if self.stream_archive:
+                try:
+                    stream = TarStream(file_path)
+                except OSError as e:
+                    logging.warning(f"[W] Can't stream {Path(file_path).name} ({e}), archiving it first")
                 else:
-                    req = await _upload_chunks(file_path)
-                    if self._check_success(req):
-                        logging.info(f"[I] {file_name} has been uploaded")
-                        logging.info(f"[I] File has been uploaded to: {req.json()['result']['url']}")
-                    await self.Client.aclose()
+                    logging.info(f"[I] File being uploaded: {Path(file_path).name}.tar")
+                    logging.debug(f"[D] File size: {format_byte(stream.size)}")
+                    journal_key = self._journal_key(file_path, stream.size, stream.mtime)
+                    req = None
+                    if self.compression is not None:
+                        with stream:
+                            req = await self._upload_compressed(
+                                stream, stream.size, f"{Path(file_path).name}.tar", password, journal_key
+                            )
+                        # Compressing used up the stream
+                        stream = TarStream(file_path) if req is None else stream
+                    if req is None:
+                        with stream:
+                            req = await self._upload_stream(
+                                stream, stream.size, f"{Path(file_path).name}.tar", password, journal_key
+                            )
+                    self._finish_journal(journal_key, req)
                     return req
-        if path.isdir(file_path):
             if not Path(getenv("ZIP_SAVE")).is_dir():
                 logging.info(f"[D] Creating tar save folder")
                 Path(getenv("ZIP_SAVE")).mkdir()
             logging.info(f"[D] Archiving {Path(file_path).name}")
-            archive_directory(file_path)
-            req = await self.__call__(f"{getenv('ZIP_SAVE') + Path(file_path).name}.tar")
-            await self.Client.aclose()
+            with self.metrics.span("archive"):
+                archive_directory(file_path)
+            req = await self._upload(f"{getenv('ZIP_SAVE') + Path(file_path).name}.tar", password)
             remove(Path(f'{getenv("ZIP_SAVE")}/{Path(file_path).name}.tar'))
             return req
 
-    def _check_success(self, response: httpx.Response) -> bool:
-        if response.json()["status"] == "success":
+    async def _upload_compressed(
+        self,
+        file: BinaryIO,
+        file_size: int,
+        file_name: str,
+        password: Optional[str] = None,
+        journal_key: Optional[str] = None,
+    ) -> Union[httpx.Response, List[httpx.Response], None]:
+        """
+        Compress the next file_size bytes of file into a temporary file, then upload it in their place.
+
+        Returns:
+            Union[httpx.Response, List[httpx.Response], None] = The upload's result, None if compression didn't
+            make it any smaller, in which case nothing was uploaded
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        from mirror_up._compress import EXTENSIONS, compress_stream
+
+        save = getenv("ZIP_SAVE")
+        workers = os.cpu_count() or 1
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(workers)
+
+        def _acquire(buffer_size: int, wait: bool) -> Optional[bytearray]:
+            # Read-ahead blocks count towards the same memory limit as chunk buffers
+            if wait:
+                return anyio.from_thread.run(self.buffers.acquire, buffer_size)
+            return anyio.from_thread.run_sync(self.buffers.try_acquire, buffer_size)
+
+        def _release(buffer: bytearray) -> None:
+            anyio.from_thread.run_sync(self.buffers.release, buffer)
+
+        with tempfile.TemporaryFile(dir=save if save and path.isdir(save) else None) as compressed:
+            with self.metrics.span("compress"):
+                compressed_size = await anyio.to_thread.run_sync(
+                    compress_stream,
+                    file,
+                    file_size,
+                    compressed,
+                    self.compression,
+                    self.compression_level,
+                    workers,
+                    self._executor,
+                    _acquire,
+                    _release,
+                )
+            if compressed_size >= file_size:
+                logging.debug(f"[D] {file_name} doesn't shrink when compressed, uploading it as is")
+                return None
+            logging.debug(f"[D] {file_name} compressed to {format_byte(compressed_size)}")
+            compressed.seek(0)
+            return await self._upload_stream(
+                compressed, compressed_size, f"{file_name}{EXTENSIONS[self.compression]}", password, journal_key
+            )
+
+    async def _upload_stream(
+        self,
+        file: BinaryIO,
+        file_size: int,
+        file_name: str,
+        password: Optional[str] = None,
+        journal_key: Optional[str] = None,
+    ) -> Union[httpx.Response, List[httpx.Response]]:
+        """
+        Upload the next file_size bytes of file, picking a direct, chunked or multi-volume upload.
+
+        Args:
+            file: BinaryIO = Readable file object, positioned at the start of the upload
+            file_size: int = Number of bytes to upload
+            file_name: str = Name given to the upload
+            password: Optional[str] = Upload's password, if desired.
+            journal_key: Optional[str] = Key of the upload in the journal, if it is being recorded
+        """
+        if file_size > int(self.params["max_file_size"]):
+            # Volumes are plain byte ranges of the source, so they can be read from it in place
+            logging.info(f"[D] Streaming {file_name} as multi-volume parts")
+            parts = list(split_ranges(Path(file_name).stem, file_size, int(self.params["max_file_size"])))
+            if FileRange.supported(file):
+                start = file.tell()
+                return await self._upload_parts(
+                    parts,
+                    lambda _, offset, length: FileRange(file.fileno(), start + offset, length),
+                    password,
+                    journal_key,
+                )
+            # Streams that can only be read in order, like a folder's tar, upload their parts one after the other
+            result = []
+            for part_name, _, length in parts:
+                done = self.journal.part(journal_key, part_name) if journal_key is not None else None
+                if done is not None:
+                    logging.info(f"[I] {part_name} has already been uploaded, skipping it")
+                    skip_bytes(file, length)
+                    result.append(httpx.Response(200, json=done))
+                    continue
+                req = await self._upload_chunks(file, length, part_name, password, journal_key)
+                self._log_upload(req, part_name)
+                self._finish_journal_part(journal_key, part_name, req)
+                result.append(req)
+            return result
+        if file_size < int(self.params["max_chunk_size"]):
+            digest = self._new_digest()
+            if file_size <= READ_SIZE:
+                # Not worth holding a whole chunk buffer for
+                with self.metrics.span("read"):
+                    content = file.read(file_size)
+                self.metrics.count("bytes_read", len(content))
+                if digest is not None:
+                    digest.update(content)
+                payload = {"files": (file_name, content, mimetypes.guess_type(file_name)[0])}
+                req = await self._post_upload(payload, password)
+            else:
+                buffer = await self.buffers.acquire(int(self.params["max_chunk_size"]))
+                try:
+                    content = BufferFile(self._read_chunk(file, buffer, file_size, digest))
+                    payload = {"files": (file_name, content, mimetypes.guess_type(file_name)[0])}
+                    req = await self._post_upload(payload, password)
+                finally:
+                    self.buffers.release(buffer)
+            req = await self._verify_upload(req, file_name, file_size, digest)
+        else:
+            req = await self._upload_chunks(file, file_size, file_name, password, journal_key)
+        self._log_upload(req, file_name)
+        return req
+
+    async def _split_upload(
+        self, file_path: PathLike, password: Optional[str] = None, journal_key: Optional[str] = None
+    ) -> List[httpx.Response]:
+        """Split a file into multi-volume parts inside ZIP_SAVE, then upload each of them."""
+        if not Path(getenv("ZIP_SAVE")).is_dir():
+            logging.info(f"[D] Creating tar save folder")
+            Path(getenv("ZIP_SAVE")).mkdir()
+        logging.info(f"[D] Splitting {Path(file_path).name} into multi-volume archive")
+        with self.metrics.span("split"):
+            split_directory(Path(file_path), int(self.params["max_file_size"]))
+        folder = Path(f"{getenv('ZIP_SAVE') + Path(file_path).stem}/")
+        parts = [(part.name, 0, part.stat().st_size) for part in sorted(folder.iterdir())]
+        result = await self._upload_parts(parts, lambda name, *_: open(folder / name, "rb"), password, journal_key)
+        shutil.rmtree(folder)
+        return result
+
+    async def _upload_parts(
+        self,
+        parts: List[Tuple[str, int, int]],
+        open_part: Callable[[str, int, int], BinaryIO],
+        password: Optional[str] = None,
+        journal_key: Optional[str] = None,
+    ) -> List[httpx.Response]:
+        """
+        Upload the volumes of a multi-volume upload, up to part_concurrency of them at a time.
+
+        Each part is read from its own file object, so parts never wait on each other's reads. Parts the
+        journal has as uploaded are skipped. A failed part doesn't stop the others: every part that can make
+        it does, and is recorded in the journal for a resumed upload to skip, then the first error is raised.
+
+        Args:
+            parts: List[Tuple[str, int, int]] = Name, offset and length of each part, in order
+            open_part: Callable = Opens a part, given its name, offset and length, positioned at its start
+            password: Optional[str] = Upload's password, if desired.
+            journal_key: Optional[str] = Key of the upload in the journal, if it is being recorded
+
+        Returns:
+            List[httpx.Response] = Response of each part, in the same order
+        """
+        limiter = anyio.CapacityLimiter(self.part_concurrency)
+        results: List[Optional[httpx.Response]] = [None] * len(parts)
+        errors: List[Optional[Exception]] = [None] * len(parts)
+
+        async def _upload_part(i: int, part_name: str, offset: int, length: int) -> None:
+            done = self.journal.part(journal_key, part_name) if journal_key is not None else None
+            if done is not None:
+                logging.info(f"[I] {part_name} has already been uploaded, skipping it")
+                results[i] = httpx.Response(200, json=done)
+                return
+            async with limiter:
+                try:
+                    with open_part(part_name, offset, length) as file:
+                        req = await self._upload_chunks(file, length, part_name, password, journal_key)
+                except (httpx.HTTPError, OSError, UploadError, SessionError) as e:
+                    logging.error(f"Error: {part_name} failed to upload ({e!r})")
+                    errors[i] = e
+                    return
+            self._log_upload(req, part_name)
+            self._finish_journal_part(journal_key, part_name, req)
+            results[i] = req
+
+        logging.debug(f"[D] Uploading {len(parts)} parts, {self.part_concurrency} at a time")
+        async with anyio.create_task_group() as task_group:
+            for i, (part_name, offset, length) in enumerate(parts):
+                task_group.start_soon(_upload_part, i, part_name, offset, length)
+        failed = [e for e in errors if e is not None]
+        if failed:
+            logging.error(f"Error: {len(failed)} of {len(parts)} parts failed to upload")
+            raise failed[0]
+        return results
+
+    async def _upload_chunks(
+        self,
+        file: BinaryIO,
+        file_size: int,
+        file_name: str,
+        password: Optional[str] = None,
+        journal_key: Optional[str] = None,
+    ) -> httpx.Response:
+        """
+        Upload the next file_size bytes of file in Content-Range chunks, keeping up to chunk_window requests in flight.
+
+        Every chunk but the last is sent concurrently; the last one is only sent once all others have been
+        acknowledged, so its response is the one carrying the upload result. Every chunk goes under the session
+        the upload started with, even if the connection's session is renewed meanwhile, since the server only
+        puts together chunks sent with the same upload key. If the server rejects that session partway, the
+        chunks already sent are lost with it: once the session is renewed, the upload starts over under the new
+        one, or raises SessionError when file can't be rewound. With a checksum, chunks are hashed as they are
+        read, and chunks skipped when resuming are read through for it rather than seeked past.
+
+        Args:
+            file: BinaryIO = Readable file object, positioned at the start of the upload
+            file_size: int = Number of bytes to upload
+            file_name: str = Name given to the upload
+            password: Optional[str] = Upload's password, if desired.
+            journal_key: Optional[str] = Key of the upload in the journal, if it is being recorded
+        """
+        session = None
+        account = account_id(self.api_key)
+        if journal_key is not None:
+            # Resuming only works with the upload key the acknowledged chunks were sent with, through its account,
+            # so an upload started by another account sharing the journal starts over
+            session = self.journal.resume_session(journal_key, file_name, account) if self.resume else None
+            if session is not None:
+                logging.info(f"[I] Resuming the upload of {file_name}")
+        start = file.tell() if file.seekable() else None
+        while True:
+            if session is None:
+                session = self._session_fields()
+                if journal_key is not None:
+                    self.journal.start(journal_key, file_name, session, account)
+            try:
+                return await self._send_chunks(file, file_size, file_name, password, journal_key, session)
+            except SessionError:
+                # Starting over under the same key would only be rejected again
+                if start is None or self.params.get("upload_key") == session["upload_key"]:
+                    raise
+            logging.info(f"[I] Upload session of {file_name} was rejected, starting it over under a new one")
+            file.seek(start)
+            session = None
+
+    async def _send_chunks(
+        self,
+        file: BinaryIO,
+        file_size: int,
+        file_name: str,
+        password: Optional[str],
+        journal_key: Optional[str],
+        session: dict,
+    ) -> httpx.Response:
+        """Body of _upload_chunks, sending every chunk with session."""
+        limiter = anyio.CapacityLimiter(self.chunk_window)
+        chunk_size = int(session["max_chunk_size"])
+        # Chunks are read in order, so the digest sees the content as a single pass over it
+        digest = self._new_digest()
+
+        failures = []
+
+        async def _send(chunk: memoryview, range_start: int, range_end: int) -> httpx.Response:
+            files = {"files": (file_name, BufferFile(chunk))}
+            # Required headers
+            headers = {"Content-Range": f"bytes {range_start}-{range_end}/{file_size}"}
+            start = time.monotonic()
+            try:
+                req = await self._post_upload(files, password, headers, session)
+            except httpx.HTTPError as e:
+                raise UploadError(file_name, range_start, range_end, repr(e)) from e
+            self.metrics.observe("chunk_seconds", time.monotonic() - start)
+            if not self._check_success(req):
+                raise UploadError(file_name, range_start, range_end, f"{req.status_code} {req.text[:200]}")
+            if journal_key is not None:
+                self.journal.acknowledge(journal_key, file_name, range_start, range_end)
+            return req
+
+        async def _send_limited(buffer: bytearray, chunk: memoryview, range_start: int, range_end: int) -> None:
+            try:
+                await _send(chunk, range_start, range_end)
+            except (UploadError, SessionError) as e:
+                # No point in sending the rest once a chunk is lost
+                failures.append(e)
+                task_group.cancel_scope.cancel()
+            finally:
+                self.buffers.release(buffer)
+                limiter.release_on_behalf_of(range_start)
+
+        chunks = math.ceil(file_size / chunk_size)
+        logging.debug(f"[D] Uploading {file_name} in {chunks} chunks, {self.chunk_window} at a time")
+        async with anyio.create_task_group() as task_group:
+            for i in range(chunks - 1):
+                range_start = i * chunk_size
+                if journal_key is not None and self.journal.acknowledged(
+                    journal_key, file_name, range_start, range_start + chunk_size - 1
+                ):
+                    if digest is not None:
+                        digest_bytes(file, chunk_size, digest)
+                    else:
+                        skip_bytes(file, chunk_size)
+                    continue
+                # Only read the next chunk once there is room for it in the window
+                await limiter.acquire_on_behalf_of(range_start)
+                buffer = await self.buffers.acquire(chunk_size)
+                chunk = self._read_chunk(file, buffer, chunk_size, digest)
+                task_group.start_soon(_send_limited, buffer, chunk, range_start, range_start + len(chunk) - 1)
+        if failures:
+            raise failures[0]
+        range_start = (chunks - 1) * chunk_size
+        buffer = await self.buffers.acquire(chunk_size)
+        try:
+            chunk = self._read_chunk(file, buffer, file_size - range_start, digest)
+            req = await _send(chunk, range_start, range_start + len(chunk) - 1)
+        finally:
+            self.buffers.release(buffer)
+        if "url" not in req.json()["result"]:
+            raise UploadError(
+                file_name, range_start, file_size - 1, "every chunk was acknowledged, yet it isn't complete"
+            )
+        return await self._verify_upload(req, file_name, file_size, digest)
+
+    def _read_chunk(
+        self, file: BinaryIO, buffer: bytearray, size: int, digest: Optional[StreamDigest] = None
+    ) -> memoryview:
+        with self.metrics.span("read"):
+            chunk = read_into(file, buffer, size)
+        self.metrics.count("bytes_read", len(chunk))
+        if digest is not None:
+            with self.metrics.span("digest"):
+                digest.update(chunk)
+        return chunk
+
+    def _new_digest(self) -> Optional[StreamDigest]:
+        return StreamDigest(self.checksum) if self.checksum is not None else None
+
+    async def _verify_upload(
+        self, response: httpx.Response, file_name: str, file_size: int, digest: Optional[StreamDigest]
+    ) -> httpx.Response:
+        """
+        Check a finished upload against the bytes read for it, adding its digest to the result.
+
+        The size MirrorAce reports for the upload must match both the number of bytes read and the size the
+        upload was meant to have, else an UploadError is raised. That catches files that changed while being
+        read as well as bytes lost on the way, without reading anything again.
+
+        Returns:
+            httpx.Response = The response, its result holding the upload's digest under checksum
+        """
+        if digest is None or not self._check_success(response):
+            return response
+        result = dict(response.json()["result"])
+        with self.metrics.span("verify"):
+            info = await self.get_file_info([result["slug"]])
+        if info is None:
+            logging.warning(f"[W] Couldn't check the size of {file_name} on MirrorAce")
+        else:
+            remote_size = info.json()["result"].get(result["slug"], {}).get("size")
+            if digest.size != file_size or remote_size is None or int(remote_size) != digest.size:
+                self.metrics.count("verify_failures")
+                raise UploadError(
+                    file_name,
+                    0,
+                    file_size - 1,
+                    f"{digest.size} bytes were read for it, but MirrorAce has {remote_size} bytes of it",
+                )
+            logging.debug(f"[D] {file_name} checked, MirrorAce has all {digest.size} bytes of it")
+        result["checksum"] = digest.hexdigest()
+        return httpx.Response(response.status_code, json={**response.json(), "result": result})
+
+    async def _post_upload(
+        self,
+        files: dict,
+        password: Optional[str] = None,
+        headers: Optional[dict] = None,
+        session: Optional[dict] = None,
+    ) -> httpx.Response:
+        """POST to the upload server, retrying transient failures with jittered exponential backoff."""
+        for attempt in range(self.max_attempts):
+            error = None
+            try:
+                req = await self._post_upload_once(files, password, headers, session)
+                if not self._is_transient(req):
+                    return req
+            except httpx.TransportError as e:
+                error = e
+            if attempt + 1 < self.max_attempts:
+                delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2**attempt))
+                reason = repr(error) if error is not None else f"status {req.status_code}"
+                logging.debug(f"[D] Upload request failed ({reason}), retrying in {delay:.1f}s")
+                self.metrics.count("retries")
+                await anyio.sleep(delay)
+        if error is not None:
+            raise error
+        return req
+
+    async def _post_upload_once(
+        self,
+        files: dict,
+        password: Optional[str] = None,
+        headers: Optional[dict] = None,
+        session: Optional[dict] = None,
+    ) -> httpx.Response:
+        """
+        POST to the upload server, renewing the upload session once if it gets rejected.
+
+        A request without a session of its own is then sent again under the new session. One made with a given
+        session, a chunk, raises SessionError instead, as its upload has to start over under the new one.
+        A rejection under the key a renewal handed out is returned as is, since a new session didn't help with it.
+        """
+        data = self._form_data(password, session)
+        req = await self._send_upload(data, files, headers)
+        if self._is_transient(req) or self._check_success(req) or data["upload_key"] == self._renewed_key:
+            return req
+        async with self._session_lock:
+            # Concurrent requests may have renewed it already
+            if self.params["upload_key"] == data["upload_key"]:
+                logging.debug("[D] Upload session was rejected, renewing it")
+                await self._get_upload(refresh=True)
+                self._renewed_key = self.params["upload_key"]
+        if session is not None:
+            raise SessionError(f"MirrorAce rejected upload session {data['upload_key']} ({req.text[:200]})")
+        return await self._send_upload(self._form_data(password), files, headers)
+
+    async def _send_upload(self, data: dict, files: dict, headers: Optional[dict] = None) -> httpx.Response:
+        """POST to the upload server once the scheduler lets the request through."""
+        size = sum(len(content) for _, content, *_ in files.values())
+        await self.scheduler.acquire(size)
+        start = time.monotonic()
+        ok = False
+        self.metrics.count("requests")
+        try:
+            req = await self.Client.post(data["server_file"], files=files, data=data, headers=headers)
+            ok = not self._is_transient(req)
+            self.metrics.count("bytes_sent", size)
+            return req
+        finally:
+            self.scheduler.release(size, time.monotonic() - start, ok)
+
+    @staticmethod
+    def _is_transient(response: httpx.Response) -> bool:
+        """Check if a failed response is worth retrying, rather than an answer from the API."""
+        if response.status_code == 429 or response.is_server_error:
+            return True
+        try:
+            response.json()
+        except ValueError:
+            return True
+        return False
+
+    def _form_data(self, password: Optional[str] = None, session: Optional[dict] = None) -> dict:
+        """Copy of the session's form fields for a single upload, so concurrent uploads never share state."""
+        data = dict(self.params)
+        if session is not None:
+            data.update(session)
+        if password is not None:
+            data["file_password"] = password
+        return data
+
+    def _session_fields(self) -> dict:
+        return {key: value for key, value in self.params.items() if key not in ("api_key", "api_token", "files")}
+
+    def _journal_key(self, file_path: PathLike, size: int, mtime: int) -> Optional[str]:
+        if self.journal is None:
+            return None
+        journal_key = UploadJournal.key(file_path, size, mtime)
+        if not self.resume:
+            self.journal.discard(journal_key)
+        return journal_key
+
+    def _finish_journal_part(self, journal_key: Optional[str], part_name: str, response: httpx.Response) -> None:
+        if journal_key is not None and self._check_success(response):
+            self.journal.finish_part(journal_key, part_name, response.json())
+
+    def _finish_journal(
+        self, journal_key: Optional[str], result: Union[httpx.Response, List[httpx.Response], None]
+    ) -> None:
+        # Keep the journal entry around until every part has made it
+        responses = result if isinstance(result, list) else [result]
+        if journal_key is not None and all(req is not None and self._check_success(req) for req in responses):
+            self.journal.finish(journal_key)
+
+    def _log_upload(self, response: httpx.Response, file_name: str) -> None:
+        if self._check_success(response):
+            logging.info(f"[I] {file_name} has been uploaded")
+            logging.info(f"[I] File has been uploaded to: {response.json()['result']['url']}")
+        else:
+            logging.error(f"Error: {response.text}")
+
+    @staticmethod
+    def _check_success(response: httpx.Response) -> bool:
+        try:
+            success = response.json()["status"] == "success"
+        except (ValueError, KeyError, TypeError):
+            return False
+        if success:
             logging.debug("[D] Successful response")
             return True
         else:
             return False
 
-    async def _get_upload(self) -> None:
+    async def refresh_session(self) -> None:
+        """Start a new upload session if the current key expires within EXPIRY_MARGIN, for long-lived connections."""
+        await self._ensure_session()
+
+    def _session_expiring(self) -> bool:
+        expiry = session_expiry(self.params)
+        return expiry is not None and expiry - EXPIRY_MARGIN <= time.time()
+
+    async def _ensure_session(self) -> None:
+        """Start the upload session, unless an earlier upload already has, or renew it if it's about to expire."""
+        if "upload_key" in self.params and not self._session_expiring():
+            return
+        async with self._session_lock:
+            # Concurrent uploads wait for the first one's handshake rather than each making their own
+            if "upload_key" not in self.params:
+                await self._get_upload()
+            elif self._session_expiring():
+                logging.debug("[D] Upload session is about to expire, renewing it")
+                await self._get_upload(refresh=True)
+            if "upload_key" not in self.params:
+                raise SessionError("MirrorAce refused to start an upload session")
+
+    async def _get_upload(self, refresh: bool = False) -> None:
+        # Reuse the cached session until shortly before its upload key expires
+        session = None if refresh else load_session(self.api_key, self.session_cache)
+        if session is not None:
+            logging.debug("[D] Reusing cached upload session")
+            self.params.update(session)
+            return
         # Regular httpx async request
-        upload_data = await self.Client.post("https://mirrorace.com/api/v1/file/upload", data=self.params)
+        self.metrics.count("handshakes")
+        if refresh:
+            self.metrics.count("session_refreshes")
+        with self.metrics.span("handshake"):
+            upload_data = await self.Client.post("https://mirrorace.com/api/v1/file/upload", data=self.params)
         if self._check_success(upload_data):
+            session = dict(upload_data.json()["result"])
+            session["mirrors[]"] = session.pop("default_mirrors")
+            del session["mirrors"]
             # Add every entry in the json to the class __dict__
-            self.params.update({key: value for key, value in upload_data.json()["result"].items()})
-            self.params["mirrors[]"] = self.params["default_mirrors"]
-            del self.params["default_mirrors"]
-            del self.params["mirrors"]
+            self.params.update(session)
+            save_session(self.api_key, session, self.session_cache)
+        else:
+            logging.error(f"Error: upload session couldn't be started ({upload_data.text})")
 
-    async def get_file_info(self, file_slugs: List[str]) -> Dict:
+    async def get_file_info(
+        self, file_slugs: List[str], on_batch: Optional[Callable[[Dict[str, dict]], None]] = None
+    ) -> Optional[httpx.Response]:
         """
-        Get the information of a file uploaded to MirrorAce.
+        Get the information of files uploaded to MirrorAce.
+
+        Slugs are asked about in batches of info_batch_size, up to info_concurrency batches at a time,
+        and the batches' results are merged into a single response.
 
         Args:
             file_slugs: List[str] = Slugs of the requested files
+            on_batch: Optional[Callable] = Called with each batch's results, by slug, as soon as they arrive
+
+        Returns:
+            Optional[httpx.Response] = Response with the information of every slug, None if any batch failed
         """
-        # Turn all list entries into a str with comma separations
-        slugs_str = ",".join(map(str, file_slugs))
-        self.params.update({"files": slugs_str})
-        result = await self.Client.post("https://mirrorace.com/api/v1/file/info", data=self.params)
-        if self._check_success(result):
-            return result
+        merged: Dict[str, dict] = {}
+        pending = []
+        now = time.time()
+        for slug in dict.fromkeys(map(str, file_slugs)):
+            cached = self._info_cache.get(slug)
+            if self.info_ttl is not None and cached is not None and cached[0] + self.info_ttl > now:
+                merged[slug] = cached[1]
+            else:
+                pending.append(slug)
+        if merged and on_batch is not None:
+            on_batch(dict(merged))
+        batches = [pending[i : i + self.info_batch_size] for i in range(0, len(pending), self.info_batch_size)]
+        logging.debug(f"[D] Requesting the information of {len(pending)} files in {len(batches)} batches")
+        limiter = anyio.CapacityLimiter(self.info_concurrency)
+        failed = []
+
+        async def _fetch(batch: List[str]) -> None:
+            async with limiter:
+                try:
+                    # Keep the slugs out of self.params, or every later upload would send them too
+                    req = await self.Client.post(
+                        "https://mirrorace.com/api/v1/file/info", data={**self.params, "files": ",".join(batch)}
+                    )
+                except httpx.HTTPError as e:
+                    logging.warning(f"[W] Couldn't get the information of {len(batch)} files: {e!r}")
+                    failed.append(batch)
+                    return
+            if not self._check_success(req):
+                logging.warning(f"[W] Couldn't get the information of {len(batch)} files: {req.text[:200]}")
+                failed.append(batch)
+                return
+            result = req.json()["result"]
+            fetched = time.time()
+            if self.info_ttl is not None:
+                self._info_cache.update({slug: (fetched, info) for slug, info in result.items()})
+            merged.update(result)
+            if on_batch is not None:
+                on_batch(result)
+
+        async with anyio.create_task_group() as task_group:
+            for batch in batches:
+                task_group.start_soon(_fetch, batch)
+        if failed:
+            return None
+        return httpx.Response(200, json={"status": "success", "result": merged})
 
     # TODO Currently not working
     # async def upload_remote(self, url: str, password: Union[str, None] = None) -> None:
@@ -199,4 +1335,10 @@ class MirrorAceConnection:
 
     def renew(self) -> "MirrorAceConnection":
         """Recreate the connection. Use when it has been closed (after any upload operation)"""
-        return MirrorAceConnection(self.api_key, self.api_token)
+        return MirrorAceConnection(
+            self.api_key,
+            self.api_token,
+            transport=self.transport,
+            transport_config=self.transport_config,
+            history=self.history,
+        )
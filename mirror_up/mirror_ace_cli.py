@@ -1,26 +1,77 @@
 """CLI configuration"""
 
+import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import sys
 from os import PathLike, getenv
 from pathlib import Path
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
 
-import pyperclip
-import trio
 import typer
-from dotenv import load_dotenv
-from httpx import Response
-from notifypy import Notify
 
-from mirror_up.mirror_ace import MirrorAceConnection
+from mirror_up._metrics import MetricsHook, MetricsRecorder
 
-load_dotenv()
+# Everything else is imported where it's used, so --help and info start fast
+if TYPE_CHECKING:
+    from httpx import Response
+
+    from mirror_up._pool import MirrorAcePool
+    from mirror_up._transport import TransportConfig
+    from mirror_up.mirror_ace import MirrorAceConnection
 
 app = typer.Typer(help="Use MirrorAce commands")
 
 logging.basicConfig(format="%(message)s", level=logging.INFO)
 
+# Settings given to the mirror_ace callback, for the clients of every command
+transport_options: dict = {}
+
+
+@app.callback()
+def transport(
+    http2: bool = typer.Option(
+        False, help="Multiplex concurrent requests over HTTP/2 connections, needs mirror_up[http2]."
+    ),
+    max_connections: int = typer.Option(100, min=1, help="Maximum connections open at once."),
+    max_keepalive: int = typer.Option(32, min=0, help="Maximum idle connections kept open for later requests."),
+    keepalive_expiry: float = typer.Option(30.0, min=0, help="Seconds idle connections are kept open."),
+    connect_timeout: float = typer.Option(30.0, min=0, help="Seconds to establish a connection."),
+    read_timeout: float = typer.Option(1800.0, min=0, help="Seconds to wait for the server's response."),
+    write_timeout: float = typer.Option(300.0, min=0, help="Seconds to wait for a request's bytes to be sent."),
+    pool_timeout: Optional[float] = typer.Option(
+        None, min=0, help="Seconds a request waits for a free connection, no limit if unset."
+    ),
+    send_buffer: Optional[int] = typer.Option(None, min=1, help="Socket send buffer in KiB, the system's if unset."),
+    receive_buffer: Optional[int] = typer.Option(
+        None, min=1, help="Socket receive buffer in KiB, the system's if unset."
+    ),
+) -> None:
+    """Use MirrorAce commands"""
+    transport_options.update(
+        http2=http2,
+        max_connections=max_connections,
+        max_keepalive=max_keepalive,
+        keepalive_expiry=keepalive_expiry,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        pool_timeout=pool_timeout,
+        send_buffer=send_buffer * 1024 if send_buffer is not None else None,
+        receive_buffer=receive_buffer * 1024 if receive_buffer is not None else None,
+    )
+
+
+def transport_config() -> "TransportConfig":
+    """Transport settings given on the command line, the defaults when called from elsewhere."""
+    from mirror_up._transport import TransportConfig, http2_available, socket_buffers_available
+
+    if transport_options.get("http2") and not http2_available():
+        raise typer.BadParameter("install mirror_up[http2] to use it", param_hint="--http2")
+    buffers = transport_options.get("send_buffer") or transport_options.get("receive_buffer")
+    if buffers and not socket_buffers_available():
+        raise typer.BadParameter("unsupported by the installed httpx", param_hint="--send-buffer/--receive-buffer")
+    return TransportConfig(**transport_options)
+
 
 @app.command(help="Upload files/folders to MirrorAce.")
 def upload(
@@ -28,32 +79,186 @@ def upload(
     notify: Optional[bool] = typer.Option(False, help="Specify if you want to be notified when it concludes."),
     password: Optional[str] = typer.Option(None, help="Provide a password for the download."),
     clipboard: Optional[bool] = typer.Option(True, help="Specify if you want to save the result to the clipboard."),
+    chunk_window: int = typer.Option(4, min=1, help="Number of chunks uploaded concurrently for large files."),
+    max_files: int = typer.Option(4, min=1, help="Number of files uploaded concurrently."),
+    max_parts: int = typer.Option(4, min=1, help="Number of multi-volume parts uploaded concurrently for huge files."),
+    shard: bool = typer.Option(True, help="Spread files across every account listed in MirAce_K and MirAce_T."),
+    session_cache: bool = typer.Option(True, help="Reuse upload sessions across runs until they expire."),
+    resume: bool = typer.Option(False, help="Continue interrupted uploads from where they stopped."),
+    memory_limit: Optional[int] = typer.Option(None, min=1, help="Maximum MiB of file data held in memory."),
+    rate_limit: Optional[float] = typer.Option(
+        None, min=0.01, help="Maximum upload rate in MiB/s, across every account."
+    ),
+    max_requests: int = typer.Option(32, min=1, help="Maximum requests in flight, adjusted to the network."),
+    dedup: bool = typer.Option(
+        False, help="Skip files whose content has already been uploaded, hashing every file before any upload starts."
+    ),
+    revalidate: bool = typer.Option(
+        False, help="With --dedup, check that skipped files' uploads still exist on MirrorAce."
+    ),
+    metrics: Optional[Path] = typer.Option(
+        None, help="Write upload timings and counters to this file, as a Prometheus textfile if it ends in .prom."
+    ),
+    compress: Optional[str] = typer.Option(
+        None, help="Compress files that aren't already compressed with gzip, bz2, xz or zstd."
+    ),
+    compress_level: Optional[int] = typer.Option(None, help="Compression level, the codec's default if unset."),
+    checksum: Optional[str] = typer.Option(
+        None, help="Hash uploads as they are read with sha256, sha512, blake2b or blake2s, and check them on MirrorAce."
+    ),
     verbose: Optional[int] = typer.Option(0, "--verbose", "-v", count=True),
 ) -> None:
     if verbose == 1:
         logging.basicConfig(format="%(message)s", level=logging.DEBUG, force=True)
-    with ThreadPoolExecutor() as executor:
-        for filepath in path:
-            if filepath.exists():
-                executor.submit(upload_logic, filepath, notify, password, clipboard)
-            else:
-                typer.echo(f"This path does not exist: {filepath}")
+    paths = []
+    for filepath in path:
+        if filepath.exists():
+            paths.append(filepath)
+        else:
+            typer.echo(f"This path does not exist: {filepath}")
+    if paths:
+        recorder = MetricsRecorder() if metrics is not None else None
+        obj = connect(
+            chunk_window,
+            session_cache,
+            resume,
+            memory_limit,
+            rate_limit,
+            max_requests,
+            dedup,
+            revalidate,
+            recorder,
+            compress,
+            compress_level,
+            max_parts,
+            shard,
+            checksum=checksum,
+        )
+        try:
+            upload_logic(obj, paths, notify, password, clipboard, max_files)
+        finally:
+            if recorder is not None:
+                recorder.write(metrics)
 
 
-def upload_logic(filepath: PathLike, notify: bool, password: str, clipboard: bool):
-    obj = MirrorAceConnection(getenv("MirAce_K"), getenv("MirAce_T"))
-    if password is not None:
-        req = trio.run(obj, filepath, password)
-    else:
-        req = trio.run(obj, filepath)
+def connect(
+    chunk_window: int = 4,
+    session_cache: bool = True,
+    resume: bool = False,
+    memory_limit: Optional[int] = None,
+    rate_limit: Optional[float] = None,
+    max_requests: int = 32,
+    dedup: bool = False,
+    revalidate: bool = False,
+    metrics: Optional[MetricsHook] = None,
+    compression: Optional[str] = None,
+    compression_level: Optional[int] = None,
+    part_concurrency: int = 4,
+    shard: bool = False,
+    checksum: Optional[str] = None,
+) -> Union["MirrorAceConnection", "MirrorAcePool"]:
+    from mirror_up._compress import available_codecs
+    from mirror_up._index import DedupIndex
+    from mirror_up._journal import UploadJournal
+    from mirror_up._plan import ThroughputHistory
+    from mirror_up._scheduler import TokenBucket, UploadScheduler
+    from mirror_up._utils import BufferPool
+    from mirror_up.mirror_ace import CHECKSUMS, MirrorAceConnection
+
+    if compression is not None and compression not in available_codecs():
+        raise typer.BadParameter(f"use one of {', '.join(available_codecs())}", param_hint="--compress")
+    if checksum is not None and checksum not in CHECKSUMS:
+        raise typer.BadParameter(f"use one of {', '.join(CHECKSUMS)}", param_hint="--checksum")
+    # Memory is capped across every account
+    buffers = BufferPool(memory_limit * 1024 * 1024 if memory_limit is not None else None)
+    config = transport_config()
+    # Every run's throughput is recorded, for plan's estimates
+    history = ThroughputHistory()
+    # Progress is always recorded, so any run can be resumed later on. Every account shares the one journal,
+    # since separate copies of it would each overwrite the others' progress when saved
+    journal = UploadJournal()
+    # The rate limit is for the whole run, so every account draws from the one bucket
+    bucket = TokenBucket(rate_limit * 1024 * 1024 if rate_limit else None)
+    connections = [
+        MirrorAceConnection(
+            api_key,
+            api_token,
+            chunk_window,
+            session_cache=session_cache,
+            journal=journal,
+            resume=resume,
+            buffers=buffers,
+            # Each account's server gets its own request window
+            scheduler=UploadScheduler(chunk_window, max_requests, bucket=bucket),
+            index=DedupIndex() if dedup else None,
+            revalidate=revalidate,
+            metrics=metrics,
+            compression=compression,
+            compression_level=compression_level,
+            part_concurrency=part_concurrency,
+            checksum=checksum,
+            transport_config=config,
+            history=history,
+        )
+        for api_key, api_token in (accounts() if shard else accounts()[:1])
+    ]
+    if len(connections) == 1:
+        return connections[0]
+    from mirror_up._pool import MirrorAcePool
+
+    return MirrorAcePool(connections)
+
+
+def accounts() -> List[Tuple[str, str]]:
+    """API key and token of every account, from MirAce_K and MirAce_T, which may each hold a comma separated list."""
+    keys = [key.strip() for key in (getenv("MirAce_K") or "").split(",")]
+    tokens = [token.strip() for token in (getenv("MirAce_T") or "").split(",")]
+    if len(keys) != len(tokens):
+        raise typer.BadParameter(f"MirAce_K holds {len(keys)} API keys but MirAce_T holds {len(tokens)} tokens")
+    return list(zip(keys, tokens))
+
+
+def upload_logic(
+    obj: Union["MirrorAceConnection", "MirrorAcePool"],
+    paths: List[PathLike],
+    notify: bool,
+    password: str,
+    clipboard: bool,
+    max_files: int = 4,
+) -> None:
+    import trio
+
+    # A single connection, and so a single client and upload session, serves every path
+    for req in trio.run(obj.upload_many, paths, password, max_files):
+        report_result(req, notify, clipboard)
+
+
+def report_result(req: Union["Response", List["Response"], None], notify: bool, clipboard: bool) -> None:
+    from httpx import Response
+
+    from mirror_up.mirror_ace import MirrorAceConnection
+
+    # Rejected uploads are reported as such, without stopping the rest of the batch
+    rejected = [
+        response
+        for response in (req if isinstance(req, list) else [req])
+        if response is not None and not MirrorAceConnection._check_success(response)
+    ]
+    if rejected:
+        typer.echo(f"Upload failed: {rejected[0].text[:200]}")
+        return
     if isinstance(req, Response):
         typer.echo(req.json()["result"]["url"])
         if notify:
+            from notifypy import Notify
+
             notification = Notify()
             notification.title = f'{req.json()["result"]["name"]} has been uploaded.'
             notification.message = f"The link has been copied to your clipboard"
             notification.send()
         if clipboard:
+            import pyperclip
+
             pyperclip.copy(req.json()["result"]["url"])
     if isinstance(req, list):
         typer.echo("File was too large for direct upload; it as been split into multiple files.")
@@ -67,17 +272,326 @@ def upload_logic(filepath: PathLike, notify: bool, password: str, clipboard: boo
 def folder(
     path: List[Path] = typer.Argument(..., help="Path to folder containing files"),
     password: Optional[str] = typer.Option(None, help="Provide a password for the download"),
+    pack: bool = typer.Option(False, help="Pack small files, subfolders included, into tar bundles."),
+    bundle_size: Optional[int] = typer.Option(
+        None, min=1, help="Largest bundle in MiB, MirrorAce's file limit by default."
+    ),
+    pack_under: float = typer.Option(1, min=0.001, help="Size in MiB from which files are uploaded on their own."),
+    chunk_window: int = typer.Option(4, min=1, help="Number of chunks uploaded concurrently for large files."),
+    max_files: int = typer.Option(4, min=1, help="Number of files uploaded concurrently."),
+    max_parts: int = typer.Option(4, min=1, help="Number of multi-volume parts uploaded concurrently for huge files."),
+    shard: bool = typer.Option(
+        True, help="Spread files across every account listed in MirAce_K and MirAce_T, except with --pack."
+    ),
+    session_cache: bool = typer.Option(True, help="Reuse upload sessions across runs until they expire."),
+    resume: bool = typer.Option(False, help="Continue interrupted uploads from where they stopped."),
+    memory_limit: Optional[int] = typer.Option(None, min=1, help="Maximum MiB of file data held in memory."),
+    rate_limit: Optional[float] = typer.Option(
+        None, min=0.01, help="Maximum upload rate in MiB/s, across every account."
+    ),
+    max_requests: int = typer.Option(32, min=1, help="Maximum requests in flight, adjusted to the network."),
+    dedup: bool = typer.Option(
+        False, help="Skip files whose content has already been uploaded, hashing every file before any upload starts."
+    ),
+    revalidate: bool = typer.Option(
+        False, help="With --dedup, check that skipped files' uploads still exist on MirrorAce."
+    ),
+    metrics: Optional[Path] = typer.Option(
+        None, help="Write upload timings and counters to this file, as a Prometheus textfile if it ends in .prom."
+    ),
+    compress: Optional[str] = typer.Option(
+        None, help="Compress files that aren't already compressed with gzip, bz2, xz or zstd."
+    ),
+    compress_level: Optional[int] = typer.Option(None, help="Compression level, the codec's default if unset."),
+    checksum: Optional[str] = typer.Option(
+        None, help="Hash uploads as they are read with sha256, sha512, blake2b or blake2s, and check them on MirrorAce."
+    ),
     verbose: Optional[int] = typer.Option(0, "--verbose", "-v", count=True),
 ) -> None:  # noqa
     if verbose == 1:
         logging.basicConfig(format="%(message)s", level=logging.DEBUG, force=True)
-    with ThreadPoolExecutor() as executor:
+    recorder = MetricsRecorder() if metrics is not None else None
+    try:
+        if pack:
+            import trio
+
+            from mirror_up._index import BundleIndex
+
+            bundle_index = BundleIndex()
+            for filepath in path:
+                if not filepath.is_dir():
+                    typer.echo(f"This folder does not exist: {filepath}")
+                    continue
+                # Each packed upload closes its connection's client once done
+                obj = connect(
+                    chunk_window,
+                    session_cache,
+                    resume,
+                    memory_limit,
+                    rate_limit,
+                    max_requests,
+                    dedup,
+                    revalidate,
+                    recorder,
+                    compress,
+                    compress_level,
+                    max_parts,
+                    checksum=checksum,
+                )
+                results = trio.run(
+                    obj.upload_packed,
+                    filepath,
+                    password,
+                    max_files,
+                    bundle_size * 1024 * 1024 if bundle_size is not None else None,
+                    int(pack_under * 1024 * 1024),
+                    bundle_index,
+                )
+                for name, req in results.items():
+                    if req is None:
+                        typer.echo(f"{name} : failed")
+                    else:
+                        report_result(req, False, False)
+            return
+        paths = []
         for filepath in path:
             if filepath.exists():
-                for entry in Path(filepath).iterdir():
-                    executor.submit(upload_logic, entry, password)
+                paths.extend(Path(filepath).iterdir())
             else:
                 typer.echo(f"This path does not exist: {filepath}")
+        if paths:
+            obj = connect(
+                chunk_window,
+                session_cache,
+                resume,
+                memory_limit,
+                rate_limit,
+                max_requests,
+                dedup,
+                revalidate,
+                recorder,
+                compress,
+                compress_level,
+                max_parts,
+                shard,
+                checksum=checksum,
+            )
+            upload_logic(obj, paths, False, password, False, max_files)
+    finally:
+        if recorder is not None:
+            recorder.write(metrics)
+
+
+@app.command(help="Upload the files within the given folders that are new or changed since their last sync.")
+def sync(
+    path: List[Path] = typer.Argument(..., help="Path to folders to sync"),
+    password: Optional[str] = typer.Option(None, help="Provide a password for the download"),
+    recursive: bool = typer.Option(True, help="Also sync the files inside subfolders."),
+    include: Optional[List[str]] = typer.Option(None, help="Only sync files matching this glob, can be repeated."),
+    exclude: Optional[List[str]] = typer.Option(
+        None, help="Skip files and folders matching this glob, can be repeated."
+    ),
+    chunk_window: int = typer.Option(4, min=1, help="Number of chunks uploaded concurrently for large files."),
+    max_files: int = typer.Option(4, min=1, help="Number of files uploaded concurrently."),
+    max_parts: int = typer.Option(4, min=1, help="Number of multi-volume parts uploaded concurrently for huge files."),
+    session_cache: bool = typer.Option(True, help="Reuse upload sessions across runs until they expire."),
+    resume: bool = typer.Option(False, help="Continue interrupted uploads from where they stopped."),
+    memory_limit: Optional[int] = typer.Option(None, min=1, help="Maximum MiB of file data held in memory."),
+    rate_limit: Optional[float] = typer.Option(
+        None, min=0.01, help="Maximum upload rate in MiB/s, across every account."
+    ),
+    max_requests: int = typer.Option(32, min=1, help="Maximum requests in flight, adjusted to the network."),
+    dedup: bool = typer.Option(
+        False, help="Skip files whose content has already been uploaded, hashing every file before any upload starts."
+    ),
+    revalidate: bool = typer.Option(
+        False, help="With --dedup, check that skipped files' uploads still exist on MirrorAce."
+    ),
+    metrics: Optional[Path] = typer.Option(
+        None, help="Write upload timings and counters to this file, as a Prometheus textfile if it ends in .prom."
+    ),
+    compress: Optional[str] = typer.Option(
+        None, help="Compress files that aren't already compressed with gzip, bz2, xz or zstd."
+    ),
+    compress_level: Optional[int] = typer.Option(None, help="Compression level, the codec's default if unset."),
+    checksum: Optional[str] = typer.Option(
+        None, help="Hash uploads as they are read with sha256, sha512, blake2b or blake2s, and check them on MirrorAce."
+    ),
+    verbose: Optional[int] = typer.Option(0, "--verbose", "-v", count=True),
+) -> None:  # noqa
+    if verbose == 1:
+        logging.basicConfig(format="%(message)s", level=logging.DEBUG, force=True)
+    import trio
+
+    recorder = MetricsRecorder() if metrics is not None else None
+    try:
+        for filepath in path:
+            if not filepath.is_dir():
+                typer.echo(f"This folder does not exist: {filepath}")
+                continue
+            # Each sync closes its connection's client once done
+            obj = connect(
+                chunk_window,
+                session_cache,
+                resume,
+                memory_limit,
+                rate_limit,
+                max_requests,
+                dedup,
+                revalidate,
+                recorder,
+                compress,
+                compress_level,
+                max_parts,
+                checksum=checksum,
+            )
+            results = trio.run(obj.sync, filepath, password, max_files, recursive, include, exclude)
+            for rel_path, req in results.items():
+                if req is None:
+                    typer.echo(f"{rel_path} : failed")
+                else:
+                    report_result(req, False, False)
+    finally:
+        if recorder is not None:
+            recorder.write(metrics)
+
+
+@app.command(help="Watch folders and upload files as they land in them, until interrupted.")
+def watch(
+    path: List[Path] = typer.Argument(..., help="Path to folders to watch"),
+    password: Optional[str] = typer.Option(None, help="Provide a password for the download"),
+    recursive: bool = typer.Option(True, help="Also watch subfolders."),
+    include: Optional[List[str]] = typer.Option(None, help="Only upload files matching this glob, can be repeated."),
+    exclude: Optional[List[str]] = typer.Option(
+        None, help="Skip files and folders matching this glob, can be repeated."
+    ),
+    stable_for: float = typer.Option(5.0, min=0, help="Seconds a file must stay unchanged before it is uploaded."),
+    poll_interval: float = typer.Option(2.0, min=0.01, help="Seconds between checks for new files."),
+    inotify: bool = typer.Option(True, help="Use inotify where available, instead of rescanning the folders."),
+    workers: int = typer.Option(4, min=1, help="Number of files uploaded concurrently."),
+    max_parts: int = typer.Option(4, min=1, help="Number of multi-volume parts uploaded concurrently for huge files."),
+    ledger: Path = typer.Option(Path("ledger.jsonl"), help="JSON lines file recording every upload."),
+    chunk_window: int = typer.Option(4, min=1, help="Number of chunks uploaded concurrently for large files."),
+    session_cache: bool = typer.Option(True, help="Reuse upload sessions across runs until they expire."),
+    resume: bool = typer.Option(False, help="Continue interrupted uploads from where they stopped."),
+    memory_limit: Optional[int] = typer.Option(None, min=1, help="Maximum MiB of file data held in memory."),
+    rate_limit: Optional[float] = typer.Option(
+        None, min=0.01, help="Maximum upload rate in MiB/s, across every account."
+    ),
+    max_requests: int = typer.Option(32, min=1, help="Maximum requests in flight, adjusted to the network."),
+    dedup: bool = typer.Option(
+        False, help="Skip files whose content has already been uploaded, hashing every file before any upload starts."
+    ),
+    revalidate: bool = typer.Option(
+        False, help="With --dedup, check that skipped files' uploads still exist on MirrorAce."
+    ),
+    metrics: Optional[Path] = typer.Option(
+        None, help="Write upload timings and counters to this file, as a Prometheus textfile if it ends in .prom."
+    ),
+    compress: Optional[str] = typer.Option(
+        None, help="Compress files that aren't already compressed with gzip, bz2, xz or zstd."
+    ),
+    compress_level: Optional[int] = typer.Option(None, help="Compression level, the codec's default if unset."),
+    checksum: Optional[str] = typer.Option(
+        None, help="Hash uploads as they are read with sha256, sha512, blake2b or blake2s, and check them on MirrorAce."
+    ),
+    verbose: Optional[int] = typer.Option(0, "--verbose", "-v", count=True),
+) -> None:  # noqa
+    if verbose == 1:
+        logging.basicConfig(format="%(message)s", level=logging.DEBUG, force=True)
+    missing = [filepath for filepath in path if not filepath.is_dir()]
+    if missing:
+        raise typer.BadParameter(f"This folder does not exist: {missing[0]}", param_hint="PATH")
+    import trio
+
+    from mirror_up._watch import FolderWatcher, UploadLedger
+
+    recorder = MetricsRecorder() if metrics is not None else None
+    watcher = FolderWatcher(path, recursive, include, exclude, stable_for, poll_interval, inotify)
+    try:
+        obj = connect(
+            chunk_window,
+            session_cache,
+            resume,
+            memory_limit,
+            rate_limit,
+            max_requests,
+            dedup,
+            revalidate,
+            recorder,
+            compress,
+            compress_level,
+            max_parts,
+            checksum=checksum,
+        )
+        trio.run(obj.watch, watcher, UploadLedger(ledger), password, workers)
+    except KeyboardInterrupt:
+        typer.echo("Stopped watching")
+    finally:
+        if recorder is not None:
+            recorder.write(metrics)
+
+
+@app.command(help="Show how files/folders would be uploaded and about how long it would take, uploading nothing.")
+def plan(
+    path: List[Path] = typer.Argument(..., help="Path to files/folders."),
+    session_cache: bool = typer.Option(True, help="Reuse upload sessions across runs until they expire."),
+    compress: Optional[str] = typer.Option(
+        None, help="Plan compressing files that aren't already compressed with gzip, bz2, xz or zstd."
+    ),
+    as_json: bool = typer.Option(False, "--json", help="Print one JSON object per path, then one with the totals."),
+    verbose: Optional[int] = typer.Option(0, "--verbose", "-v", count=True),
+) -> None:
+    """
+    Plan uploads from a stat-only scan, with estimates from the throughput of the last runs
+
+    Args:
+        path: List[Path]
+    """
+    if verbose == 1:
+        logging.basicConfig(format="%(message)s", level=logging.DEBUG, force=True)
+    import trio
+    from format_byte import format_byte
+
+    obj = connect(session_cache=session_cache, dedup=False, compression=compress)
+    plans = trio.run(obj.plan, path)
+    history = obj.history
+
+    def _eta(size: int) -> str:
+        seconds = history.estimate(size)
+        if seconds is None:
+            return "unknown"
+        return f"{int(seconds) // 3600}:{int(seconds) // 60 % 60:02d}:{int(seconds) % 60:02d}"
+
+    totals = {
+        "paths": len(plans),
+        "size": sum(upload.size for upload in plans),
+        "volumes": sum(upload.volumes for upload in plans),
+        "requests": sum(upload.requests for upload in plans),
+        # Uploads run concurrently, so every temporary file may exist at once
+        "temp_bytes": sum(upload.temp_bytes for upload in plans),
+    }
+    if as_json:
+        for upload in plans:
+            typer.echo(json.dumps({**upload._asdict(), "seconds": history.estimate(upload.size)}))
+        typer.echo(json.dumps({**totals, "seconds": history.estimate(totals["size"]), "runs": len(history.runs)}))
+        return
+    typer.echo(f"{'name':<40}{'route':<16}{'size':>12}{'volumes':>9}{'requests':>10}{'temp':>12}{'ETA':>11}")
+    for upload in plans:
+        route = f"tar, {upload.route}" if upload.archive else upload.route
+        typer.echo(
+            f"{upload.name[:39]:<40}{route:<16}{format_byte(upload.size):>12}{upload.volumes:>9}{upload.requests:>10}"
+            f"{format_byte(upload.temp_bytes):>12}{_eta(upload.size):>11}"
+        )
+    typer.echo(
+        f"{'total':<40}{'':<16}{format_byte(totals['size']):>12}{totals['volumes']:>9}{totals['requests']:>10}"
+        f"{format_byte(totals['temp_bytes']):>12}{_eta(totals['size']):>11}"
+    )
+    rate = history.rate()
+    if rate is None:
+        typer.echo("No upload has been measured yet, ETAs will show after the first one")
+    else:
+        typer.echo(f"ETAs assume {format_byte(rate)}/s, measured over the last {len(history.runs)} runs")
 
 
 # #Remote file upload currently not working
@@ -97,19 +611,61 @@ def folder(
 #             typer.echo(req.json()["result"]["url"])
 
 
-@app.command(help="Get info on files uploaded to MirrorAce")
+@app.command(help="Get info on files uploaded to MirrorAce, printed as one JSON object per line")
 def info(
-    slugs: List[str],
+    slugs: Optional[List[str]] = typer.Argument(None, help="Slugs of the files."),
+    from_file: Optional[Path] = typer.Option(
+        None, "--from-file", help="Also read slugs from this file, one per line, - for stdin."
+    ),
+    batch_size: int = typer.Option(100, min=1, help="Number of slugs asked about in a single request."),
+    concurrency: int = typer.Option(4, min=1, help="Number of requests in flight at once."),
+    session_cache: bool = typer.Option(True, help="Reuse upload sessions across runs until they expire."),
     verbose: Optional[int] = typer.Option(0, "--verbose", "-v", count=True),
 ) -> None:
     """
     Get file information from MirrorAce slugs
 
+    Slugs are read from stdin when none are given.
+
     Args:
         slugs: List[str]
     """
     if verbose == 1:
         logging.basicConfig(format="%(message)s", level=logging.DEBUG, force=True)
-    obj = MirrorAceConnection(getenv("MirAce_K"), getenv("MirAce_T"))
-    req = trio.run(obj.get_file_info, slugs)
-    typer.echo(req)
+    slugs = list(slugs or [])
+    if from_file is not None and str(from_file) != "-":
+        with open(from_file) as lines:
+            slugs.extend(line.strip() for line in lines if line.strip())
+    elif from_file is not None or not slugs:
+        # Left open, it isn't ours to close
+        if sys.stdin.isatty():
+            raise typer.BadParameter(
+                "pipe the slugs in or give them as arguments", param_hint="--from-file" if from_file else "SLUGS"
+            )
+        slugs.extend(line.strip() for line in sys.stdin if line.strip())
+    if not slugs:
+        return
+    import trio
+
+    from mirror_up.mirror_ace import MirrorAceConnection
+
+    api_key, api_token = accounts()[0]
+    obj = MirrorAceConnection(
+        api_key,
+        api_token,
+        session_cache=session_cache,
+        info_batch_size=batch_size,
+        info_concurrency=concurrency,
+        transport_config=transport_config(),
+    )
+
+    def _print_batch(result: dict) -> None:
+        for slug, file_info in result.items():
+            typer.echo(json.dumps({**file_info, "slug": slug}))
+
+    try:
+        req = trio.run(obj.get_file_info, slugs, _print_batch)
+    finally:
+        trio.run(obj.Client.aclose)
+    if req is None:
+        raise typer.Exit(1)
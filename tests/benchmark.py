@@ -0,0 +1,179 @@
+"""
+Throughput benchmarks of MirrorAceConnection's upload paths, run against FakeMirrorAce.
+
+Each case runs in a fresh process, so its peak RSS isn't inflated by the ones before it. By default requests go
+through the fake server's mock transport; with --transport http1 or http2 they go through real local sockets.
+
+Usage:
+    python -m tests.benchmark [--scale 1] [--latency 0] [--bandwidth MIB_PER_S] [--transport mock|http1|http2]
+        [--max-connections 100] [--json] [CASE...]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import trio
+
+MIB = 1024 * 1024
+
+# Case -> (size of each file in MiB at scale 1, number of files, folder upload, stream instead of using ZIP_SAVE)
+CASES = {
+    "simple": (2, 1, False, True),
+    "chunked": (24, 1, False, True),
+    "split-stream": (80, 1, False, True),
+    "split-temp": (80, 1, False, False),
+    "directory-stream": (1, 24, True, True),
+    "directory-temp": (1, 24, True, False),
+}
+MAX_CHUNK_SIZE = 4 * MIB
+MAX_FILE_SIZE = 32 * MIB
+TRANSPORTS = ("mock", "http1", "http2")
+
+
+def _disk_usage(directory: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def run_case(
+    case: str,
+    scale: float = 1,
+    latency: float = 0.0,
+    bandwidth: Optional[float] = None,
+    transport: str = "mock",
+    max_connections: int = 100,
+) -> Dict:
+    """
+    Upload a case's files to a fake server and measure it.
+
+    Args:
+        case: str = Name of the case, one of CASES
+        scale: float = Multiplier of every file size, and of the server's limits
+        latency: float = Seconds the fake server adds to every request
+        bandwidth: Optional[float] = Bytes per second the fake server accepts, unlimited if None
+        transport: str = One of TRANSPORTS, how requests reach the fake server
+        max_connections: int = Maximum connections open at once, over real sockets
+
+    Returns:
+        Dict = Bytes uploaded, seconds taken, MB/s, requests/s, peak RSS and peak temporary disk use
+    """
+    import resource
+
+    from mirror_up._transport import TransportConfig
+    from mirror_up.mirror_ace import MirrorAceConnection
+    from tests.fake_mirrorace import FakeMirrorAce, LocalTransport
+
+    file_size, file_count, folder, stream = CASES[case]
+    file_size = int(file_size * scale * MIB)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp, "source")
+        source.mkdir()
+        for i in range(file_count):
+            with open(source / f"file{i:04d}.bin", "wb") as f:
+                for offset in range(0, file_size, MIB):
+                    f.write(os.urandom(min(MIB, file_size - offset)))
+        save = Path(tmp, "save")
+        save.mkdir()
+        os.environ["ZIP_SAVE"] = f"{save}{os.sep}"
+        server = FakeMirrorAce(int(MAX_CHUNK_SIZE * scale), int(MAX_FILE_SIZE * scale), latency, bandwidth)
+        # HTTP/2 is spoken with prior knowledge, the local server has no TLS to negotiate it with
+        config = TransportConfig(
+            http2=transport == "http2", http1=transport != "http2", max_connections=max_connections
+        )
+        target = source if folder else source / "file0000.bin"
+        peak_disk = 0
+
+        async def _upload() -> float:
+            nonlocal peak_disk
+
+            async def _watch_disk() -> None:
+                nonlocal peak_disk
+                while True:
+                    peak_disk = max(peak_disk, await trio.to_thread.run_sync(_disk_usage, save))
+                    await trio.sleep(0.01)
+
+            async with trio.open_nursery() as nursery:
+                if transport == "mock":
+                    client_transport = server.transport
+                else:
+                    client_transport = LocalTransport(config.transport(), await nursery.start(server.serve))
+                connection = MirrorAceConnection(
+                    "key",
+                    "token",
+                    stream_split=stream,
+                    stream_archive=stream,
+                    transport=client_transport,
+                    transport_config=config,
+                )
+                nursery.start_soon(_watch_disk)
+                start = time.perf_counter()
+                await connection(target)
+                elapsed = time.perf_counter() - start
+                nursery.cancel_scope.cancel()
+            return elapsed
+
+        elapsed = trio.run(_upload)
+    size = file_size * file_count
+    # The handshake happens during the upload, but isn't part of it
+    requests = sum(server.requests.values()) - server.requests["file/upload"]
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "case": case,
+        "transport": transport,
+        "bytes": size,
+        "seconds": elapsed,
+        "mb_per_s": size / elapsed / 10**6,
+        "requests": requests,
+        "requests_per_s": requests / elapsed,
+        "peak_rss_mib": peak_rss / MIB,
+        "peak_temp_disk_mib": peak_disk / MIB,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:  # noqa: D103
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("cases", nargs="*", metavar="CASE", help=f"Cases to run, all by default: {', '.join(CASES)}")
+    parser.add_argument("--scale", type=float, default=1, help="Multiplier of file sizes and server limits")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Server bandwidth in MiB/s")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="mock", help="How requests reach the server")
+    parser.add_argument("--max-connections", type=int, default=100, help="Maximum connections over real sockets")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per case")
+    args = parser.parse_args(argv)
+    unknown = set(args.cases).difference(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    bandwidth = args.bandwidth * MIB if args.bandwidth else None
+    if not args.json:
+        print(f"{'case':<18}{'MiB':>8}{'s':>9}{'MB/s':>9}{'req/s':>9}{'RSS MiB':>10}{'temp MiB':>10}")
+    for case in args.cases or CASES:
+        # A fresh process per case keeps peak RSS per case
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(
+                run_case, case, args.scale, args.latency, bandwidth, args.transport, args.max_connections
+            ).result()
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                f"{case:<18}{result['bytes'] / MIB:>8.1f}{result['seconds']:>9.2f}{result['mb_per_s']:>9.1f}"
+                f"{result['requests_per_s']:>9.1f}{result['peak_rss_mib']:>10.1f}{result['peak_temp_disk_mib']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Fixtures shared by the tests of `mirror_up`."""
+from typing import Callable
+
+import pytest
+
+from mirror_up import _session
+from tests.fake_mirrorace import FakeMirrorAce
+
+
+@pytest.fixture(autouse=True)
+def fresh_sessions(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Start every test without cached upload sessions, so none leaks from one test's server into another's."""
+    monkeypatch.setattr(_session, "_sessions", {})
+
+
+@pytest.fixture
+def fake_server(monkeypatch: pytest.MonkeyPatch) -> Callable[..., FakeMirrorAce]:
+    """
+    Factory of fake MirrorAce servers, sized for tests and keeping what they receive.
+
+    Sessions are cached per API key and each server hands out its own upload keys, so creating a server
+    also forgets the sessions of earlier ones.
+    """
+
+    def _create(max_chunk_size: int = 10**4, max_file_size: int = 10**5, **kwargs) -> FakeMirrorAce:
+        monkeypatch.setattr(_session, "_sessions", {})
+        return FakeMirrorAce(max_chunk_size, max_file_size, **{"keep_data": True, **kwargs})
+
+    return _create
@@ -0,0 +1,350 @@
+"""In-process stand-in for the MirrorAce API, served through an httpx transport."""
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import anyio
+import anyio.abc
+import httpx
+
+SERVER_FILE = "https://fake.mirrorace.local/upload"
+# First bytes of an HTTP/2 connection made with prior knowledge
+H2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+# Flow control window of HTTP/2 streams, large enough for clients to never wait for one to reopen
+H2_WINDOW = 2**30
+
+
+class FakeMirrorAce:
+    """
+    Fake MirrorAce API implementing the upload handshake, the server_file endpoint and file/info.
+
+    Chunked uploads are checked like the real server would: every Content-Range must match the size of its
+    chunk, stay within max_chunk_size and agree on the total size, and the file is only complete once every
+    byte has arrived. Received bytes are only kept with keep_data, so benchmarks don't measure the server.
+
+    Args:
+        max_chunk_size: int = Largest chunk, and largest file sent without Content-Range
+        max_file_size: int = Largest file accepted
+        latency: float = Seconds added to every request
+        bandwidth: Optional[float] = Bytes per second shared by every upload, unlimited if None
+        keep_data: bool = Keep the content of uploaded files in files[slug]["data"]
+
+    Attributes:
+        files: Dict[str, dict] = Name, size and, with keep_data, content of every completed upload, by slug
+        requests: Counter = Number of requests served, by endpoint
+        bytes_received: int = Size of every file and chunk received
+    """
+
+    def __init__(  # noqa
+        self,
+        max_chunk_size: int = 1024 * 1024,
+        max_file_size: int = 8 * 1024 * 1024,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        keep_data: bool = False,
+    ) -> None:
+        self.max_chunk_size = max_chunk_size
+        self.max_file_size = max_file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.keep_data = keep_data
+        self.files: Dict[str, dict] = {}
+        self.requests: Counter = Counter()
+        self.bytes_received = 0
+        # Keys still accepted, and how many were ever handed out, so a revoked key's name is never reused
+        self._upload_keys: set = set()
+        self._keys_issued = 0
+        # (upload key, name) -> total size, byte ranges received and, with keep_data, the content so far
+        self._partial: Dict[Tuple[str, str], dict] = {}
+        # When the simulated link is done with the bytes already queued on it
+        self._link_free_at = 0.0
+
+    @property
+    def transport(self) -> httpx.MockTransport:  # noqa: D102
+        return httpx.MockTransport(self.handle)
+
+    async def serve(self, task_status: anyio.abc.TaskStatus = anyio.TASK_STATUS_IGNORED) -> None:
+        """
+        Serve the API on a local port, over HTTP/1.1 and, if h2 is installed, HTTP/2 with prior knowledge.
+
+        Start it with task_group.start(server.serve), which returns the port, and send requests to it
+        through a LocalTransport. Unlike with transport, requests then go through real sockets.
+        """
+        listener = await anyio.create_tcp_listener(local_host="127.0.0.1")
+        task_status.started(listener.listeners[0].extra(anyio.abc.SocketAttribute.local_port))
+        await listener.serve(self._serve_connection)
+
+    async def _serve_connection(self, stream: anyio.abc.ByteStream) -> None:
+        buffer = bytearray()
+        try:
+            while len(buffer) < len(H2_PREFACE):
+                buffer += await stream.receive()
+            if buffer.startswith(H2_PREFACE):
+                await self._serve_http2(stream, bytes(buffer))
+            else:
+                await self._serve_http1(stream, buffer)
+        except (anyio.EndOfStream, anyio.BrokenResourceError):
+            pass
+        finally:
+            await stream.aclose()
+
+    async def _serve_http1(self, stream: anyio.abc.ByteStream, buffer: bytearray) -> None:
+        while True:
+            while b"\r\n\r\n" not in buffer:
+                buffer += await stream.receive()
+            end = buffer.index(b"\r\n\r\n")
+            request_line, *header_lines = buffer[:end].decode("latin-1").split("\r\n")
+            del buffer[: end + 4]
+            method, target, _ = request_line.split(" ", 2)
+            headers = [tuple(part.strip() for part in line.split(":", 1)) for line in header_lines]
+            fields = {name.lower(): value for name, value in headers}
+            if fields.get("transfer-encoding", "").lower() == "chunked":
+                body = bytearray()
+                while True:
+                    while b"\r\n" not in buffer:
+                        buffer += await stream.receive()
+                    end = buffer.index(b"\r\n")
+                    size = int(buffer[:end].split(b";")[0], 16)
+                    while len(buffer) < end + 2 + size + 2:
+                        buffer += await stream.receive()
+                    body += buffer[end + 2 : end + 2 + size]
+                    del buffer[: end + 2 + size + 2]
+                    if not size:
+                        break
+            else:
+                length = int(fields.get("content-length", 0))
+                while len(buffer) < length:
+                    buffer += await stream.receive()
+                body = buffer[:length]
+                del buffer[:length]
+            request = httpx.Request(method, f"https://{fields['host']}{target}", headers=headers, content=bytes(body))
+            response = await self.handle(request)
+            head = f"HTTP/1.1 {response.status_code} {response.reason_phrase}\r\n"
+            head += f"content-type: application/json\r\ncontent-length: {len(response.content)}\r\n\r\n"
+            await stream.send(head.encode() + response.content)
+
+    async def _serve_http2(self, stream: anyio.abc.ByteStream, received: bytes) -> None:
+        import h2.config
+        import h2.connection
+        import h2.events
+        import h2.settings
+
+        connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        connection.initiate_connection()
+        connection.update_settings({h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: H2_WINDOW})
+        connection.increment_flow_control_window(H2_WINDOW - connection.inbound_flow_control_window)
+        send_lock = anyio.Lock()
+        # Stream id -> headers and body received so far
+        requests: Dict[int, Tuple[Dict[str, str], bytearray]] = {}
+
+        async def _flush() -> None:
+            async with send_lock:
+                data = connection.data_to_send()
+                if data:
+                    await stream.send(data)
+
+        async def _respond(stream_id: int, headers: Dict[str, str], body: bytes) -> None:
+            request = httpx.Request(
+                headers[":method"],
+                f"https://{headers[':authority']}{headers[':path']}",
+                headers={name: value for name, value in headers.items() if not name.startswith(":")},
+                content=body,
+            )
+            response = await self.handle(request)
+            # Responses are small JSON objects, well within a single frame and the client's window
+            connection.send_headers(
+                stream_id,
+                [
+                    (":status", str(response.status_code)),
+                    ("content-type", "application/json"),
+                    ("content-length", str(len(response.content))),
+                ],
+            )
+            connection.send_data(stream_id, response.content, end_stream=True)
+            await _flush()
+
+        async with anyio.create_task_group() as task_group:
+            try:
+                while True:
+                    for event in connection.receive_data(received):
+                        if isinstance(event, h2.events.RequestReceived):
+                            requests[event.stream_id] = (dict(event.headers), bytearray())
+                        elif isinstance(event, h2.events.DataReceived):
+                            requests[event.stream_id][1].extend(event.data)
+                            connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                        elif isinstance(event, h2.events.StreamEnded):
+                            headers, body = requests.pop(event.stream_id)
+                            task_group.start_soon(_respond, event.stream_id, headers, bytes(body))
+                        elif isinstance(event, h2.events.ConnectionTerminated):
+                            return
+                    await _flush()
+                    received = await stream.receive()
+            except (anyio.EndOfStream, anyio.BrokenResourceError):
+                # Inside the task group, these would reach _serve_connection wrapped in an exception group
+                pass
+            finally:
+                task_group.cancel_scope.cancel()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        """Answer a request like the MirrorAce API would."""
+        await self._delay(len(request.content))
+        if request.url.path == "/api/v1/file/upload":
+            self.requests["file/upload"] += 1
+            return self._handshake(parse_qs(request.content.decode()))
+        if request.url.path == "/api/v1/file/info":
+            self.requests["file/info"] += 1
+            return self._info(parse_qs(request.content.decode()))
+        if str(request.url) == SERVER_FILE:
+            self.requests["server_file"] += 1
+            return self._receive(request)
+        return httpx.Response(404)
+
+    async def _delay(self, size: int) -> None:
+        deadline = anyio.current_time() + self.latency
+        if self.bandwidth:
+            # Requests queue up on a single link, like uploads sharing a real connection would
+            self._link_free_at = max(self._link_free_at, anyio.current_time()) + size / self.bandwidth
+            deadline = max(deadline, self._link_free_at)
+        await anyio.sleep_until(deadline)
+
+    def _handshake(self, form: Dict[str, List[str]]) -> httpx.Response:
+        if not form.get("api_key") or not form.get("api_token"):
+            return self._error("Invalid API key or token")
+        upload_key = f"key{self._keys_issued}"
+        self._keys_issued += 1
+        self._upload_keys.add(upload_key)
+        return self._success(
+            {
+                "server_file": SERVER_FILE,
+                "max_chunk_size": str(self.max_chunk_size),
+                "max_file_size": str(self.max_file_size),
+                "upload_key": upload_key,
+                "upload_key_expiry": str(int(time.time()) + 3600),
+                "default_mirrors": ["1"],
+                "mirrors": {"1": "Fake"},
+            }
+        )
+
+    def _receive(self, request: httpx.Request) -> httpx.Response:
+        fields, name, data = self._parse_multipart(request)
+        if fields.get("upload_key") not in self._upload_keys:
+            return self._error("Invalid upload key")
+        if name is None:
+            return self._error("No file received")
+        self.bytes_received += len(data)
+        content_range = request.headers.get("Content-Range")
+        if content_range is None:
+            if len(data) > self.max_chunk_size:
+                return self._error("File too large, it must be sent in chunks")
+            return self._complete(name, len(data), data)
+        match = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", content_range)
+        if match is None:
+            return self._error(f"Malformed Content-Range: {content_range}")
+        start, end, total = map(int, match.groups())
+        if end - start + 1 != len(data) or end >= total:
+            return self._error(f"Content-Range {content_range} doesn't match a chunk of {len(data)} bytes")
+        if len(data) > self.max_chunk_size:
+            return self._error("Chunk too large")
+        if total > self.max_file_size:
+            return self._error("File too large")
+        partial = self._partial.setdefault(
+            (fields["upload_key"], name),
+            {"total": total, "ranges": [], "data": bytearray(total) if self.keep_data else None},
+        )
+        if partial["total"] != total:
+            return self._error("Content-Range total doesn't match earlier chunks")
+        partial["ranges"].append((start, end))
+        if self.keep_data:
+            partial["data"][start : end + 1] = data
+        if self._missing(partial["ranges"], total):
+            return self._success({"message": "Chunk received"})
+        del self._partial[(fields["upload_key"], name)]
+        return self._complete(name, total, partial["data"])
+
+    def _complete(self, name: str, size: int, data: Optional[bytes]) -> httpx.Response:
+        slug = f"{len(self.files):08x}"
+        self.files[slug] = {"name": name, "size": size}
+        if self.keep_data:
+            self.files[slug]["data"] = bytes(data)
+        return self._success({"slug": slug, "name": name, "size": str(size), "url": f"https://fake/{slug}"})
+
+    def _info(self, form: Dict[str, List[str]]) -> httpx.Response:
+        slugs = form.get("files", [""])[0].split(",")
+        result = {}
+        for slug in slugs:
+            file = self.files.get(slug)
+            if file is None:
+                result[slug] = {
+                    "id": None,
+                    "name": None,
+                    "slug": None,
+                    "size": None,
+                    "url": None,
+                    "status": "not found",
+                }
+            else:
+                result[slug] = {
+                    "id": slug,
+                    "name": file["name"],
+                    "slug": slug,
+                    "size": str(file["size"]),
+                    "url": f"https://fake/{slug}",
+                    "status": "active",
+                }
+        return self._success(result)
+
+    @staticmethod
+    def _missing(ranges: List[Tuple[int, int]], total: int) -> bool:
+        covered = 0
+        for start, end in sorted(ranges):
+            if start > covered:
+                return True
+            covered = max(covered, end + 1)
+        return covered < total
+
+    @staticmethod
+    def _parse_multipart(request: httpx.Request) -> Tuple[Dict[str, str], Optional[str], bytes]:
+        boundary = re.search(r"boundary=([^;]+)", request.headers["Content-Type"]).group(1).strip('"')
+        fields, name, data = {}, None, b""
+        # Parts sit between boundary lines, the first and last pieces are the preamble and the closing "--"
+        for part in request.content.split(f"--{boundary}".encode())[1:-1]:
+            headers, _, content = part[2:-2].partition(b"\r\n\r\n")
+            disposition = re.search(rb"Content-Disposition:([^\r\n]*)", headers, re.IGNORECASE).group(1).decode()
+            file_name = re.search(r'filename="([^"]*)"', disposition)
+            if file_name is not None:
+                name, data = file_name.group(1), content
+            else:
+                fields[re.search(r'name="([^"]*)"', disposition).group(1)] = content.decode()
+        return fields, name, data
+
+    @staticmethod
+    def _success(result: dict) -> httpx.Response:
+        return httpx.Response(200, json={"status": "success", "result": result})
+
+    @staticmethod
+    def _error(message: str) -> httpx.Response:
+        return httpx.Response(200, json={"status": "error", "result": message})
+
+
+class LocalTransport(httpx.AsyncBaseTransport):
+    """
+    Transport sending every request to a FakeMirrorAce served on a local port, whatever its URL.
+
+    Args:
+        transport: httpx.AsyncBaseTransport = Network transport the requests go through
+        port: int = Port the fake server listens on
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, port: int) -> None:  # noqa
+        self._transport = transport
+        self._port = port
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Send the request to the local port, its Host header still telling the server where it was meant to go."""
+        request.url = request.url.copy_with(scheme="http", host="127.0.0.1", port=self._port)
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:  # noqa: D102
+        await self._transport.aclose()
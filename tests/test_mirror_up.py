@@ -2,19 +2,44 @@
 """Tests for `mirror_up` package."""
 # pylint: disable=redefined-outer-name
 
-from os import getenv, remove
+import gzip
+import hashlib
+import io
+import json
+import shutil
+import subprocess
+import sys
+import time
+from os import PathLike, getenv, remove, urandom
 from pathlib import Path
+from typing import BinaryIO, Callable, Optional, Tuple
 
+import anyio
+import httpx
+import pytest
 import trio
+import typer
 from dotenv import load_dotenv
 
-from mirror_up.mirror_ace import MirrorAceConnection
+from mirror_up import _compress, _session, mirror_ace, mirror_ace_cli
+from mirror_up._index import BundleIndex, DedupIndex
+from mirror_up._journal import UploadJournal
+from mirror_up._manifest import SyncManifest, scan_tree
+from mirror_up._metrics import MetricsRecorder
+from mirror_up._plan import ThroughputHistory, plan_upload
+from mirror_up._pool import MirrorAcePool
+from mirror_up._scheduler import UploadScheduler
+from mirror_up._transport import TransportConfig, http2_available, socket_buffers_available
+from mirror_up._utils import BufferFile, BufferPool, TarStream, hash_files, pack_files, read_into, split_ranges
+from mirror_up._watch import FolderWatcher, UploadLedger
+from mirror_up.mirror_ace import MirrorAceConnection, UploadError
+from tests.fake_mirrorace import FakeMirrorAce, LocalTransport
 
 load_dotenv()
 
 
 def test_mirrorace_keys() -> None:  # noqa: D103
-    connection = MirrorAceConnection(getenv("MirAce_K"), getenv("MirAce_T"))
+    connection = MirrorAceConnection(getenv("MirAce_K"), getenv("MirAce_T"), handshake=True)
     assert isinstance(connection.params["server"], str)
     assert isinstance(connection.params["server_file"], str)
     assert isinstance(connection.params["server_remote"], str)
@@ -65,7 +90,7 @@ def test_mirrorace_file_info() -> None:  # noqa: D103
 
 def test_mirrorace_part_upload() -> None:  # noqa: D103
     file = "testP.tmp"
-    connection = MirrorAceConnection(getenv("MirAce_K"), getenv("MirAce_T"))
+    connection = MirrorAceConnection(getenv("MirAce_K"), getenv("MirAce_T"), handshake=True)
     # Create chonky file for testing
     with open(file, "w") as f:
         f.truncate(int(1.05 * int(connection.params["max_file_size"])))
@@ -77,7 +102,7 @@ def test_mirrorace_part_upload() -> None:  # noqa: D103
 
 def test_mirrorace_chunk_upload() -> None:  # noqa: D103
     file = "testC.tmp"
-    connection = MirrorAceConnection(getenv("MirAce_K"), getenv("MirAce_T"))
+    connection = MirrorAceConnection(getenv("MirAce_K"), getenv("MirAce_T"), handshake=True)
     # Create chonky file for testing
     with open(file, "w") as f:
         f.truncate(int(1.05 * int(connection.params["max_chunk_size"])))
@@ -97,4 +122,1031 @@ def test_mirrorace_simple_upload() -> None:  # noqa: D103
     assert connection._check_success(req)
 
 
+def test_split_ranges() -> None:  # noqa: D103
+    volumes = list(split_ranges("test", 25, 10))
+    assert volumes == [("test.0001", 0, 10), ("test.0002", 10, 10), ("test.0003", 20, 5)]
+    assert sum(length for _, _, length in volumes) == 25
+    assert list(split_ranges("test", 20, 10))[-1] == ("test.0002", 10, 10)
+
+
+def test_tar_stream(tmp_path: Path) -> None:  # noqa: D103
+    folder = tmp_path / "folder"
+    (folder / "sub").mkdir(parents=True)
+    (folder / "a.bin").write_bytes(urandom(10**5))
+    (folder / "sub" / ("b" * 150)).write_bytes(b"long name")
+    (folder / "empty").touch()
+    archive = shutil.make_archive(str(tmp_path / "folder"), "tar", folder)
+    with TarStream(folder) as stream:
+        assert stream.size == Path(archive).stat().st_size
+        assert stream.read() == Path(archive).read_bytes()
+
+
+def test_read_into_buffer() -> None:  # noqa: D103
+    data = urandom(2500)
+    pool = BufferPool()
+    source = io.BytesIO(data)
+    buffer = trio.run(pool.acquire, 1000)
+    chunks = []
+    while True:
+        chunk = read_into(source, buffer, 1000)
+        if not chunk:
+            break
+        content = BufferFile(chunk)
+        assert content.seek(0, io.SEEK_END) == len(chunk)
+        content.seek(0)
+        chunks.append(content.read(600) + content.read())
+    pool.release(buffer)
+    assert b"".join(chunks) == data
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    # Buffers are reused rather than allocated again
+    assert trio.run(pool.acquire, 1000) is buffer
+
+
+def test_buffer_pool_limit() -> None:  # noqa: D103
+    pool = BufferPool(limit=2000)
+    acquired = []
+
+    async def _hold(delay: float) -> None:
+        buffer = await pool.acquire(1000)
+        acquired.append(pool.allocated)
+        await trio.sleep(delay)
+        pool.release(buffer)
+
+    async def _main() -> None:
+        async with trio.open_nursery() as nursery:
+            for _ in range(6):
+                nursery.start_soon(_hold, 0.01)
+
+    trio.run(_main)
+    assert len(acquired) == 6
+    assert max(acquired) == pool.allocated == 2000
+
+
+def test_upload_scheduler() -> None:  # noqa: D103
+    scheduler = UploadScheduler(initial_requests=2, max_requests=8)
+
+    async def _request(elapsed: float, ok: bool = True) -> None:
+        await scheduler.acquire(1000)
+        scheduler.release(1000, elapsed, ok)
+
+    for _ in range(20):
+        trio.run(_request, 0.01)
+    assert scheduler.window > 2
+    window = scheduler.window
+    # Congestion halves the window
+    trio.run(_request, 1.0)
+    assert scheduler.window == window // 2
+    assert scheduler.bytes_sent == 21000
+
+
+def test_upload_scheduler_mixed_sizes() -> None:  # noqa: D103
+    async def _request(scheduler: UploadScheduler, size: int, elapsed: float) -> None:
+        await scheduler.acquire(size)
+        scheduler.release(size, elapsed, True)
+
+    def _window(sizes: list) -> int:
+        scheduler = UploadScheduler(initial_requests=2, max_requests=64)
+        for size in sizes:
+            # A 50ms round trip, then 10MB/s
+            trio.run(_request, scheduler, size, 0.05 + size / 10**7)
+        return scheduler.window
+
+    # Small files' requests are mostly round trip, yet they don't hold the window back for the chunks
+    chunks_only = _window([10**7] * 200)
+    assert (
+        _window([10**3, 10**7] * 100) == _window([10**3 + i for i in range(100)] + [10**7] * 100) == chunks_only
+    )
+    assert chunks_only >= 16
+    scheduler = UploadScheduler(initial_requests=2, max_requests=64)
+    for _ in range(100):
+        trio.run(_request, scheduler, 10**3, 0.05)
+        trio.run(_request, scheduler, 10**7, 1.05)
+    window = scheduler.window
+    # Congestion of the chunks is still noticed
+    trio.run(_request, scheduler, 10**7, 3.0)
+    assert scheduler.window == window // 2
+
+
+def test_upload_scheduler_rate_limit() -> None:  # noqa: D103
+    scheduler = UploadScheduler(rate_limit=10**6)
+
+    async def _main() -> None:
+        for _ in range(15):
+            await scheduler.acquire(10**5)
+            scheduler.release(10**5, 0.001, True)
+
+    start = time.monotonic()
+    trio.run(_main)
+    # The first second worth of bytes is a burst, the rest waits for the bucket
+    assert time.monotonic() - start >= 0.45
+
+
+def test_dedup_index(tmp_path: Path) -> None:  # noqa: D103
+    files = [tmp_path / "a", tmp_path / "b", tmp_path / "c"]
+    for file, content in zip(files, [b"same", b"same", b"other"]):
+        file.write_bytes(content)
+    digests = hash_files(files)
+    assert digests[0] == digests[1] == hashlib.sha256(b"same").hexdigest()
+    assert digests[2] != digests[0]
+    index = DedupIndex(tmp_path / "index.sqlite3")
+    index.add(digests[0], 4, {"status": "success", "result": {"slug": "slug"}})
+    assert index.lookup(digests[1], 4)["result"]["slug"] == "slug"
+    assert index.lookup(digests[1], 5) is None
+    assert index.lookup(digests[2], 5) is None
+    index.remove(digests[0], 4)
+    assert index.lookup(digests[0], 4) is None
+
+
+def test_session_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    session = {"upload_key": "key", "upload_key_expiry": str(int(time.time()) + 3600)}
+    _session.save_session("api", session, on_disk=True)
+    assert _session.load_session("api") == session
+    # A new process only has the copy on disk
+    monkeypatch.setattr(_session, "_sessions", {})
+    assert _session.load_session("api") is None
+    assert _session.load_session("api", on_disk=True) == session
+    assert "api" not in (tmp_path / "mirror-up" / "sessions.json").read_text()
+    expiring = {"upload_key": "key", "upload_key_expiry": str(int(time.time()) + 60)}
+    _session.save_session("api", expiring)
+    assert _session.load_session("api") is None
+
+
+def test_upload_journal(tmp_path: Path) -> None:  # noqa: D103
+    journal = UploadJournal(tmp_path / "journal.json")
+    key = UploadJournal.key(tmp_path / "file", 3000, 1)
+    session = {"upload_key": "key", "upload_key_expiry": str(int(time.time()) + 3600)}
+    journal.start(key, "file.0001", session, "account")
+    journal.acknowledge(key, "file.0001", 1000, 1999)
+    journal.acknowledge(key, "file.0001", 0, 999)
+    journal.finish_part(key, "file.0000", {"status": "success"})
+    # Progress survives a restart
+    journal = UploadJournal(tmp_path / "journal.json")
+    assert journal.acknowledged(key, "file.0001", 0, 1999)
+    assert not journal.acknowledged(key, "file.0001", 2000, 2999)
+    assert journal.resume_session(key, "file.0001", "account") == session
+    # Only the account the upload was started by can resume it
+    assert journal.resume_session(key, "file.0001", "other") is None
+    assert journal.part(key, "file.0000") == {"status": "success"}
+    journal.finish(key)
+    assert UploadJournal(tmp_path / "journal.json").part(key, "file.0000") is None
+
+
+def test_shared_journal(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setenv("MirAce_K", "key0,key1")
+    monkeypatch.setenv("MirAce_T", "token0,token1")
+    pool = mirror_ace_cli.connect(shard=True)
+    for i, connection in enumerate(pool.connections):
+        connection.journal.finish_part(f"file{i}", "file.001", {"result": {"slug": f"slug{i}"}})
+    # Neither account's progress is lost when the other's is saved
+    journal = UploadJournal()
+    assert [journal.part(f"file{i}", "file.001")["result"]["slug"] for i in range(2)] == ["slug0", "slug1"]
+
+
+def test_shared_rate_limit(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setenv("MirAce_K", "key0,key1")
+    monkeypatch.setenv("MirAce_T", "token0,token1")
+    pool = mirror_ace_cli.connect(shard=True, rate_limit=1)
+    schedulers = [connection.scheduler for connection in pool.connections]
+    assert schedulers[0] is not schedulers[1]
+
+    async def _main() -> None:
+        for _ in range(16):
+            for scheduler in schedulers:
+                await scheduler.acquire(2**16)
+                scheduler.release(2**16, 0.001, True)
+
+    start = time.monotonic()
+    trio.run(_main)
+    # Both accounts draw from the one MiB/s, so the second MiB has to wait for the bucket
+    assert time.monotonic() - start >= 0.9
+
+
+def test_sync_manifest(tmp_path: Path) -> None:  # noqa: D103
+    root = tmp_path / "root"
+    (root / "sub" / "skip").mkdir(parents=True)
+    for name in ["a.txt", "b.log", "sub/c.txt", "sub/skip/d.txt"]:
+        (root / name).write_bytes(urandom(16))
+    scanned = dict(scan_tree(root, exclude=["skip", "*.log"]))
+    assert sorted(scanned) == ["a.txt", "sub/c.txt"]
+    assert sorted(dict(scan_tree(root, recursive=False, include=["*.txt"]))) == ["a.txt"]
+    manifest = SyncManifest(root, tmp_path / "manifest.json")
+    assert all(manifest.changed(rel_path, stat) for rel_path, stat in scanned.items())
+    for rel_path, stat in scanned.items():
+        manifest.record(rel_path, stat, [rel_path])
+    manifest.save()
+    manifest = SyncManifest(root, tmp_path / "manifest.json")
+    assert not any(manifest.changed(rel_path, stat) for rel_path, stat in scan_tree(root, exclude=["skip", "*.log"]))
+    with open(root / "a.txt", "ab") as f:
+        f.write(b"more")
+    assert manifest.changed("a.txt", (root / "a.txt").stat())
+    (root / "sub" / "c.txt").unlink()
+    assert manifest.prune(["a.txt"]) == ["sub/c.txt"]
+    assert manifest.slugs("a.txt") == ["a.txt"] and "sub/c.txt" not in manifest
+
+
+@pytest.mark.parametrize("size", [10**3, 10**5, 4 * 10**5 + 7])
+@pytest.mark.parametrize("stream", [True, False])
+def test_fake_server_upload(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable, size: int, stream: bool
+) -> None:  # noqa: D103
+    monkeypatch.setenv("ZIP_SAVE", f"{tmp_path / 'save'}/")
+    server = fake_server(max_chunk_size=2 * 10**4)
+    connection = MirrorAceConnection(
+        "key", "token", stream_split=stream, stream_archive=stream, transport=server.transport
+    )
+    data = urandom(size)
+    (tmp_path / "file.bin").write_bytes(data)
+    result = trio.run(connection, tmp_path / "file.bin")
+    responses = result if isinstance(result, list) else [result]
+    assert len(responses) == -(-size // 10**5)
+    assert all(connection._check_success(req) for req in responses)
+    assert b"".join(server.files[req.json()["result"]["slug"]]["data"] for req in responses) == data
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_parallel_parts(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable, stream: bool
+) -> None:  # noqa: D103
+    monkeypatch.setenv("ZIP_SAVE", f"{tmp_path / 'save'}/")
+    data = urandom(8 * 2 * 10**4)
+    (tmp_path / "file.bin").write_bytes(data)
+
+    def _upload(part_concurrency: int, server: FakeMirrorAce) -> Tuple[list, float]:
+        connection = MirrorAceConnection(
+            "key",
+            "token",
+            stream_split=stream,
+            part_concurrency=part_concurrency,
+            scheduler=UploadScheduler(16, 16),
+            transport=server.transport,
+        )
+        start = time.perf_counter()
+        result = trio.run(connection, tmp_path / "file.bin")
+        return result, time.perf_counter() - start
+
+    # 8 parts of 2 chunks each, every request taking 50ms
+    _, sequential = _upload(1, fake_server(max_file_size=2 * 10**4, latency=0.05))
+    server = fake_server(max_file_size=2 * 10**4, latency=0.05)
+    result, concurrent = _upload(8, server)
+    assert concurrent < sequential / 2
+    assert [req.json()["result"]["name"] for req in result] == [f"file.{i:04d}" for i in range(1, 9)]
+    assert b"".join(server.files[req.json()["result"]["slug"]]["data"] for req in result) == data
+
+    # A failed part doesn't keep the others from making it
+    server = fake_server(max_file_size=2 * 10**4)
+    handle = server.handle
+
+    async def _reject_third_part(request: httpx.Request) -> httpx.Response:
+        if b'filename="file.0003"' in request.content:
+            return server._error("Rejected")
+        return await handle(request)
+
+    monkeypatch.setattr(server, "handle", _reject_third_part)
+    with pytest.raises(UploadError):
+        _upload(8, server)
+    assert sorted(file["name"] for file in server.files.values()) == [f"file.{i:04d}" for i in (1, 2, 4, 5, 6, 7, 8)]
+
+
+@pytest.mark.parametrize("failure", ["status", "transport"])
+def test_retry(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable, failure: str
+) -> None:  # noqa: D103
+    monkeypatch.setattr(mirror_ace, "RETRY_BACKOFF", 0.001)
+    server = fake_server()
+    data = urandom(5 * 10**4)
+    (tmp_path / "file.bin").write_bytes(data)
+    handle = server.handle
+    attempts = []
+
+    async def _fail_once(request: httpx.Request) -> httpx.Response:
+        if request.headers.get("Content-Range") == "bytes 20000-29999/50000":
+            attempts.append(request)
+            if len(attempts) == 1:
+                if failure == "transport":
+                    raise httpx.ConnectError("Connection reset", request=request)
+                return httpx.Response(503, text="Service Unavailable")
+        return await handle(request)
+
+    monkeypatch.setattr(server, "handle", _fail_once)
+    recorder = MetricsRecorder()
+    connection = MirrorAceConnection("key", "token", transport=server.transport, metrics=recorder)
+    req = trio.run(connection, tmp_path / "file.bin")
+    assert len(attempts) == 2 and recorder.counters["retries"] == 1
+    assert server.files[req.json()["result"]["slug"]]["data"] == data
+
+
+# An API refusal is only sent once more, under a renewed session in case the session was what it refused
+@pytest.mark.parametrize("status, attempts", [(503, 3), (429, 3), (403, 2)])
+def test_retry_gives_up(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable, status: int, attempts: int
+) -> None:  # noqa: D103
+    monkeypatch.setattr(mirror_ace, "RETRY_BACKOFF", 0.001)
+    server = fake_server()
+    (tmp_path / "file.bin").write_bytes(urandom(5 * 10**4))
+    handle = server.handle
+    sent = []
+
+    async def _fail(request: httpx.Request) -> httpx.Response:
+        if request.headers.get("Content-Range") == "bytes 20000-29999/50000":
+            sent.append(request)
+            # A JSON body, so only the status tells throttling and outages apart from the API refusing the chunk
+            return httpx.Response(status, json={"status": "error", "result": "Refused"})
+        return await handle(request)
+
+    monkeypatch.setattr(server, "handle", _fail)
+    connection = MirrorAceConnection("key", "token", max_attempts=3, transport=server.transport)
+    with pytest.raises(UploadError) as error:
+        trio.run(connection, tmp_path / "file.bin")
+    assert (error.value.file_name, error.value.range_start, error.value.range_end) == ("file.bin", 20000, 29999)
+    assert str(status) in str(error.value)
+    assert len(sent) == attempts
+    assert not server.files
+
+
+def test_fake_server_folder_upload(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server(max_file_size=10**6)
+    folder = tmp_path / "folder"
+    folder.mkdir()
+    (folder / "a.bin").write_bytes(urandom(5 * 10**4))
+    connection = MirrorAceConnection("key", "token", transport=server.transport)
+    req = trio.run(connection, folder)
+    with TarStream(folder) as stream:
+        assert server.files[req.json()["result"]["slug"]]["data"] == stream.read()
+    connection = connection.renew()
+    req = trio.run(connection.get_file_info, [req.json()["result"]["slug"], "0101"])
+    assert req.json()["result"]["0101"]["status"] == "not found"
+
+
+def test_upload_metrics(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server()
+    recorder = MetricsRecorder()
+    connection = MirrorAceConnection("key", "token", transport=server.transport, metrics=recorder)
+    (tmp_path / "file.bin").write_bytes(urandom(5 * 10**4 + 1))
+    assert connection._check_success(trio.run(connection, tmp_path / "file.bin"))
+    assert recorder.counters["bytes_read"] == recorder.counters["bytes_sent"] == 5 * 10**4 + 1
+    assert recorder.counters["requests"] == server.requests["server_file"] == 6
+    assert recorder.spans["handshake"][0] == recorder.counters["handshakes"] == 1
+    assert sum(recorder.histograms["chunk_seconds"]) == 6
+    recorder.write(tmp_path / "metrics.prom")
+    assert 'mirror_up_chunk_seconds_bucket{le="+Inf"} 6' in (tmp_path / "metrics.prom").read_text()
+    recorder.write(tmp_path / "metrics.json")
+    assert json.loads((tmp_path / "metrics.json").read_text())["counters"]["requests"] == 6
+
+
+def test_dedup_upload(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server()
+    index = DedupIndex(tmp_path / "index.sqlite3")
+    files = [tmp_path / "a.bin", tmp_path / "b.bin", tmp_path / "c.bin"]
+    data = urandom(3 * 10**4)
+    for file in files[:2]:
+        file.write_bytes(data)
+    files[2].write_bytes(urandom(10**3))
+    connection = MirrorAceConnection("key", "token", transport=server.transport, index=index)
+    first = trio.run(connection.upload_many, files[:1])
+    assert connection._check_success(first[0]) and server.requests["server_file"] == 3
+    connection = MirrorAceConnection("key", "token", transport=server.transport, index=index)
+    results = trio.run(connection.upload_many, files[1:])
+    # Only the new content was sent, the copy got the earlier upload's slug
+    assert server.requests["server_file"] == 4 and len(server.files) == 2
+    assert results[0].json()["result"]["slug"] == first[0].json()["result"]["slug"]
+    assert server.files[results[1].json()["result"]["slug"]]["data"] != data
+    index.close()
+
+
+def test_dedup_revalidate(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server()
+    index = DedupIndex(tmp_path / "index.sqlite3")
+    (tmp_path / "file.bin").write_bytes(urandom(10**3))
+
+    def _upload(revalidate: bool) -> httpx.Response:
+        connection = MirrorAceConnection("key", "token", transport=server.transport, index=index, revalidate=revalidate)
+        return trio.run(connection.upload_many, [tmp_path / "file.bin"])[0]
+
+    slug = _upload(False).json()["result"]["slug"]
+    del server.files[slug]
+    # Without revalidation the index is trusted, even though the upload is gone
+    assert _upload(False).json()["result"]["slug"] == slug
+    assert server.requests["server_file"] == 1 and server.requests["file/info"] == 0
+    result = _upload(True)
+    assert server.requests["file/info"] == 1 and server.requests["server_file"] == 2
+    assert server.files[result.json()["result"]["slug"]]["data"] == (tmp_path / "file.bin").read_bytes()
+    # Uploads that still exist are skipped once checked
+    assert _upload(True).json() == result.json()
+    assert server.requests["file/info"] == 2 and server.requests["server_file"] == 2
+    index.close()
+
+
+def test_file_info(monkeypatch: pytest.MonkeyPatch, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server(latency=0.01)
+    for i in range(5):
+        server.files[f"slug{i}"] = {"name": f"file{i}", "size": i}
+    in_flight = [0, 0]
+
+    async def _handle(request: httpx.Request) -> httpx.Response:
+        if b"down" in request.content:
+            raise httpx.ConnectError("unreachable", request=request)
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        try:
+            return await server.handle(request)
+        finally:
+            in_flight[0] -= 1
+
+    connection = MirrorAceConnection(
+        "key", "token", transport=httpx.MockTransport(_handle), info_batch_size=2, info_concurrency=2, info_ttl=60
+    )
+    batches = []
+    slugs = ["slug0", "slug1", "slug2", "slug1", "slug3", "gone"]
+    req = trio.run(connection.get_file_info, slugs, batches.append)
+    # Duplicates are asked about once, in batches of 2, no more than 2 of them at a time
+    assert server.requests["file/info"] == 3 and in_flight[1] == 2
+    assert sorted(len(batch) for batch in batches) == [1, 2, 2]
+    result = req.json()["result"]
+    assert set(result) == set(slugs)
+    assert result["slug3"]["name"] == "file3" and result["gone"]["status"] == "not found"
+    # Cached results are given without asking again, and only the rest is fetched
+    batches.clear()
+    req = trio.run(connection.get_file_info, ["slug0", "slug4"], batches.append)
+    assert server.requests["file/info"] == 4
+    assert batches == [{"slug0": result["slug0"]}, {"slug4": req.json()["result"]["slug4"]}]
+    now = time.time()
+    monkeypatch.setattr(mirror_ace.time, "time", lambda: now + 61)
+    trio.run(connection.get_file_info, ["slug0"])
+    assert server.requests["file/info"] == 5
+    # A batch that can't be sent fails the whole lookup, without stopping the other batches
+    batches.clear()
+    assert trio.run(connection.get_file_info, ["slug3", "down", "slug4", "slug2"], batches.append) is None
+    assert [set(batch) for batch in batches] == [{"slug4", "slug2"}]
+    trio.run(connection.Client.aclose)
+
+
+def test_cli_info(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture, fake_server: Callable
+) -> None:  # noqa: D103
+    server = fake_server()
+    server.files.update({"slug0": {"name": "file0", "size": 0}, "slug1": {"name": "file1", "size": 1}})
+    monkeypatch.setenv("MirAce_K", "key")
+    monkeypatch.setenv("MirAce_T", "token")
+    monkeypatch.setattr(TransportConfig, "transport", lambda self: server.transport)
+
+    def _info(slugs: list, from_file: Optional[str] = None) -> list:
+        mirror_ace_cli.info(slugs, from_file, batch_size=1, concurrency=4, session_cache=False, verbose=0)
+        return sorted((json.loads(line) for line in capsys.readouterr().out.splitlines()), key=lambda i: i["slug"])
+
+    stdin = io.StringIO("slug0\n\nslug1\n")
+    monkeypatch.setattr(sys, "stdin", stdin)
+    assert [(i["slug"], i["name"]) for i in _info([])] == [("slug0", "file0"), ("slug1", "file1")]
+    assert not stdin.closed
+    (tmp_path / "slugs.txt").write_text("slug1\n")
+    assert [i["slug"] for i in _info(["missing"], tmp_path / "slugs.txt")] == ["missing", "slug1"]
+    monkeypatch.setattr(sys, "stdin", io.StringIO("slug0\n"))
+    assert [i["status"] for i in _info(["slug1"], "-")] == ["active", "active"]
+    # Waiting on a terminal for slugs that will never come is an error instead
+    monkeypatch.setattr(sys.stdin, "isatty", lambda: True)
+    with pytest.raises(typer.BadParameter):
+        _info([])
+
+
+def test_cli_report_rejected(
+    tmp_path: Path, capsys: pytest.CaptureFixture, fake_server: Callable
+) -> None:  # noqa: D103
+    server = fake_server()
+    files = [tmp_path / "bad.bin", tmp_path / "good.bin"]
+    for file in files:
+        file.write_bytes(urandom(10**3))
+
+    async def _handle(request: httpx.Request) -> httpx.Response:
+        if b'filename="bad.bin"' in request.content:
+            return FakeMirrorAce._error("Invalid file")
+        return await server.handle(request)
+
+    connection = MirrorAceConnection("key", "token", transport=httpx.MockTransport(_handle))
+    mirror_ace_cli.upload_logic(connection, files, False, None, False)
+    # The rejected file is reported, and the next one still gets its link
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].startswith("Upload failed:") and "Invalid file" in out[0]
+    assert out[1] == "https://fake/" + next(iter(server.files))
+
+
+@pytest.mark.parametrize("size", [10**3, 5 * 10**4 + 1, 2 * 10**5 + 7])
+def test_checksum(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable, size: int
+) -> None:  # noqa: D103
+    server = fake_server()
+    recorder = MetricsRecorder()
+    connection = MirrorAceConnection("key", "token", transport=server.transport, metrics=recorder, checksum="sha256")
+    (tmp_path / "file.bin").write_bytes(urandom(size))
+    result = trio.run(connection, tmp_path / "file.bin")
+    # Every byte was read once, for the upload and its digest alike
+    assert recorder.counters["bytes_read"] == size
+    for req in result if isinstance(result, list) else [result]:
+        data = server.files[req.json()["result"]["slug"]]["data"]
+        assert req.json()["result"]["checksum"] == f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+    # MirrorAce ending up with fewer bytes than were sent fails the upload
+    server = fake_server()
+    complete = server._complete
+    monkeypatch.setattr(server, "_complete", lambda name, size, data: complete(name, size - 1, data))
+    connection = MirrorAceConnection("key", "token", transport=server.transport, checksum="blake2b")
+    with pytest.raises(UploadError):
+        trio.run(connection, tmp_path / "file.bin")
+
+
+@pytest.mark.parametrize(
+    "http2", [False, pytest.param(True, marks=pytest.mark.skipif(not http2_available(), reason="no h2"))]
+)
+def test_transport_config(tmp_path: Path, fake_server: Callable, http2: bool) -> None:  # noqa: D103
+    server = fake_server()
+    data = urandom(2 * 10**5 + 3)
+    (tmp_path / "file.bin").write_bytes(data)
+    # A single connection, which HTTP/2 multiplexes every chunk over
+    config = TransportConfig(http2=http2, http1=not http2, max_connections=1, write_timeout=60, send_buffer=2**20)
+
+    async def _upload() -> list:
+        async with anyio.create_task_group() as task_group:
+            port = await task_group.start(server.serve)
+            connection = MirrorAceConnection(
+                "key", "token", transport=LocalTransport(config.transport(), port), transport_config=config
+            )
+            assert connection.Client.timeout.write == 60
+            result = await connection(tmp_path / "file.bin")
+            task_group.cancel_scope.cancel()
+        return result
+
+    result = trio.run(_upload)
+    assert b"".join(server.files[req.json()["result"]["slug"]]["data"] for req in result) == data
+
+
+def test_socket_buffers_unavailable(monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    assert socket_buffers_available()
+
+    class _Transport(httpx.AsyncHTTPTransport):
+        # Like an httpx whose connection pool keeps its network backend elsewhere
+        def __init__(self, *args, **kwargs) -> None:  # noqa: D107
+            super().__init__(*args, **kwargs)
+            del self._pool._network_backend
+
+    monkeypatch.setattr(httpx, "AsyncHTTPTransport", _Transport)
+    assert not socket_buffers_available()
+    with pytest.raises(ValueError, match="Socket buffers"):
+        TransportConfig(receive_buffer=2**20)
+    assert TransportConfig().transport()
+    monkeypatch.setitem(mirror_ace_cli.transport_options, "send_buffer", 2**20)
+    with pytest.raises(typer.BadParameter):
+        mirror_ace_cli.transport_config()
+
+
+def test_plan(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server()
+    history = ThroughputHistory(tmp_path / "history.json")
+    paths = []
+    for name, size in (("small.bin", 10**3), ("chunked.bin", 5 * 10**4 + 1), ("split.bin", 2 * 10**5 + 7)):
+        (tmp_path / name).write_bytes(urandom(size))
+        paths.append(tmp_path / name)
+    (tmp_path / "folder").mkdir()
+    (tmp_path / "folder" / "file.bin").write_bytes(urandom(3 * 10**4))
+    paths.append(tmp_path / "folder")
+    connection = MirrorAceConnection("key", "token", transport=server.transport, history=history)
+    plans = trio.run(connection.plan, paths + [tmp_path / "missing"])
+    assert [(plan.route, plan.volumes) for plan in plans] == [
+        ("simple", 1),
+        ("chunked", 1),
+        ("split", 3),
+        ("chunked", 1),
+    ]
+    assert plans[3].archive and plans[3].name == "folder.tar"
+    assert not any(plan.temp_bytes for plan in plans)
+    assert history.estimate(10**6) is None
+
+    # Uploading takes the requests and bytes that were planned, and measures how long they took
+    connection = MirrorAceConnection("key", "token", transport=server.transport, history=history)
+    trio.run(connection.upload_many, paths)
+    assert server.requests["server_file"] == sum(plan.requests for plan in plans)
+    assert history.runs[0]["bytes"] == sum(plan.size for plan in plans)
+    assert ThroughputHistory(tmp_path / "history.json").estimate(10**6) > 0
+    # Archived then split into ZIP_SAVE, the tar and its volumes are both on disk at once
+    assert plan_upload(tmp_path / "folder", 10**4, 10**4, False, False).temp_bytes == 2 * plans[3].size
+
+
+def test_pack_files(tmp_path: Path) -> None:  # noqa: D103
+    # Names past 100 characters need an extra long name header
+    sizes = {f"file{i:02d}" + "n" * (i * 12): i * 100 for i in range(20)}
+    for name, size in sizes.items():
+        (tmp_path / name).write_bytes(urandom(size))
+    bundles = pack_files(list(sizes.items()), 32 * 1024)
+    assert [name for bundle in bundles for name in bundle] == list(sizes)
+    index = BundleIndex(tmp_path / "index.sqlite3")
+    for i, bundle in enumerate(bundles):
+        with TarStream(files=[(tmp_path / name, name) for name in bundle]) as stream:
+            assert stream.size <= 32 * 1024
+            archive = stream.read()
+        index.add(f"slug{i}", f"bundle{i}", [(tmp_path / name, *stream.members[name]) for name in bundle])
+    last = tmp_path / list(sizes)[-1]
+    entry = index.lookup(last)
+    assert entry["slug"] == f"slug{len(bundles) - 1}" and entry["size"] == 1900
+    assert archive[entry["offset"] : entry["offset"] + entry["size"]] == last.read_bytes()
+
+
+def test_packed_upload(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server(max_chunk_size=10**4, max_file_size=3 * 10**4)
+    folder = tmp_path / "folder"
+    (folder / "sub").mkdir(parents=True)
+    small = [folder / f"file{i:02d}.txt" for i in range(30)] + [folder / "sub" / "nested.txt"]
+    for i, file in enumerate(small):
+        file.write_bytes(urandom(100 * i + 1))
+    (folder / "large.bin").write_bytes(urandom(5 * 10**3))
+    index = BundleIndex(tmp_path / "index.sqlite3")
+    connection = MirrorAceConnection("key", "token", transport=server.transport)
+    results = trio.run(connection.upload_packed, folder, None, 4, None, 4096, index)
+    bundles = sorted(name for name in results if name.endswith(".tar"))
+    assert len(bundles) > 1 and bundles[0] == "folder.bundle0001.tar"
+    assert all(connection._check_success(req) for req in results.values())
+    # Every small file can be read back from its bundle, the large one went on its own
+    assert index.lookup(folder / "large.bin") is None
+    assert server.files[results["large.bin"].json()["result"]["slug"]]["data"] == (folder / "large.bin").read_bytes()
+    for file in small:
+        entry = index.lookup(file)
+        assert entry["bundle"] in bundles and results[entry["bundle"]].json()["result"]["slug"] == entry["slug"]
+        assert (
+            server.files[entry["slug"]]["data"][entry["offset"] : entry["offset"] + entry["size"]] == file.read_bytes()
+        )
+    index.close()
+    # A failed handshake still closes the client, under another key so no cached session is reused
+    failing = MirrorAceConnection("other", "token", transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+    with pytest.raises(mirror_ace.SessionError):
+        trio.run(failing.upload_packed, folder)
+    assert failing.Client.is_closed
+
+
+def test_compress_stream(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:  # noqa: D103
+    monkeypatch.setattr(_compress, "BLOCK_SIZE", 10**4)
+    data = b"".join(b"line %d\n" % i for i in range(10**4))
+    source = io.BytesIO(data + b"trailing bytes")
+    target = io.BytesIO()
+    assert _compress.compress_stream(source, len(data), target, "gzip", workers=2) == len(target.getvalue())
+    assert gzip.decompress(target.getvalue()) == data
+    assert source.read() == b"trailing bytes"
+    (tmp_path / "photo.jpg").write_bytes(data)
+    (tmp_path / "disguised.bin").write_bytes(gzip.compress(data))
+    (tmp_path / "plain.txt").write_bytes(data)
+    assert _compress.is_compressed(tmp_path / "photo.jpg")
+    assert _compress.is_compressed(tmp_path / "disguised.bin")
+    assert not _compress.is_compressed(tmp_path / "plain.txt")
+
+
+def test_compressed_upload(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable
+) -> None:  # noqa: D103
+    monkeypatch.setattr(_compress, "BLOCK_SIZE", 10**4)
+    server = fake_server()
+    files = {tmp_path / f"file{i}.txt": b"".join(b"line %d of %d\n" % (j, i) for j in range(10**4)) for i in range(2)}
+    for file, data in files.items():
+        file.write_bytes(data)
+    (tmp_path / "noise.txt").write_bytes(urandom(5 * 10**4))
+    buffers = BufferPool(3 * 10**4)
+    recorder = MetricsRecorder()
+    connection = MirrorAceConnection(
+        "key", "token", transport=server.transport, compression="gzip", buffers=buffers, metrics=recorder
+    )
+    results = trio.run(connection.upload_many, [*files, tmp_path / "noise.txt"])
+    for (file, data), req in zip(files.items(), results):
+        uploaded = server.files[req.json()["result"]["slug"]]
+        assert uploaded["name"] == f"{file.name}.gz" and gzip.decompress(uploaded["data"]) == data
+    # Random bytes don't shrink, so they go up as they are
+    assert server.files[results[2].json()["result"]["slug"]]["name"] == "noise.txt"
+    assert recorder.spans["compress"][0] == 3
+    # Blocks read ahead come out of the same memory limit as chunks, and the processes end with the connection
+    assert buffers.allocated <= buffers.limit and connection._executor is None
+
+
+@pytest.mark.parametrize("backend", ["trio", "asyncio"])
+def test_async_connection(tmp_path: Path, fake_server: Callable, backend: str) -> None:  # noqa: D103
+    server = fake_server()
+    files = {tmp_path / f"file{i}.bin": urandom(size) for i, size in enumerate([10**3, 5 * 10**4, 2 * 10**5])}
+    for file, data in files.items():
+        file.write_bytes(data)
+
+    async def _upload_concurrently() -> list:
+        async with await MirrorAceConnection.create("key", "token", transport=server.transport) as connection:
+            results = {}
+
+            async def _upload(file: Path) -> None:
+                results[file] = await connection(file)
+
+            async with anyio.create_task_group() as task_group:
+                for file in files:
+                    task_group.start_soon(_upload, file)
+            # Still open for more uploads
+            results["again"] = await connection.upload_many(list(files))
+        assert connection.Client.is_closed
+        return [results[file] for file in files] + results["again"]
+
+    results = anyio.run(_upload_concurrently, backend=backend)
+    for result, data in zip(results, [*files.values(), *files.values()]):
+        responses = result if isinstance(result, list) else [result]
+        assert b"".join(server.files[req.json()["result"]["slug"]]["data"] for req in responses) == data
+
+
+def test_session_renewed_mid_upload(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server(latency=0.01)
+    data = urandom(10**5)
+    (tmp_path / "file.bin").write_bytes(data)
+
+    async def _upload_while_renewing() -> httpx.Response:
+        async with MirrorAceConnection("key", "token", chunk_window=2, transport=server.transport) as connection:
+            result = []
+
+            async def _upload() -> None:
+                result.append(await connection(tmp_path / "file.bin"))
+
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(_upload)
+                # Like a watch worker renewing the session between files while another one is uploading
+                await anyio.sleep(0.03)
+                await connection._get_upload(refresh=True)
+            assert connection.params["upload_key"] == "key1"
+        return result[0]
+
+    req = trio.run(_upload_while_renewing)
+    # Every chunk went under the key the upload started with
+    assert server.requests["file/upload"] == 2
+    assert server.files[req.json()["result"]["slug"]]["data"] == data
+
+
+def test_session_rejected_mid_upload(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable
+) -> None:  # noqa: D103
+    server = fake_server()
+    data = urandom(10**5)
+    (tmp_path / "small.bin").write_bytes(b"small")
+    (tmp_path / "file.bin").write_bytes(data)
+    # The first upload's session gets cached, the second upload reuses it
+    trio.run(MirrorAceConnection("key", "token", transport=server.transport), tmp_path / "small.bin")
+    handle = server.handle
+
+    async def _expire_key0(request: httpx.Request) -> httpx.Response:
+        if server.requests["server_file"] == 4:
+            server._upload_keys.discard("key0")
+        return await handle(request)
+
+    monkeypatch.setattr(server, "handle", _expire_key0)
+    connection = MirrorAceConnection("key", "token", chunk_window=1, transport=server.transport)
+    req = trio.run(connection, tmp_path / "file.bin")
+    # Renewed once, then every chunk was sent again under the new key
+    assert server.requests["file/upload"] == 2
+    assert server.files[req.json()["result"]["slug"]]["data"] == data
+    assert server.requests["server_file"] == 1 + 4 + 10
+
+
+def test_session_expired_between_uploads(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server()
+    (tmp_path / "file.bin").write_bytes(b"data")
+
+    async def _upload_three() -> None:
+        async with MirrorAceConnection("key", "token", session_cache=False, transport=server.transport) as connection:
+            assert connection._check_success(await connection(tmp_path / "file.bin"))
+            # A freshly handshaken key revoked between two uploads is renewed, and the upload sent again
+            server._upload_keys.discard("key0")
+            assert connection._check_success(await connection(tmp_path / "file.bin"))
+            assert server.requests["file/upload"] == 2 and server.requests["server_file"] == 3
+            # One about to expire is renewed before anything is sent under it
+            connection.params["upload_key_expiry"] = str(int(time.time()) + 60)
+            assert connection._check_success(await connection(tmp_path / "file.bin"))
+            assert server.requests["file/upload"] == 3 and server.requests["server_file"] == 4
+            assert connection.params["upload_key"] == "key2"
+
+    trio.run(_upload_three)
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_watch(tmp_path: Path, fake_server: Callable, use_inotify: bool) -> None:  # noqa: D103
+    server = fake_server()
+    spool = tmp_path / "spool"
+    (spool / "sub").mkdir(parents=True)
+    (spool / "early.bin").write_bytes(b"early")
+    ledger_path = tmp_path / "ledger.jsonl"
+    watcher = FolderWatcher([spool], exclude=["*.part"], stable_for=0.2, poll_interval=0.05, use_inotify=use_inotify)
+
+    async def _watch_until(count: int) -> None:
+        connection = MirrorAceConnection("key", "token", handshake=False, transport=server.transport)
+        async with connection, anyio.create_task_group() as task_group:
+            task_group.start_soon(connection.watch, watcher, UploadLedger(ledger_path), None, 2)
+            await anyio.sleep(0.1)
+            (spool / "ignored.part").write_bytes(b"partial")
+            with open(spool / "sub" / "growing.bin", "wb") as f:
+                # Still being written to, so it mustn't be uploaded half done
+                for _ in range(4):
+                    f.write(urandom(10**4))
+                    f.flush()
+                    await anyio.sleep(0.1)
+            while len(ledger_path.read_text().splitlines()) < count:
+                await anyio.sleep(0.05)
+            task_group.cancel_scope.cancel()
+
+    anyio.run(_watch_until, 2, backend="trio")
+    entries = {Path(entry["path"]).name: entry for entry in map(json.loads, ledger_path.read_text().splitlines())}
+    assert set(entries) == {"early.bin", "growing.bin"}
+    assert all(entry["status"] == "uploaded" for entry in entries.values())
+    slug = entries["growing.bin"]["results"][0]["slug"]
+    assert server.files[slug]["data"] == (spool / "sub" / "growing.bin").read_bytes()
+
+    # A restart skips what the ledger has as uploaded, and picks up files changed since
+    (spool / "early.bin").write_bytes(b"changed")
+    anyio.run(_watch_until, 4, backend="trio")
+    names = [Path(json.loads(line)["path"]).name for line in ledger_path.read_text().splitlines()]
+    assert sorted(names[2:]) == ["early.bin", "growing.bin"]
+
+
+def test_connection_pool(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    files = [tmp_path / f"file{i}.bin" for i in range(6)]
+    for file in files:
+        file.write_bytes(urandom(3 * 10**4))
+    servers = [fake_server(latency=0.05) for _ in range(2)]
+    history = ThroughputHistory(tmp_path / "history.json")
+    pool = MirrorAcePool(
+        [
+            MirrorAceConnection(f"key{i}", "token", transport=server.transport, history=history)
+            for i, server in enumerate(servers)
+        ]
+    )
+    start = time.monotonic()
+    results = trio.run(pool.upload_many, files, None, len(files))
+    # Every file is placed before any is done, and they are all the same size, so each account gets half
+    assert [len(server.files) for server in servers] == [3, 3]
+    # Both accounts' uploads make up a single run, at their combined rate
+    assert len(history.runs) == 1 and history.runs[0]["bytes"] == 6 * 3 * 10**4
+    assert history.runs[0]["seconds"] <= time.monotonic() - start
+    uploaded = {file["name"]: file["data"] for server in servers for file in server.files.values()}
+    assert all(req.json()["result"]["name"] == file.name for file, req in zip(files, results))
+    assert all(uploaded[file.name] == file.read_bytes() for file in files)
+
+    # An account that can't start a session cools down, and its files go through the other one
+    servers = [fake_server() for _ in range(2)]
+    pool = MirrorAcePool(
+        [
+            MirrorAceConnection("key", "", transport=servers[0].transport),
+            MirrorAceConnection("key2", "token", transport=servers[1].transport),
+        ]
+    )
+    results = trio.run(pool.upload_many, files, None, 1)
+    assert all(req is not None and pool.connections[1]._check_success(req) for req in results)
+    assert len(servers[1].files) == len(files)
+    # It was only tried once, before cooling down
+    assert servers[0].requests["file/upload"] == 1
+
+
+def test_resume_sends_missing_ranges(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable
+) -> None:  # noqa: D103
+    data = urandom(10**5)
+    (tmp_path / "file.bin").write_bytes(data)
+    journal = UploadJournal(tmp_path / "journal.json")
+    server = fake_server()
+    handle = server.handle
+    sent = []
+    failing = True
+
+    async def _fail_sixth_chunk(request: httpx.Request) -> httpx.Response:
+        if "Content-Range" in request.headers:
+            if failing and request.headers["Content-Range"] == "bytes 50000-59999/100000":
+                return httpx.Response(503)
+            sent.append(request.headers["Content-Range"])
+        return await handle(request)
+
+    monkeypatch.setattr(server, "handle", _fail_sixth_chunk)
+    connection = MirrorAceConnection(
+        "key", "token", chunk_window=1, journal=journal, max_attempts=1, transport=server.transport
+    )
+    with pytest.raises(UploadError):
+        trio.run(connection, tmp_path / "file.bin")
+    assert len(sent) == 5
+    sent.clear()
+    failing = False
+    connection = MirrorAceConnection(
+        "key", "token", chunk_window=1, journal=journal, resume=True, transport=server.transport
+    )
+    result = trio.run(connection, tmp_path / "file.bin")
+    # Only the chunks from the failed one on are sent again, and the server pieces the whole file together
+    assert sorted(sent) == [f"bytes {start}-{start + 9999}/100000" for start in range(50000, 10**5, 10**4)]
+    assert server.files[result.json()["result"]["slug"]]["data"] == data
+
+
+def test_connection_pool_resume_other_account(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable
+) -> None:  # noqa: D103
+    data = urandom(10**5)
+    (tmp_path / "file.bin").write_bytes(data)
+    journal = UploadJournal(tmp_path / "journal.json")
+    server_a = fake_server()
+    handle = server_a.handle
+
+    async def _fail_sixth_chunk(request: httpx.Request) -> httpx.Response:
+        if request.headers.get("Content-Range") == "bytes 50000-59999/100000":
+            return httpx.Response(503)
+        return await handle(request)
+
+    monkeypatch.setattr(server_a, "handle", _fail_sixth_chunk)
+    connection = MirrorAceConnection(
+        "key_a", "token", chunk_window=1, journal=journal, max_attempts=1, transport=server_a.transport
+    )
+    with pytest.raises(UploadError):
+        trio.run(connection, tmp_path / "file.bin")
+    # The other account's server hands out the same key names, so resuming under account A's session would
+    # have it piece together a file out of chunks it never got
+    server_b = fake_server()
+    connection = MirrorAceConnection(
+        "key_b", "token", chunk_window=1, journal=journal, resume=True, transport=server_b.transport
+    )
+    pool = MirrorAcePool([connection])
+    (result,) = trio.run(pool.upload_many, [tmp_path / "file.bin"])
+    assert server_b.files[result.json()["result"]["slug"]]["data"] == data
+    assert server_b.requests["server_file"] == 10 and pool._failures == {0: 0}
+
+
+def test_connection_pool_local_error(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, fake_server: Callable
+) -> None:  # noqa: D103
+    files = [tmp_path / "locked.bin", tmp_path / "file.bin"]
+    for file in files:
+        file.write_bytes(urandom(10**3))
+
+    def _open(file: PathLike, *args, **kwargs) -> BinaryIO:
+        if Path(file).name == "locked.bin":
+            raise PermissionError(13, "Permission denied", str(file))
+        return open(file, *args, **kwargs)
+
+    monkeypatch.setattr(mirror_ace, "open", _open, raising=False)
+    servers = [fake_server() for _ in range(2)]
+    pool = MirrorAcePool(
+        [MirrorAceConnection(f"key{i}", "token", transport=server.transport) for i, server in enumerate(servers)]
+    )
+    results = trio.run(pool.upload_many, files, None, 1)
+    # A file that can't be read fails without being tried on the other account, or cooling the first one down
+    assert results[0] is None and pool.connections[0]._check_success(results[1])
+    assert sum(server.requests["server_file"] for server in servers) == 1
+    assert pool._failures == {0: 0, 1: 0}
+
+
+def test_deferred_handshake(tmp_path: Path, fake_server: Callable) -> None:  # noqa: D103
+    server = fake_server()
+    (tmp_path / "file.bin").write_bytes(b"data")
+
+    async def _info_then_upload() -> None:
+        async with MirrorAceConnection("key", "token", transport=server.transport) as connection:
+            await connection.get_file_info(["missing"])
+            assert server.requests["file/upload"] == 0
+            # Concurrent first uploads share a single handshake
+            await connection.upload_many([tmp_path / "file.bin"] * 3)
+
+    anyio.run(_info_then_upload, backend="trio")
+    assert server.requests["file/upload"] == 1
+    assert server.requests["server_file"] == 3
+
+
+def test_feature_imports() -> None:  # noqa: D103
+    # Plain uploads don't load the modules of optional features, nor what they depend on
+    imported = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, mirror_up.mirror_ace; print(*sorted({'mirror_up._compress', 'mirror_up._index', "
+            "'mirror_up._manifest', 'mirror_up._plan', 'mirror_up._watch', 'sqlite3', 'ctypes', 'zstandard'} "
+            "& set(sys.modules)))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    assert imported == []
+
+
+def test_cli_startup() -> None:  # noqa: D103
+    # Only a command that needs them imports the heavy and optional dependencies
+    imported = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, mirror_up.__main__; "
+            "print(*sorted({'httpx', 'anyio', 'trio', 'pyperclip', 'notifypy', 'format_byte'} & set(sys.modules)))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    assert imported == []
+    # Best of a few cold starts, so a busy machine doesn't fail the test
+    for command in (["--help"], ["info"]):
+        timings = []
+        for _ in range(3):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-m", "mirror_up", "mirror_ace", *command], check=True, capture_output=True, input=b""
+            )
+            timings.append(time.perf_counter() - start)
+        assert min(timings) < 1.0, f"{' '.join(command)} took {min(timings):.2f}s to start"
+
+
 # TODO Finish writing tests